@@ -0,0 +1,190 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from operator import itemgetter
+from typing import Optional
+
+import numpy as np
+
+# build_results ile aynı sonuç için tek GROUP BY: (kategori, işyeri, birim litre) grupları.
+# Grup sayısı kalem sayısından bağımsız küçük kalır; toplamlar gruplardan Python'da birleştirilir.
+AGGREGATE_SELECT = """
+    SELECT
+      COALESCE(NULLIF(i.category, ''), 'diger'),
+      COALESCE(NULLIF(COALESCE(m.canonical_name, r.merchant), ''), 'UNKNOWN'),
+      CASE WHEN i.liters_total IS NOT NULL THEN i.volume_l END,
+      COUNT(*),
+      SUM(i.amount),
+      SUM(i.qty),
+      COUNT(i.qty),
+      SUM(i.liters_total),
+      SUM(CASE WHEN i.liters_total IS NOT NULL THEN COALESCE(i.qty, 0) * COALESCE(NULLIF(i.pack_count, 0), 1) END),
+      SUM(i.kg_total),
+      SUM(i.unit_price),
+      COUNT(i.unit_price),
+      MIN(i.unit_price),
+      MAX(i.unit_price)
+"""
+
+def results_from_groups(groups) -> dict:
+    """
+    AGGREGATE_SELECT satırlarından (kategori, işyeri, birim litre, sayım, toplamlar...)
+    build_results ile aynı sonuç sözlüğü.
+    """
+    count, qty_n, price_n = 0, 0, 0
+    amount = qty = liters = kg = price_sum = 0.0
+    any_liters = any_kg = False
+    price_min: Optional[float] = None
+    price_max: Optional[float] = None
+    breakdown: dict[str, float] = {}
+    by_category: dict[str, float] = {}
+    by_merchant: dict[str, float] = {}
+
+    for cat, merchant, vol, n, amt, q, qn, lt, units, kgs, ps, pn, pmin, pmax in groups:
+        count += n
+        amount += amt or 0.0
+        qty += q or 0.0
+        qty_n += qn
+        by_category[cat] = by_category.get(cat, 0.0) + (amt or 0.0)
+        by_merchant[merchant] = by_merchant.get(merchant, 0.0) + (amt or 0.0)
+        if vol is not None:
+            any_liters = True
+            liters += lt or 0.0
+            key = f"{vol:g}l"
+            breakdown[key] = breakdown.get(key, 0.0) + (units or 0.0)
+        if kgs is not None:
+            any_kg = True
+            kg += kgs
+        if pn:
+            price_n += pn
+            price_sum += ps
+            price_min = pmin if price_min is None else min(price_min, pmin)
+            price_max = pmax if price_max is None else max(price_max, pmax)
+
+    return {
+        "matched_item_count": count,
+        "matched_total_amount_try": round(amount, 2),
+        "total_qty": round(qty, 3) if qty_n else None,
+        "times_purchased": count,
+        "total_liters_est": round(liters, 3) if any_liters else None,
+        "volume_breakdown_units": dict(sorted(breakdown.items(), key=lambda x: float(x[0][:-1]))),
+        "total_kg_est": round(kg, 3) if any_kg else None,
+        "unit_price_try": (
+            {"avg": round(price_sum / price_n, 2), "min": round(price_min, 2), "max": round(price_max, 2)}
+            if price_n else None
+        ),
+        "by_category_try": {k: round(v, 2) for k, v in sorted(by_category.items(), key=lambda x: -x[1])},
+        "by_merchant_try": {k: round(v, 2) for k, v in sorted(by_merchant.items(), key=lambda x: -x[1])},
+    }
+
+
+# Sütunlara alınan sayısal alanlar (None -> NaN), ardından kategori ve işyeri etiketi
+NUMERIC_FIELDS = ("amount", "qty", "pack_count", "volume_l", "liters_total", "kg_total", "unit_price")
+
+def _factorize(values) -> tuple[np.ndarray, list]:
+    # Değer -> ilk görülme sırasıyla kod
+    index: dict = {}
+    codes = np.fromiter((index.setdefault(v, len(index)) for v in values), dtype="int64", count=len(values))
+    return codes, list(index)
+
+
+@dataclass
+class ItemColumns:
+    """
+    Kalem kümesinin sütun dizileri: sayısal alanlar (NaN = yok), kategori/işyeri
+    kodları ve birim litre kodu (0 = litre bilgisi yok, k = vols[k - 1]).
+    """
+    numeric: np.ndarray  # (len(NUMERIC_FIELDS), n): alan başına bitişik satır
+    category: np.ndarray
+    categories: list[str]
+    merchant: np.ndarray
+    merchants: list[str]
+    vol: np.ndarray
+    vols: np.ndarray
+
+    @classmethod
+    def from_rows(cls, rows: list[tuple]) -> "ItemColumns":
+        """(sayısal alanlar..., kategori, işyeri) satırlarından."""
+        n, k = len(rows), len(NUMERIC_FIELDS)
+        cols = list(zip(*rows)) if rows else [()] * (k + 2)
+        numeric = np.array(cols[:k], dtype="float64").reshape(k, n)
+        category, categories = _factorize(cols[k])
+        merchant, merchants = _factorize(cols[k + 1])
+        vol_l, liters = numeric[NUMERIC_FIELDS.index("volume_l")], numeric[NUMERIC_FIELDS.index("liters_total")]
+        has_liters = ~np.isnan(liters) & ~np.isnan(vol_l)
+        vols, vol = np.unique(vol_l[has_liters], return_inverse=True)
+        vol_code = np.zeros(n, dtype="int64")
+        vol_code[has_liters] = vol.reshape(-1) + 1
+        return cls(numeric, category, categories, merchant, merchants, vol_code, vols)
+
+    @classmethod
+    def from_items(cls, items: list[dict]) -> "ItemColumns":
+        get = itemgetter(*NUMERIC_FIELDS)
+        return cls.from_rows([(*get(it), it.get("category") or "diger", it.get("merchant") or "UNKNOWN") for it in items])
+
+    def groups(self) -> list[tuple]:
+        """AGGREGATE_SELECT ile aynı (kategori, işyeri, birim litre) grup satırları."""
+        missing = np.isnan(self.numeric)
+        amount, qty, pack, _, liters, kg, price = np.where(missing, 0.0, self.numeric)
+        seen = dict(zip(NUMERIC_FIELDS, ~missing))
+        nv = len(self.vols) + 1
+        key = (self.category * len(self.merchants) + self.merchant) * nv + self.vol
+        # Anahtar uzayı küçük (kategori x işyeri x hacim): sıralama yerine yoğun kodlama
+        space = len(self.categories) * len(self.merchants) * nv
+        if space <= 4 * len(key) + 1024:
+            keys = np.flatnonzero(np.bincount(key, minlength=space))
+            dense = np.zeros(space, dtype="int64")
+            dense[keys] = np.arange(len(keys))
+            g = dense[key]
+        else:
+            keys, g = np.unique(key, return_inverse=True)
+            g = g.reshape(-1)
+        ng = len(keys)
+
+        def total(x: np.ndarray) -> np.ndarray:
+            return np.bincount(g, weights=x, minlength=ng)
+
+        def present(name: str) -> np.ndarray:
+            return np.bincount(g, weights=seen[name], minlength=ng)
+
+        units = np.where(self.vol > 0, qty * np.where(pack == 0, 1.0, pack), 0.0)
+        has_price = seen["unit_price"]
+        pmin = np.full(ng, np.inf)
+        pmax = np.full(ng, -np.inf)
+        np.minimum.at(pmin, g[has_price], price[has_price])
+        np.maximum.at(pmax, g[has_price], price[has_price])
+
+        n, amount_s, amount_n = np.bincount(g, minlength=ng), total(amount), present("amount")
+        qty_s, qty_n = total(qty), present("qty")
+        liters_s, units_s = total(liters), total(units)
+        kg_s, kg_n, price_s, price_n = total(kg), present("kg_total"), total(price), present("unit_price")
+        out = []
+        for j, k in enumerate(keys.tolist()):
+            rest, v = divmod(k, nv)
+            c, m = divmod(rest, len(self.merchants))
+            out.append((
+                self.categories[c], self.merchants[m], float(self.vols[v - 1]) if v else None,
+                int(n[j]),
+                float(amount_s[j]) if amount_n[j] else None,
+                float(qty_s[j]) if qty_n[j] else None,
+                int(qty_n[j]),
+                float(liters_s[j]) if v else None,
+                float(units_s[j]) if v else None,
+                float(kg_s[j]) if kg_n[j] else None,
+                float(price_s[j]) if price_n[j] else None,
+                int(price_n[j]),
+                float(pmin[j]) if price_n[j] else None,
+                float(pmax[j]) if price_n[j] else None,
+            ))
+        return out
+
+
+def aggregate_items(items: list[dict]) -> dict:
+    """
+    Bellekteki kalem kümesinin (retrieval/terim eşleşmeleri) sonuç sözlüğü; SQL
+    yolundaki ItemPlan.aggregate ile aynı. Sütunlar çağıranın zaten okuduğu kalem
+    sözlüklerinden çıkarılır, toplamlar NumPy ile grup başına hesaplanır.
+    """
+    if not items:
+        return results_from_groups([])
+    return results_from_groups(ItemColumns.from_items(items).groups())
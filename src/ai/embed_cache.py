@@ -0,0 +1,185 @@
+"""
+Embedding Cache - (model, metin) hash'i ile kalıcı embedding deposu
+"""
+from __future__ import annotations
+
+import hashlib
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Callable, Optional
+
+import numpy as np
+
+EncodeFn = Callable[[list[str]], np.ndarray]
+
+# SQLite IN (...) parametre sınırının altında kalan sorgu parçası
+_LOOKUP_CHUNK = 900
+
+class EmbeddingCache:
+    """
+    Vektörler model başına tek bir float32 dosyasına satır satır eklenir ve
+    memory-map ile okunur; sha1(model + metin) -> satır numarası eşlemesi
+    küçük bir SQLite ofset tablosunda tutulur. Sadece daha önce görülmemiş
+    metinler encode edilir. Aynı dizini kullanan süreçler (indeks kurulumu,
+    kNN zenginleştirme, EmbedPool) satırlarını ofset veritabanındaki yazma
+    kilidi altında ayırır.
+    """
+
+    def __init__(self, root: str = "data/emb_cache"):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.db_path = self.root / "offsets.sqlite"
+        self._lock = threading.Lock()
+        self._maps: dict[str, np.memmap] = {}
+        self._init_db()
+
+    def _connect(self) -> sqlite3.Connection:
+        # Diğer süreçlerin satır ayırması bitene kadar beklenir
+        return sqlite3.connect(str(self.db_path), timeout=60)
+
+    def _init_db(self):
+        conn = self._connect()
+        conn.executescript("""
+            -- rows: dosyada ayrılmış satır sayısı (NULL: eski kayıt, dosya boyutundan okunur)
+            CREATE TABLE IF NOT EXISTS emb_models (
+                model TEXT PRIMARY KEY,
+                file TEXT NOT NULL,
+                dim INTEGER NOT NULL,
+                rows INTEGER
+            );
+            CREATE TABLE IF NOT EXISTS emb_offsets (
+                key BLOB PRIMARY KEY,
+                row INTEGER NOT NULL
+            ) WITHOUT ROWID;
+        """)
+        if "rows" not in {r[1] for r in conn.execute("PRAGMA table_info(emb_models)")}:
+            conn.execute("ALTER TABLE emb_models ADD COLUMN rows INTEGER")
+        conn.commit()
+        conn.close()
+
+    @staticmethod
+    def _key(model: str, text: str) -> bytes:
+        return hashlib.sha1(f"{model}\0{text}".encode("utf-8")).digest()
+
+    def _model_file(self, conn: sqlite3.Connection, model: str) -> tuple[Optional[Path], int]:
+        row = conn.execute("SELECT file, dim FROM emb_models WHERE model = ?", (model,)).fetchone()
+        if row is None:
+            return None, 0
+        return self.root / row[0], int(row[1])
+
+    def _rows_in_file(self, path: Path, dim: int) -> int:
+        return path.stat().st_size // (dim * 4) if path.exists() else 0
+
+    def _matrix(self, path: Path, dim: int, min_rows: int) -> np.memmap:
+        """Dosyanın memmap görünümü (dosya büyüdüyse yeniden açılır)."""
+        mm = self._maps.get(str(path))
+        if mm is None or mm.shape[0] < min_rows:
+            rows = self._rows_in_file(path, dim)
+            mm = np.memmap(path, dtype="float32", mode="r", shape=(rows, dim))
+            self._maps[str(path)] = mm
+        return mm
+
+    def lookup(self, model: str, texts: list[str]) -> dict[str, int]:
+        """Cache'te bulunan metinler için metin -> satır numarası."""
+        conn = self._connect()
+        try:
+            uniq = list(dict.fromkeys(texts))
+            key_to_text = {self._key(model, t): t for t in uniq}
+            keys = list(key_to_text)
+            found: dict[str, int] = {}
+            for start in range(0, len(keys), _LOOKUP_CHUNK):
+                part = keys[start : start + _LOOKUP_CHUNK]
+                q = ",".join(["?"] * len(part))
+                for key, row in conn.execute(f"SELECT key, row FROM emb_offsets WHERE key IN ({q})", part):
+                    found[key_to_text[key]] = int(row)
+            return found
+        finally:
+            conn.close()
+
+    def encode(self, model: str, texts: list[str], encode_fn: EncodeFn) -> np.ndarray:
+        """
+        texts için (len(texts), dim) float32 matris döndürür. Cache'te olmayan
+        farklı metinler tek çağrıda encode_fn ile hesaplanıp dosyaya eklenir.
+        """
+        if not texts:
+            return np.zeros((0, 0), dtype="float32")
+
+        found = self.lookup(model, texts)
+        missing = [t for t in dict.fromkeys(texts) if t not in found]
+
+        fresh: dict[str, np.ndarray] = {}
+        if missing:
+            emb = np.ascontiguousarray(np.asarray(encode_fn(missing), dtype="float32"))
+            self._append(model, missing, emb)
+            fresh = {t: emb[i] for i, t in enumerate(missing)}
+
+        conn = self._connect()
+        path, dim = self._model_file(conn, model)
+        conn.close()
+
+        out = np.empty((len(texts), dim), dtype="float32")
+        cached_pos = [i for i, t in enumerate(texts) if t not in fresh]
+        if cached_pos:
+            rows = np.asarray([found[texts[i]] for i in cached_pos], dtype="int64")
+            with self._lock:
+                mm = self._matrix(path, dim, int(rows.max()) + 1)
+            out[cached_pos] = mm[rows]
+        for i, t in enumerate(texts):
+            v = fresh.get(t)
+            if v is not None:
+                out[i] = v
+        return out
+
+    def _append(self, model: str, texts: list[str], emb: np.ndarray) -> None:
+        with self._lock:
+            conn = self._connect()
+            try:
+                # Süreçler arası kilit: satır sayısı okunup artırılana kadar başka yazar giremez
+                conn.execute("BEGIN IMMEDIATE")
+                row = conn.execute("SELECT file, dim, rows FROM emb_models WHERE model = ?", (model,)).fetchone()
+                if row is None:
+                    dim = int(emb.shape[1])
+                    name = hashlib.sha1(model.encode("utf-8")).hexdigest()[:12] + f"_{dim}.f32"
+                    conn.execute("INSERT INTO emb_models (model, file, dim, rows) VALUES (?, ?, ?, 0)", (model, name, dim))
+                    path, start = self.root / name, 0
+                else:
+                    path, dim = self.root / row[0], int(row[1])
+                    start = row[2] if row[2] is not None else self._rows_in_file(path, dim)
+                if emb.shape[1] != dim:
+                    raise ValueError(f"Embedding boyutu değişti ({model}: {dim} -> {emb.shape[1]})")
+
+                # Önce vektörler ayrılan satırlara, sonra ofsetler yazılır; yarıda kalan
+                # ekleme sadece sahipsiz satır bırakır (bir sonraki ekleme üzerine yazar)
+                with path.open("r+b" if path.exists() else "w+b") as f:
+                    f.seek(start * dim * 4)
+                    f.write(emb.tobytes())
+                conn.execute("UPDATE emb_models SET rows = ? WHERE model = ?", (start + len(texts), model))
+                conn.executemany(
+                    "INSERT OR REPLACE INTO emb_offsets (key, row) VALUES (?, ?)",
+                    [(self._key(model, t), start + i) for i, t in enumerate(texts)],
+                )
+                conn.commit()
+            finally:
+                conn.close()
+
+    def get_stats(self) -> dict:
+        """Cache istatistikleri"""
+        conn = self._connect()
+        total = conn.execute("SELECT COUNT(*) FROM emb_offsets").fetchone()[0]
+        models = conn.execute("SELECT model, file, dim FROM emb_models").fetchall()
+        conn.close()
+        return {
+            "total_vectors": total,
+            "models": {m: {"dim": d, "rows": self._rows_in_file(self.root / f, d)} for m, f, d in models},
+        }
+
+# Global instance
+_emb_cache = None
+
+def get_embedding_cache() -> EmbeddingCache:
+    """Singleton embedding cache"""
+    global _emb_cache
+    if _emb_cache is None:
+        _emb_cache = EmbeddingCache()
+    return _emb_cache
@@ -0,0 +1,359 @@
+"""
+Embedder - Metin embedding backend'leri (PyTorch / ONNX Runtime)
+"""
+from __future__ import annotations
+
+import os
+import sys
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+# Multilingual embedding modeli (yerelde cache'lenir)
+EMB_MODEL_NAME = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+
+# auto | torch | onnx  (auto: export edilmiş ONNX modeli varsa onu kullanır)
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "auto")
+# ONNX backend'de int8 quantize modeli tercih et
+EMBED_QUANTIZED = os.getenv("EMBED_QUANTIZED", "1") != "0"
+ONNX_DIR = Path(os.getenv("EMBED_ONNX_DIR", "models/minilm-onnx"))
+ONNX_FP32_FILE = "model.onnx"
+ONNX_INT8_FILE = "model_int8.onnx"
+
+# Paralel encode (EmbedPool): süreç sayısı (auto: çekirdek / süreç başına thread, en fazla
+# EMBED_MAX_WORKERS) ve her sürecin kullanacağı thread. Her süreç modelin kendi kopyasını yükler
+# (torch ~0.5 GB, ONNX int8 ~0.15 GB).
+EMBED_WORKERS = os.getenv("EMBED_WORKERS", "auto")
+EMBED_WORKER_THREADS = int(os.getenv("EMBED_WORKER_THREADS", "2"))
+EMBED_MAX_WORKERS = 8
+
+# Modelin eğitimdeki maksimum token uzunluğu
+MAX_SEQ_LEN = 128
+# Parity kontrolünde ONNX ve PyTorch vektörleri arasında kabul edilen en düşük kosinüs
+PARITY_MIN_COSINE = 0.98
+
+# Parity örnekleri: indekslenen vocab anahtarları (name_norm, category, merchant) ve sorgular
+PARITY_KEYS = [
+    ("sut 1l", "gida", "A101"),
+    ("kola 2.5l", "su_icecek", "MIGROS"),
+    ("bulasik deterjani 1.5kg", "temizlik", "BIM"),
+    ("yumurta 30lu", "gida", "SOK"),
+    ("dis macunu", "kisisel_bakim", "CARREFOURSA"),
+    ("peynir", "gida", ""),
+]
+PARITY_QUERIES = [
+    "süt", "ekmek", "şampuan", "tuvalet kağıdı 32li", "maden suyu 6x200ml",
+    "Mart ayında süte ne kadar harcadım?",
+    "Geçen ay kaç litre su aldım?",
+    "temizlik ürünlerine toplam harcama",
+    "en pahalı peynir hangi marketteydi",
+]
+
+def parity_samples() -> list[str]:
+    """Kontrol metinleri: anahtarlar indeksin embed ettiği biçimde (index_faiss.build_doc_text)."""
+    # index_faiss bu modülü içe aktarır; döngüsel import olmasın diye burada
+    from ..index_faiss import build_doc_text
+    return [build_doc_text(k) for k in PARITY_KEYS] + PARITY_QUERIES
+
+
+def _normalize(x: np.ndarray) -> np.ndarray:
+    n = np.linalg.norm(x, axis=1, keepdims=True)
+    n[n == 0] = 1.0
+    return (x / n).astype("float32", copy=False)
+
+
+class Embedder(ABC):
+    """Ortak arayüz: encode() L2-normalize float32 matris döndürür."""
+
+    # Embedding cache ve indeks manifest'inde kullanılan kimlik (backend farkı dahil)
+    name: str = EMB_MODEL_NAME
+    backend: str = ""
+
+    @abstractmethod
+    def encode(self, texts: list[str], batch_size: int = 64) -> np.ndarray:
+        ...
+
+
+class TorchEmbedder(Embedder):
+    """sentence-transformers (PyTorch, float32) backend'i"""
+
+    backend = "torch"
+
+    def __init__(self, model_name: str = EMB_MODEL_NAME):
+        from sentence_transformers import SentenceTransformer
+
+        threads = os.getenv("EMBED_THREADS")
+        if threads:
+            import torch
+            torch.set_num_threads(int(threads))
+        self.name = model_name
+        self.model = SentenceTransformer(model_name)
+
+    def encode(self, texts: list[str], batch_size: int = 64) -> np.ndarray:
+        emb = self.model.encode(
+            texts, normalize_embeddings=True, batch_size=batch_size, show_progress_bar=len(texts) > 1000
+        )
+        return np.asarray(emb, dtype="float32")
+
+
+class OnnxEmbedder(Embedder):
+    """
+    ONNX Runtime backend'i (CPU). Tokenizer 'tokenizers' kütüphanesinden,
+    pooling (mean) ve normalizasyon numpy ile yapılır; torch import edilmez.
+    """
+
+    backend = "onnx"
+
+    def __init__(self, model_dir: Path = ONNX_DIR, quantized: bool = EMBED_QUANTIZED):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        path = model_dir / (ONNX_INT8_FILE if quantized else ONNX_FP32_FILE)
+        if quantized and not path.exists():
+            path = model_dir / ONNX_FP32_FILE
+            quantized = False
+        if not path.exists():
+            raise FileNotFoundError(f"ONNX modeli bulunamadı: {path} (önce: python -m src.ai.embedder export)")
+
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        opts.intra_op_num_threads = int(os.getenv("EMBED_THREADS", str(os.cpu_count() or 4)))
+        self.session = ort.InferenceSession(str(path), opts, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+        self.tokenizer = Tokenizer.from_file(str(model_dir / "tokenizer.json"))
+        self.tokenizer.enable_truncation(MAX_SEQ_LEN)
+        pad_id = self.tokenizer.token_to_id("<pad>")
+        self.tokenizer.enable_padding(pad_id=pad_id if pad_id is not None else 0, pad_token="<pad>")
+
+        self.quantized = quantized
+        # Farklı backend'in vektörleri cache'te karışmasın
+        self.name = _onnx_name(quantized)
+
+    def encode(self, texts: list[str], batch_size: int = 64) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, 0), dtype="float32")
+        # Benzer uzunluktaki metinler aynı batch'e düşsün (daha az padding)
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        out: Optional[np.ndarray] = None
+        for start in range(0, len(order), batch_size):
+            idx = order[start : start + batch_size]
+            enc = self.tokenizer.encode_batch([texts[i] for i in idx])
+            ids = np.asarray([e.ids for e in enc], dtype="int64")
+            mask = np.asarray([e.attention_mask for e in enc], dtype="int64")
+            feeds = {"input_ids": ids, "attention_mask": mask}
+            if "token_type_ids" in self.input_names:
+                feeds["token_type_ids"] = np.zeros_like(ids)
+            hidden = self.session.run(None, feeds)[0]
+            m = mask[..., None].astype("float32")
+            pooled = (hidden * m).sum(axis=1) / np.clip(m.sum(axis=1), 1e-9, None)
+            if out is None:
+                out = np.empty((len(texts), pooled.shape[1]), dtype="float32")
+            out[idx] = _normalize(pooled)
+        return out
+
+
+def export_onnx(out_dir: Path = ONNX_DIR, quantize: bool = True) -> Path:
+    """
+    Tek seferlik: PyTorch modelini ONNX'e çevirir, istenirse int8 dinamik
+    quantize eder. (Sadece export için torch/transformers gerekir.)
+    """
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    tok = AutoTokenizer.from_pretrained(EMB_MODEL_NAME)
+    model = AutoModel.from_pretrained(EMB_MODEL_NAME).eval()
+    tok.save_pretrained(str(out_dir))
+
+    dummy = tok(["örnek fiş kalemi"], return_tensors="pt")
+    fp32 = out_dir / ONNX_FP32_FILE
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            (dummy["input_ids"], dummy["attention_mask"]),
+            str(fp32),
+            input_names=["input_ids", "attention_mask"],
+            output_names=["last_hidden_state"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "seq"},
+                "attention_mask": {0: "batch", 1: "seq"},
+                "last_hidden_state": {0: "batch", 1: "seq"},
+            },
+            opset_version=14,
+        )
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(str(fp32), str(out_dir / ONNX_INT8_FILE), weight_type=QuantType.QInt8)
+    return out_dir
+
+
+def parity_check(texts: Optional[list[str]] = None, quantized: bool = EMBED_QUANTIZED) -> dict:
+    """
+    ONNX backend'i PyTorch referansıyla karşılaştırır: metin başına kosinüs ve
+    metinler arası benzerlik skorlarının (arama sıralamasını belirleyen) farkı.
+    """
+    texts = texts or parity_samples()
+    ref = TorchEmbedder().encode(texts)
+    cand = OnnxEmbedder(quantized=quantized).encode(texts)
+
+    cos = (ref * cand).sum(axis=1)
+    s_ref, s_cand = ref @ ref.T, cand @ cand.T
+    np.fill_diagonal(s_ref, -np.inf)
+    np.fill_diagonal(s_cand, -np.inf)
+    top1 = float((s_ref.argmax(axis=1) == s_cand.argmax(axis=1)).mean())
+    np.fill_diagonal(s_ref, 0.0)
+    np.fill_diagonal(s_cand, 0.0)
+
+    return {
+        "texts": len(texts),
+        "min_cosine": round(float(cos.min()), 5),
+        "mean_cosine": round(float(cos.mean()), 5),
+        "max_score_diff": round(float(np.abs(s_ref - s_cand).max()), 5),
+        "top1_agreement": round(top1, 4),
+        "ok": bool(cos.min() >= PARITY_MIN_COSINE),
+    }
+
+
+def _onnx_available() -> bool:
+    if not (ONNX_DIR / "tokenizer.json").exists():
+        return False
+    if not ((ONNX_DIR / ONNX_INT8_FILE).exists() or (ONNX_DIR / ONNX_FP32_FILE).exists()):
+        return False
+    try:
+        import onnxruntime  # noqa: F401
+        import tokenizers  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+def _onnx_name(quantized: bool) -> str:
+    return f"{EMB_MODEL_NAME}@onnx{'-int8' if quantized else ''}"
+
+def resolve_backend() -> str:
+    if EMBED_BACKEND == "auto":
+        return "onnx" if _onnx_available() else "torch"
+    return EMBED_BACKEND
+
+def embedder_name() -> str:
+    """Aktif backend'in kimliği, model yüklenmeden (indeks manifest kontrolü için)."""
+    if resolve_backend() == "onnx":
+        return _onnx_name(EMBED_QUANTIZED and (ONNX_DIR / ONNX_INT8_FILE).exists())
+    return EMB_MODEL_NAME
+
+# Global instance
+_embedder: Optional[Embedder] = None
+
+def get_embedder() -> Embedder:
+    """Singleton embedder (EMBED_BACKEND'e göre)"""
+    global _embedder
+    if _embedder is None:
+        _embedder = OnnxEmbedder() if resolve_backend() == "onnx" else TorchEmbedder()
+    return _embedder
+
+
+def pool_size() -> int:
+    """EMBED_WORKERS'a göre süreç sayısı (1: havuz kullanılmaz)."""
+    if EMBED_WORKERS != "auto":
+        return max(1, int(EMBED_WORKERS))
+    return max(1, min(EMBED_MAX_WORKERS, (os.cpu_count() or 1) // max(EMBED_WORKER_THREADS, 1)))
+
+def _pool_init(threads: int) -> None:
+    # Her süreç sabit sayıda thread kullanır; süreçler çekirdekleri paylaşmaz (aşırı abonelik olmaz).
+    # Model ilk işte yüklenir: initializer'da hata olursa havuz süreçleri sürekli yeniden başlatır.
+    for var in ("EMBED_THREADS", "OMP_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ[var] = str(threads)
+
+def _pool_encode(texts: list[str], batch_size: int) -> np.ndarray:
+    return get_embedder().encode(texts, batch_size=batch_size)
+
+
+class EmbedPool:
+    """
+    Çok çekirdekli encode: her süreç kendi modelini (ya da ONNX oturumunu) ve
+    sabit thread sayısını kullanır. submit() parça başına bir iş gönderir;
+    sonuçlar gönderilme sırasıyla alınır (indekse sırayla eklenir).
+    """
+
+    def __init__(self, workers: Optional[int] = None, threads: int = EMBED_WORKER_THREADS):
+        import multiprocessing as mp
+
+        self.workers = workers or pool_size()
+        # spawn: fork edilmiş süreçte torch/ONNX thread havuzları güvenli değil
+        self._pool = mp.get_context("spawn").Pool(self.workers, initializer=_pool_init, initargs=(threads,))
+        self.name = embedder_name()
+
+    def submit(self, texts: list[str], batch_size: int = 64):
+        """Parçayı bir sürece gönderir; sonucu .get() ile alınır."""
+        return self._pool.apply_async(_pool_encode, (texts, batch_size))
+
+    def encode(self, texts: list[str], batch_size: int = 64) -> np.ndarray:
+        """Metinleri süreçlere eşit parçalar halinde böler, sonucu sırayla birleştirir."""
+        if not texts:
+            return np.zeros((0, 0), dtype="float32")
+        step = -(-len(texts) // self.workers)
+        parts = [self.submit(texts[i : i + step], batch_size) for i in range(0, len(texts), step)]
+        return np.concatenate([p.get() for p in parts])
+
+    def close(self) -> None:
+        self._pool.close()
+        self._pool.join()
+
+    def __enter__(self) -> "EmbedPool":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        if exc[0] is None:
+            self.close()
+        else:
+            self._pool.terminate()
+
+
+def bench_pool(n_texts: int = 8192, workers: Optional[int] = None) -> dict:
+    """Tek süreç (EMBED_WORKER_THREADS thread) ile havuzun encode hızı (metin/sn)."""
+    import time
+
+    samples = parity_samples()
+    texts = [f"{samples[i % len(samples)]} #{i}" for i in range(n_texts)]
+    with EmbedPool(1) as single:
+        single.encode(texts[:64])  # model yükleme ölçüme girmesin
+        t0 = time.perf_counter()
+        ref = single.encode(texts)
+        t_single = time.perf_counter() - t0
+    with EmbedPool(workers) as pool:
+        pool.encode(texts[: 64 * pool.workers])
+        t0 = time.perf_counter()
+        out = pool.encode(texts)
+        t_pool = time.perf_counter() - t0
+    return {
+        "texts": n_texts,
+        "workers": pool.workers,
+        "threads_per_worker": EMBED_WORKER_THREADS,
+        "single_tps": round(n_texts / t_single, 1),
+        "pool_tps": round(n_texts / t_pool, 1),
+        "speedup": round(t_single / t_pool, 2),
+        "same_output": bool(np.allclose(ref, out, atol=1e-5)),
+    }
+
+
+def main():
+    cmd = sys.argv[1] if len(sys.argv) > 1 else ""
+    if cmd == "export":
+        out = export_onnx(quantize="--no-quantize" not in sys.argv[2:])
+        print(f"EMBED_EXPORT_OK: {out}")
+    elif cmd == "parity":
+        res = parity_check(quantized="--fp32" not in sys.argv[2:])
+        print(("EMBED_PARITY_OK: " if res["ok"] else "EMBED_PARITY_FAIL: ") + str(res))
+        if not res["ok"]:
+            sys.exit(1)
+    elif cmd == "bench":
+        workers = int(sys.argv[2]) if len(sys.argv) > 2 else None
+        print(f"EMBED_BENCH_OK: {bench_pool(workers=workers)}")
+    else:
+        print("Kullanım: python -m src.ai.embedder [export [--no-quantize] | parity [--fp32] | bench [N]]")
+
+if __name__ == "__main__":
+    main()
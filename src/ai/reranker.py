@@ -0,0 +1,244 @@
+"""
+Reranker - Kanıt satırları için ikinci aşama sıralama (özellik tabanlı / cross-encoder)
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from ..normalize import normalize_name
+
+# off | features | cross  (cross: yerel CrossEncoder modeli; yüklenemezse features)
+RERANKER = os.getenv("RERANKER", "features")
+RERANK_MODEL_NAME = os.getenv("RERANK_MODEL", "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1")
+# İlk aşamanın (retrieval sırası) en iyi bu kadar kalemi yeniden sıralanır
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "50"))
+# Prompt'a giren kanıt satırı; en iyinin bu oranının altındaki satırlar hiç girmez
+RERANK_EVIDENCE = int(os.getenv("RERANK_EVIDENCE", "3"))
+RERANK_MIN_RATIO = 0.5
+
+# Özellik ağırlıkları: tam token eşleşmesi, önek eşleşmesi, baş kelime, ilk aşama sırası, soru niyeti
+FEATURE_WEIGHTS = {"exact": 2.0, "prefix": 1.0, "head": 0.5, "first_stage": 0.5, "intent": 1.5}
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+def _tokens(text: str) -> list[str]:
+    return _TOKEN_RE.findall(normalize_name(text or ""))
+
+def term_matches(query: str, it: dict) -> bool:
+    """Sorgunun tüm tokenları ürün adında tam token olarak geçiyor mu ("sut": "sut 1l" evet, "sutlac" hayır)."""
+    q = _tokens(query)
+    name = set(_tokens(it.get("name_norm") or it.get("name_raw") or ""))
+    return bool(q) and all(t in name for t in q)
+
+def item_doc(it: dict) -> str:
+    """Kalemin yeniden sıralamada kullanılan metni (tarih/tutar özellik olarak ayrıca okunur)."""
+    parts = [it.get("name_norm") or it.get("name_raw") or "", it.get("category") or "", it.get("merchant") or ""]
+    return " | ".join(p for p in parts if p)
+
+def question_intent(question: str) -> Optional[str]:
+    """Kanıt seçimini etkileyen soru niyeti: en pahalı/ucuz ya da en son satırlar."""
+    x = (question or "").lower()
+    if "pahal" in x or "en yüksek" in x:
+        return "expensive"
+    if "ucuz" in x or "en düşük" in x:
+        return "cheap"
+    if "en son" in x or "son ne zaman" in x:
+        return "recent"
+    return None
+
+def intent_feature(question: str, items: list[dict]) -> np.ndarray:
+    """Soru niyetine göre [0, 1] sıra özelliği (niyet yoksa sıfır)."""
+    n = len(items)
+    out = np.zeros(n)
+    intent = question_intent(question)
+    if intent in ("expensive", "cheap"):
+        amounts = np.asarray([float(it.get("amount") or 0.0) for it in items])
+        order = np.argsort(-amounts if intent == "expensive" else amounts, kind="stable")
+    elif intent == "recent":
+        dates = [it.get("date") or "" for it in items]
+        order = np.asarray(sorted(range(n), key=lambda i: dates[i], reverse=True), dtype="int64")
+    else:
+        return out
+    out[order] = 1.0 - np.arange(n) / max(n, 1)
+    return out
+
+
+class RerankCache:
+    """
+    (model, sorgu, doküman) -> skor. Cross-encoder skorları deterministik;
+    aynı ürün terimleri ve kalemler sık tekrarlandığından SQLite'ta kalıcı tutulur.
+    """
+
+    def __init__(self, db_path: str = "data/rerank_cache.sqlite"):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        conn = sqlite3.connect(str(self.db_path))
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS rerank_scores (
+                key BLOB PRIMARY KEY,
+                score REAL NOT NULL
+            ) WITHOUT ROWID
+        """)
+        conn.commit()
+        conn.close()
+
+    @staticmethod
+    def _key(model: str, query: str, doc: str) -> bytes:
+        return hashlib.sha1(f"{model}\0{query}\0{doc}".encode("utf-8")).digest()
+
+    def scores(self, model: str, query: str, docs: list[str], score_fn) -> np.ndarray:
+        """docs için skorlar; cache'te olmayan farklı dokümanlar tek çağrıda score_fn ile hesaplanır."""
+        keys = {d: self._key(model, query, d) for d in dict.fromkeys(docs)}
+        conn = sqlite3.connect(str(self.db_path))
+        try:
+            q = ",".join(["?"] * len(keys))
+            found = dict(conn.execute(f"SELECT key, score FROM rerank_scores WHERE key IN ({q})", list(keys.values())))
+            by_doc = {d: found[k] for d, k in keys.items() if k in found}
+            missing = [d for d in keys if d not in by_doc]
+            if missing:
+                fresh = np.asarray(score_fn(query, missing), dtype="float64")
+                by_doc.update(zip(missing, fresh.tolist()))
+                with self._lock:
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO rerank_scores (key, score) VALUES (?, ?)",
+                        [(keys[d], by_doc[d]) for d in missing],
+                    )
+                    conn.commit()
+        finally:
+            conn.close()
+        return np.asarray([by_doc[d] for d in docs], dtype="float64")
+
+
+class Reranker(ABC):
+    """Ortak arayüz: score() ilk aşama sırasındaki kalemler için skor döndürür (büyük = daha alakalı)."""
+
+    name: str = ""
+
+    @abstractmethod
+    def score(self, query: str, question: str, items: list[dict]) -> np.ndarray:
+        ...
+
+    def select(self, query: str, question: str, items: list[dict], limit: int = RERANK_EVIDENCE) -> list[dict]:
+        """
+        İlk aşamanın en iyi RERANK_CANDIDATES kalemini (niyetli sorularda en
+        pahalı/ucuz/yeni kalemleri de) yeniden sıralar ve kanıt olarak en fazla `limit`
+        satır seçer: önce her (ürün, işyeri) için en iyi satır, kalan yer sonraki
+        en iyilerle doldurulur; en iyi skorun RERANK_MIN_RATIO'sunun altındakiler elenir.
+        """
+        cand = items[:RERANK_CANDIDATES]
+        intent = question_intent(question)
+        if intent is not None:
+            # Niyetin aradığı satırlar ilk aşamanın ilk adaylarında olmayabilir
+            if intent == "recent":
+                extra = sorted(items, key=lambda it: it.get("date") or "", reverse=True)
+            else:
+                extra = sorted(items, key=lambda it: float(it.get("amount") or 0.0), reverse=intent == "expensive")
+            ids = {id(it) for it in cand}
+            cand = cand + [it for it in extra[:RERANK_CANDIDATES] if id(it) not in ids]
+        if not cand:
+            return []
+        scores = self.score(query, question, cand)
+        # Cross-encoder logit'i negatif olabilir: oran en kötü adaya göre kaydırılmış skorla hesaplanır
+        base = scores - min(scores.min(), 0.0)
+        cutoff = RERANK_MIN_RATIO * base.max()
+        order = [int(i) for i in np.argsort(-scores, kind="stable") if base[i] >= cutoff]
+
+        picked, seen = [], set()
+        for i in order:
+            key = (cand[i].get("name_norm") or cand[i].get("name_raw"), cand[i].get("merchant"))
+            if key not in seen:
+                seen.add(key)
+                picked.append(i)
+        picked += [i for i in order if i not in set(picked)]
+        return [cand[i] for i in sorted(picked[:limit], key=order.index)]
+
+
+class FeatureReranker(Reranker):
+    """
+    Model gerektirmeyen skor: sorgu tokenlarının ürün adındaki tam/önek
+    eşleşmesi ("sut" için "sut 1l" > "sutlac"), ilk aşama sırası ve soru
+    niyeti (en pahalı/ucuz/son). Milisaniyeler içinde çalışır.
+    """
+
+    name = "features"
+
+    def score(self, query: str, question: str, items: list[dict]) -> np.ndarray:
+        q = list(dict.fromkeys(_tokens(query)))
+        n = len(items)
+        feats = {k: np.zeros(n) for k in FEATURE_WEIGHTS}
+        for i, it in enumerate(items):
+            name = _tokens(it.get("name_norm") or it.get("name_raw") or "")
+            if q and name:
+                feats["exact"][i] = sum(t in name for t in q) / len(q)
+                feats["prefix"][i] = sum(any(w.startswith(t) for w in name) for t in q) / len(q)
+                feats["head"][i] = float(any(name[0].startswith(t) for t in q))
+            feats["first_stage"][i] = 1.0 / (1.0 + i / 10.0)
+        feats["intent"] = intent_feature(question, items)
+        return sum(w * feats[k] for k, w in FEATURE_WEIGHTS.items())
+
+
+class CrossEncoderReranker(Reranker):
+    """
+    Küçük çok dilli cross-encoder (CPU): (sorgu, kalem metni) çifti birlikte
+    skorlanır. Skorlar RerankCache'te tutulur; tekrar eden sorgularda model çalışmaz.
+    Soru niyeti (en pahalı/ucuz/son) özellik skorundan eklenir.
+    """
+
+    def __init__(self, model_name: str = RERANK_MODEL_NAME):
+        from sentence_transformers import CrossEncoder
+
+        self.name = model_name
+        self.model = CrossEncoder(model_name, max_length=128)
+        self.cache = RerankCache()
+
+    def _predict(self, query: str, docs: list[str]) -> np.ndarray:
+        return self.model.predict([(query, d) for d in docs], batch_size=32, show_progress_bar=False)
+
+    def score(self, query: str, question: str, items: list[dict]) -> np.ndarray:
+        scores = self.cache.scores(self.name, normalize_name(query) or query, [item_doc(it) for it in items], self._predict)
+        if question_intent(question) is None:
+            return scores
+        # Logit'ler [0, 1]'e ölçeklenip niyet sırası eklenir
+        span = scores.max() - scores.min()
+        scaled = (scores - scores.min()) / span if span > 0 else np.zeros_like(scores)
+        return scaled + FEATURE_WEIGHTS["intent"] * intent_feature(question, items)
+
+
+# Global instance
+_reranker: Optional[Reranker] = None
+_reranker_loaded = False
+
+def get_reranker() -> Optional[Reranker]:
+    """Singleton reranker (RERANKER=off ise None; cross-encoder yüklenemezse özellik tabanlı)."""
+    global _reranker, _reranker_loaded
+    if not _reranker_loaded:
+        _reranker_loaded = True
+        if RERANKER == "cross":
+            try:
+                _reranker = CrossEncoderReranker()
+            except Exception as e:
+                print(f"RERANKER_FALLBACK: {e}")
+                _reranker = FeatureReranker()
+        elif RERANKER != "off":
+            _reranker = FeatureReranker()
+    return _reranker
+
+def select_evidence(query: str, question: str, items_sorted: list[dict], limit: int = 5) -> list[dict]:
+    """
+    Kanıt satırları: reranker açıksa ilk aşama adaylarından o seçer (daha az,
+    daha alakalı satır -> daha kısa prompt); kapalıysa ilk aşamanın ilk `limit` satırı.
+    """
+    reranker = get_reranker()
+    if reranker is None:
+        return items_sorted[:limit]
+    return reranker.select(query, question, items_sorted, min(limit, RERANK_EVIDENCE))
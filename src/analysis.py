@@ -14,11 +14,13 @@ def get_subscriptions(conn=None):
         
     query = """
     SELECT
-      r.merchant,
+      COALESCE(r.merchant_id, r.merchant) AS merchant_key,
+      COALESCE(m.canonical_name, r.merchant) AS merchant,
       i.amount,
       r.receipt_date
     FROM items i
     JOIN receipts r ON r.id = i.receipt_id
+    LEFT JOIN merchants m ON m.id = r.merchant_id
     WHERE r.merchant IS NOT NULL AND i.amount > 0 AND r.receipt_date IS NOT NULL
     """
     df = pd.read_sql_query(query, conn)
@@ -34,8 +36,10 @@ def get_subscriptions(conn=None):
     # Group by merchant and amount (rounded to 1 decimal for tolerance)
     df['amount_key'] = df['amount'].round(1)
     
-    # Count unique months per (merchant, amount)
-    tech_subs = df.groupby(['merchant', 'amount_key'])['month'].nunique().reset_index()
+    # Count unique months per (canonical merchant, amount)
+    tech_subs = df.groupby(['merchant_key', 'amount_key']).agg(
+        merchant=('merchant', 'first'), month=('month', 'nunique')
+    ).reset_index()
     # Filter for >= 2 months
     candidates = tech_subs[tech_subs['month'] >= 2]
     
@@ -18,20 +18,24 @@ class SubscriptionTracker:
         """Tekrarlayan ödemeleri tespit et"""
         conn = sqlite3.connect(str(self.db_path))
         
-        # Merchant bazlı harcamaları grupla
+        # Merchant bazlı harcamaları grupla (kanonik merchant_id; yazım varyantları tek grup)
         rows = conn.execute("""
-            SELECT r.merchant, i.name_norm, i.amount, r.receipt_date
+            SELECT COALESCE(r.merchant_id, r.merchant), COALESCE(m.canonical_name, r.merchant),
+                   i.name_norm, i.amount, r.receipt_date
             FROM items i
             JOIN receipts r ON i.receipt_id = r.id
+            LEFT JOIN merchants m ON m.id = r.merchant_id
             WHERE r.merchant IS NOT NULL
             AND i.amount > 0
-            ORDER BY r.merchant, r.receipt_date
+            ORDER BY r.merchant_id, r.receipt_date
         """).fetchall()
         
         # Merchant ve ürün bazında grupla
         merchant_items = defaultdict(list)
-        for merchant, name, amount, date in rows:
-            key = f"{merchant}|{name}"
+        merchant_names = {}
+        for merchant_key, merchant, name, amount, date in rows:
+            key = (merchant_key, name)
+            merchant_names[key] = merchant
             merchant_items[key].append({"amount": amount, "date": date})
         
         subscriptions = []
@@ -40,7 +44,7 @@ class SubscriptionTracker:
             if len(transactions) < min_occurrences:
                 continue
             
-            merchant, name = key.split("|", 1)
+            merchant, name = merchant_names[key], key[1]
             
             # Tutarların benzer olup olmadığını kontrol et
             amounts = [t["amount"] for t in transactions]
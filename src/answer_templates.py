@@ -0,0 +1,222 @@
+from __future__ import annotations
+
+import json
+import os
+import re
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Optional
+
+from .query_parse import QuerySpec
+
+# auto: sayısal sorular (kaç kez/adet/litre/kilo, birim fiyat, toplamlar) şablonla, diğerleri LLM ile.
+# llm: her cevap LLM ile (serbest anlatım; sayısal sorularda 10-30 sn).
+ANSWER_MODES = ("auto", "llm")
+ANSWER_MODE = os.getenv("ANSWER_MODE", "auto")
+if ANSWER_MODE not in ANSWER_MODES:
+    # Yazım hatası (ör. "template") sessizce her cevabı LLM'e göndermesin
+    print(f"⚠️ Geçersiz ANSWER_MODE={ANSWER_MODE!r} (geçerli: {', '.join(ANSWER_MODES)}); 'auto' kullanılıyor")
+    ANSWER_MODE = "auto"
+# Her cevabın modu ve süresi (satır başına bir JSON)
+ANSWER_LOG_PATH = Path(os.getenv("ANSWER_LOG", "data/answer_log.jsonl"))
+
+# Şablonu olan soru türleri; "total": ürün terimsiz kategori/tarih toplamı, "month_total": aylık rapor toplamı
+NUMERIC_KINDS = ("times", "qty", "liters", "weight", "unit_price", "total", "month_total")
+
+CATEGORY_LABELS = {
+    "gida": ("gıda", "groceries"),
+    "temizlik": ("temizlik", "cleaning"),
+    "su_icecek": ("su ve içecek", "water and drinks"),
+    "kisisel_bakim": ("kişisel bakım", "personal care"),
+    "ev": ("ev", "household"),
+    "diger": ("diğer", "other"),
+}
+
+# Kaynak satırında listelenen en fazla fiş dosyası ve toplam cevabındaki en fazla kategori
+MAX_SOURCES = 3
+MAX_CATEGORIES = 5
+
+_EN_RE = re.compile(
+    r"\b(how|what|when|which|did|do|i|my|spen[dt]\w*|buy|bought|times|many|much|total|liters?|litres?|units?|price)\b"
+)
+
+
+@dataclass
+class Answer:
+    """Cevap metni ve nasıl üretildiği (her cevap için kaydedilir)."""
+    text: str
+    mode: str                   # template | llm | none (kayıt ya da indeks yok)
+    kind: Optional[str] = None  # NUMERIC_KINDS; açık uçlu sorularda None
+    lang: str = "tr"
+
+
+def record_answer(question: str, answer: Answer, elapsed_s: float) -> None:
+    ANSWER_LOG_PATH.parent.mkdir(parents=True, exist_ok=True)
+    row = {
+        "ts": datetime.now().isoformat(timespec="seconds"),
+        "question": question,
+        "mode": answer.mode,
+        "kind": answer.kind,
+        "lang": answer.lang,
+        "ms": round(elapsed_s * 1000, 1),
+    }
+    with ANSWER_LOG_PATH.open("a", encoding="utf-8") as f:
+        f.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+def not_found_text(lang: str) -> str:
+    if lang == "tr":
+        return "Bu soruya yanıt verecek kayıt bulamadım."
+    return "I couldn't find any records that answer this question."
+
+def detect_language(question: str) -> str:
+    """Türkçe karakter varsa tr; yoksa en az iki İngilizce soru kelimesi en, değilse tr."""
+    x = (question or "").lower()
+    if any(c in x for c in "çğıöşü"):
+        return "tr"
+    return "en" if len(_EN_RE.findall(x)) >= 2 else "tr"
+
+
+# ===================== Biçimlendirme =====================
+def fmt_number(v: float, lang: str, decimals: int = 2) -> str:
+    v = float(v)
+    s = f"{v:,.0f}" if v.is_integer() else f"{v:,.{decimals}f}".rstrip("0").rstrip(".")
+    return s.replace(",", "\0").replace(".", ",").replace("\0", ".") if lang == "tr" else s
+
+def fmt_money(v: float, lang: str) -> str:
+    s = f"{float(v):,.2f}"
+    if lang == "tr":
+        return s.replace(",", "\0").replace(".", ",").replace("\0", ".") + " TL"
+    return s + " TRY"
+
+def category_label(cat: str, lang: str) -> str:
+    tr, en = CATEGORY_LABELS.get(cat, (cat, cat))
+    return tr if lang == "tr" else en
+
+def _is_month(date_from: str, date_to: str) -> bool:
+    # Ayın ilk gününden son gününe (ya da bu ay için bugüne) kadar
+    try:
+        d_from, d_to = date.fromisoformat(date_from), date.fromisoformat(date_to)
+    except ValueError:
+        return False
+    month_end = (d_to + timedelta(days=1)).day == 1 or d_to == date.today()
+    return d_from.day == 1 and d_from.strftime("%Y-%m") == d_to.strftime("%Y-%m") and month_end
+
+def period_text(spec: QuerySpec, lang: str) -> str:
+    """Tarih filtresinin ifadesi ("2024-03 ayında" / "in 2024-03"); filtre yoksa boş."""
+    f, t = spec.date_from, spec.date_to
+    if f and t:
+        if _is_month(f, t):
+            return f"{f[:7]} ayında" if lang == "tr" else f"in {f[:7]}"
+        return f"{f} – {t} arasında" if lang == "tr" else f"between {f} and {t}"
+    if f:
+        return f"{f} tarihinden bu yana" if lang == "tr" else f"since {f}"
+    if t:
+        return f"{t} tarihine kadar" if lang == "tr" else f"until {t}"
+    return ""
+
+def _sentence(*parts: str) -> str:
+    text = " ".join(p for p in parts if p)
+    return text[:1].upper() + text[1:]
+
+def _first(d: dict) -> Optional[tuple[str, float]]:
+    return next(iter(d.items()), None)
+
+def sources_line(evidence: list[dict], lang: str) -> str:
+    sources = list(dict.fromkeys(it.get("source_path") for it in evidence if it.get("source_path")))[:MAX_SOURCES]
+    if not sources:
+        return ""
+    return ("Kaynak: " if lang == "tr" else "Source: ") + ", ".join(sources)
+
+
+# ===================== Şablonlar =====================
+def _item_answer(kind: str, term: str, period: str, results: dict, lang: str) -> Optional[str]:
+    n = results["times_purchased"]
+    money = fmt_money(results["matched_total_amount_try"], lang)
+    tr = lang == "tr"
+    if kind == "times":
+        if tr:
+            return _sentence(period, f"{term} toplam {n} kez alınmış; toplam tutar {money}.")
+        return _sentence(f"You bought {term} {n} times", period, f"for a total of {money}.")
+
+    if kind == "unit_price":
+        price = results.get("unit_price_try")
+        if not price:
+            return None
+        avg, lo, hi = (fmt_money(price[k], lang) for k in ("avg", "min", "max"))
+        if tr:
+            return _sentence(period, f"{term} ortalama birim fiyatı {avg} (en düşük {lo}, en yüksek {hi}; {n} alım).")
+        return _sentence(f"The average unit price of {term}", period, f"was {avg} (min {lo}, max {hi}; {n} purchases).")
+
+    value, unit_tr, unit_en = {
+        "qty": (results.get("total_qty"), "adet", "units of"),
+        "liters": (results.get("total_liters_est"), "litre", "liters of"),
+        "weight": (results.get("total_kg_est"), "kg", "kg of"),
+    }[kind]
+    if value is None:
+        return None
+    amount = fmt_number(value, lang, 3)
+    if tr:
+        return _sentence(period, f"{term} toplam {amount} {unit_tr} alınmış ({n} alım, {money}).")
+    return _sentence(f"You bought {amount} {unit_en} {term}", period, f"across {n} purchases ({money}).")
+
+def _total_answer(spec: QuerySpec, period: str, results: dict, lang: str) -> str:
+    n = results["matched_item_count"]
+    money = fmt_money(results["matched_total_amount_try"], lang)
+    cat = category_label(spec.category, lang) if spec.category else ""
+    tr = lang == "tr"
+    if tr:
+        lines = [_sentence(period, f"{cat} harcamanız" if cat else "harcamanız", f"toplam {money} ({n} kalem).")]
+    else:
+        lines = [_sentence(f"You spent {money}", f"on {cat}" if cat else "", period, f"across {n} items.")]
+    cats = list((results.get("by_category_try") or {}).items())[:MAX_CATEGORIES]
+    if not spec.category and cats:
+        parts = ", ".join(f"{category_label(c, lang)} {fmt_money(v, lang)}" for c, v in cats)
+        lines.append(f"Kategoriler: {parts}." if tr else f"By category: {parts}.")
+    if top := _first(results.get("by_merchant_try") or {}):
+        lines.append(f"En çok harcama yapılan işyeri: {top[0]} ({fmt_money(top[1], lang)})." if tr
+                     else f"Top merchant: {top[0]} ({fmt_money(top[1], lang)}).")
+    return " ".join(lines)
+
+def render_answer(
+    kind: str, spec: QuerySpec, results: dict, evidence: list[dict], lang: str = "tr", latest: Optional[dict] = None
+) -> Optional[str]:
+    """
+    Hesaplanmış sonuçlardan ve kanıt kalemlerinden deterministik cevap; şablon
+    sorunun istediği sayıyı içermiyorsa (ör. litre bilgisi yok) None -> LLM.
+    """
+    period = period_text(spec, lang)
+    if kind == "total":
+        text = _total_answer(spec, period, results, lang)
+    else:
+        text = _item_answer(kind, spec.product_term or "", period, results, lang)
+    if text is None:
+        return None
+    lines = [text]
+    if latest is not None:
+        amount = fmt_money(latest.get("amount") or 0.0, lang)
+        lines.append(
+            f"Son alım: {latest.get('date')}, {latest.get('merchant')} ({latest.get('name_raw')}, {amount})."
+            if lang == "tr"
+            else f"Last purchase: {latest.get('date')} at {latest.get('merchant')} ({latest.get('name_raw')}, {amount})."
+        )
+    if src := sources_line(evidence, lang):
+        lines.append(src)
+    return "\n".join(lines)
+
+def render_month_total(month: str, report: dict, lang: str = "tr") -> Optional[str]:
+    """Aylık rapor toplamı ("2024-03 toplam harcamam"); ay raporda yoksa None."""
+    rows = report.get("monthly_total") or []
+    if not rows or rows[0].get("total_try") in (None, ""):
+        return None
+    money = fmt_money(float(rows[0]["total_try"]), lang)
+    tr = lang == "tr"
+    text = f"{month} ayında toplam harcamanız {money}." if tr else f"You spent {money} in total in {month}."
+    cats = sorted(
+        (r for r in report.get("monthly_by_category") or [] if r.get("total_try") not in (None, "")),
+        key=lambda r: -float(r["total_try"]),
+    )
+    if cats:
+        label, amount = category_label(cats[0].get("category") or "diger", lang), fmt_money(float(cats[0]["total_try"]), lang)
+        text += f" En çok harcanan kategori: {label} ({amount})." if tr else f" Top category: {label} ({amount})."
+    return text
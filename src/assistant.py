@@ -3,17 +3,25 @@ from __future__ import annotations
 import csv
 import json
 import re
+import sys
+import time
 from pathlib import Path
 import sqlite3
 
-import faiss
-import numpy as np
 from llama_cpp import Llama
-from sentence_transformers import SentenceTransformer
 
-from .db import connect, init_schema
-from .query_parse import parse_query
+from .aggregate import aggregate_items
+from .ai.reranker import select_evidence, term_matches
+from .answer_templates import (
+    ANSWER_MODE, Answer, detect_language, not_found_text, record_answer, render_answer, render_month_total,
+)
+from .db import connect, has_fts, init_schema
+from .granularity import level_context
+from .query_parse import QuerySpec, parse_query
+from .query_plan import ITEM_SELECT, filter_sql, plan_items, row_to_item
 from .normalize import normalize_name
+from .index_manager import index_ready
+from .retrieve import embed_queries, fts_phrase, retrieve
 
 # ====== LLM ======
 LLM_MODEL_PATH = r"models\qwen2.5-7b-instruct-q4_k_m-00001-of-00002.gguf"
@@ -26,18 +34,6 @@ def get_llm():
         _CACHED_LLM = Llama(model_path=LLM_MODEL_PATH, n_ctx=2048, n_threads=8, verbose=False)
     return _CACHED_LLM
 
-# ====== RAG index ======
-EMB_MODEL_NAME = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
-_CACHED_EMB_MODEL = None
-
-def get_emb_model():
-    global _CACHED_EMB_MODEL
-    if _CACHED_EMB_MODEL is None:
-        _CACHED_EMB_MODEL = SentenceTransformer(EMB_MODEL_NAME)
-    return _CACHED_EMB_MODEL
-INDEX_PATH = Path("data/index/items.faiss")
-META_PATH = Path("data/index/items_meta.jsonl")
-
 # ====== Reports ======
 REPORT_DIR = Path("data/reports")
 P_MONTHLY_TOTAL = REPORT_DIR / "monthly_total.csv"
@@ -71,71 +67,61 @@ RAPOR_VERISI:
 
 
 # ===================== Router / Intent =====================
-def is_report_question(q: str) -> bool:
+def _report_intents(q: str) -> tuple[bool, bool, bool, bool]:
     x = (q or "").lower()
     has_month = re.search(r"(20\d{2})[-/](\d{1,2})", x) is not None
     wants_distribution = any(k in x for k in ["kategorilere", "dağılım", "dagilim", "kırılım", "kirilim"])
-    wants_top = any(k in x for k in ["en çok", "en cok", "top", "ilk 3", "ilk üç", "ilk3"])
-    wants_monthly_total = ("toplam" in x) and (has_month or "ay" in x)
+    # "top" tek kelime olarak ("toplam" da "top" içerir)
+    wants_top = any(k in x for k in ["en çok", "en cok", "ilk 3", "ilk üç", "ilk3"]) or re.search(r"\btop\b", x) is not None
+    wants_monthly_total = ("toplam" in x or "total" in x) and (has_month or "ay" in x)
+    return has_month, wants_distribution, wants_top, wants_monthly_total
+
+def is_report_question(q: str) -> bool:
+    has_month, wants_distribution, wants_top, wants_monthly_total = _report_intents(q)
     return has_month and (wants_distribution or wants_top or wants_monthly_total)
 
+def is_month_total_question(q: str) -> bool:
+    # Sadece aylık toplam (kırılım/ilk N istenmiyor): rapordan şablonla cevaplanır
+    has_month, wants_distribution, wants_top, wants_monthly_total = _report_intents(q)
+    return has_month and wants_monthly_total and not (wants_distribution or wants_top)
+
 def is_times_question(q: str) -> bool:
     x = (q or "").lower()
-    return any(k in x for k in ["kaç kez", "kac kez", "kaç defa", "kac defa"])
+    return any(k in x for k in ["kaç kez", "kac kez", "kaç defa", "kac defa", "how many times", "how often"])
 
 def is_qty_question(q: str) -> bool:
     x = (q or "").lower()
-    return any(k in x for k in ["kaç adet", "kac adet", "kaç tane", "kac tane"])
+    return any(k in x for k in ["kaç adet", "kac adet", "kaç tane", "kac tane", "how many units", "how many pieces"])
 
 def is_liters_question(q: str) -> bool:
     x = (q or "").lower()
-    return "kaç litre" in x or "kac litre" in x or "litre" in x
-
-
-# ===================== Volume helpers (for liters) =====================
-def parse_volume_liters(name_norm: str) -> float | None:
-    """
-    Örn:
-      'su 1.5l' -> 1.5
-      'su 0.5lt' -> 0.5
-      'su 19l damacana' -> 19
-    """
-    if not name_norm:
-        return None
-    x = name_norm.lower().replace("lt", "l")
-    m = re.search(r"(\d+(?:\.\d+)?)\s*l\b", x)
-    if not m:
-        return None
-    try:
-        return float(m.group(1))
-    except:
-        return None
-
-def compute_volume_stats(items: list[dict]) -> tuple[float | None, dict[str, float]]:
-    """
-    total_liters_est: qty * litre
-    breakdown_units: {'0.5l': 12, '1.5l': 12, '19l': 1} gibi
-    """
-    total_liters = 0.0
-    any_liters = False
-    breakdown: dict[str, float] = {}
-
-    for it in items:
-        qty = it.get("qty")
-        if not isinstance(qty, (int, float)):
-            continue
-
-        liters_each = parse_volume_liters(it.get("name_norm") or "")
-        if liters_each is None:
-            continue
+    return "kaç litre" in x or "kac litre" in x or "litre" in x or "liter" in x
 
-        any_liters = True
-        total_liters += float(qty) * liters_each
+def is_weight_question(q: str) -> bool:
+    x = (q or "").lower()
+    return any(k in x for k in ["kaç kilo", "kac kilo", "kilogram", " kg"])
 
-        key = f"{liters_each:g}l"
-        breakdown[key] = breakdown.get(key, 0.0) + float(qty)
+def is_unit_price_question(q: str) -> bool:
+    x = (q or "").lower()
+    return any(k in x for k in ["birim fiyat", "ortalama fiyat", "tanesi kaç", "tanesi kac", "unit price", "average price"])
 
-    return (round(total_liters, 3) if any_liters else None, breakdown)
+def numeric_kind(question: str, spec: QuerySpec) -> str | None:
+    """Şablonla cevaplanabilen kalem sorusu türü (answer_templates.NUMERIC_KINDS); açık uçlu sorularda None."""
+    if spec.granularity != "item":
+        return None
+    if spec.product_term is None:
+        return "total" if (spec.category or spec.date_from or spec.date_to) else None
+    if is_unit_price_question(question):
+        return "unit_price"
+    if is_liters_question(question):
+        return "liters"
+    if is_weight_question(question):
+        return "weight"
+    if is_qty_question(question):
+        return "qty"
+    if is_times_question(question):
+        return "times"
+    return None
 
 
 # ===================== REPORT ENGINE =====================
@@ -153,7 +139,7 @@ def pick_month(question: str) -> str | None:
     mo = int(m.group(2))
     return f"{y}-{mo:02d}"
 
-def answer_from_reports(question: str) -> str:
+def _report_answer(question: str, mode: str) -> Answer:
     monthly_total = read_csv(P_MONTHLY_TOTAL)
     monthly_cat = read_csv(P_MONTHLY_CAT)
     top_items = read_csv(P_TOP_ITEMS)
@@ -170,180 +156,71 @@ def answer_from_reports(question: str) -> str:
     else:
         report["note"] = "Soru içinde ay (YYYY-MM) belirtilmedi."
 
+    lang = detect_language(question)
+    kind = "month_total" if target_month and is_month_total_question(question) else None
+    if mode == "auto" and kind:
+        text = render_month_total(target_month, report, lang)
+        if text is not None:
+            return Answer(text, "template", kind, lang)
+
     llm = get_llm()
     prompt = PROMPT_REPORTS.format(question=question, report_data=report)
     out = llm(prompt, max_tokens=250, temperature=0, top_p=1.0, stop=["<|im_end|>"])
-    return out["choices"][0]["text"].strip()
+    return Answer(out["choices"][0]["text"].strip(), "llm", kind, lang)
 
 
 # ===================== RAG ENGINE =====================
-def load_meta() -> list[dict]:
-    metas: list[dict] = []
-    with META_PATH.open("r", encoding="utf-8") as f:
-        for line in f:
-            metas.append(json.loads(line))
-    return metas
-
-def fetch_items_by_ids(conn: sqlite3.Connection, item_ids: list[str]) -> list[dict]:
+def fetch_items_by_ids(conn: sqlite3.Connection, item_ids: list[str], filters: QuerySpec | None = None) -> list[dict]:
     if not item_ids:
         return []
-    q = ",".join(["?"] * len(item_ids))
+    where, params = filter_sql(filters)
+    # Anahtar posting list'leri binlerce kalem olabilir: id'ler tek JSON parametresiyle (değişken sınırı yok)
     rows = conn.execute(
-        f"""
-        SELECT
-          i.id,
-          r.receipt_date,
-          r.merchant,
-          r.source_path,
-          i.name_raw,
-          i.name_norm,
-          i.category,
-          i.qty,
-          i.unit,
-          i.amount,
-          i.line_no
-        FROM items i
-        JOIN receipts r ON r.id = i.receipt_id
-        WHERE i.id IN ({q})
-        """,
-        item_ids,
+        ITEM_SELECT + "WHERE i.id IN (SELECT value FROM json_each(?))" + where, [json.dumps(item_ids), *params]
     ).fetchall()
+    return [row_to_item(r) for r in rows]
+
+def db_find_by_term(conn: sqlite3.Connection, term_norm: str, filters: QuerySpec | None = None) -> list[dict]:
+    # Kategori/tarih/işyeri filtreleri de SQL'de (eşleşmelerin tamamı Python'a gelmez)
+    where, params = filter_sql(filters)
+    # FTS5 varsa: name_norm üzerinde indeksli ifade araması (LIKE '%...%' tam tarama yerine)
+    match = fts_phrase(term_norm)
+    if match and has_fts(conn):
+        rows = conn.execute(
+            ITEM_SELECT
+            + """
+            JOIN item_vectors v ON v.item_id = i.id
+            JOIN items_fts f ON f.rowid = v.vec_id
+            WHERE items_fts MATCH ?
+            """
+            + where,
+            [f"name_norm : {match}", *params],
+        ).fetchall()
+        return [row_to_item(r) for r in rows]
 
-    out = []
-    for r in rows:
-        out.append(
-            {
-                "item_id": r[0],
-                "date": r[1],
-                "merchant": r[2],
-                "source_path": r[3],
-                "name_raw": r[4],
-                "name_norm": r[5],
-                "category": r[6],
-                "qty": r[7],
-                "unit": r[8],
-                "amount": r[9],
-                "line_no": r[10],
-            }
-        )
-    return out
-
-def db_find_by_term(conn: sqlite3.Connection, term_norm: str) -> list[dict]:
     # "su" gibi kısa terimde %su% = "sut" gibi yanlış eşleşme riski.
     if term_norm == "su":
         rows = conn.execute(
-            """
-            SELECT
-              i.id,
-              r.receipt_date,
-              r.merchant,
-              r.source_path,
-              i.name_raw,
-              i.name_norm,
-              i.category,
-              i.qty,
-              i.unit,
-              i.amount,
-              i.line_no
-            FROM items i
-            JOIN receipts r ON r.id = i.receipt_id
-            WHERE
+            ITEM_SELECT
+            + """
+            WHERE (
               i.name_norm = 'su'
               OR i.name_norm LIKE 'su %'
               OR i.name_norm LIKE '% su %'
               OR i.name_norm LIKE '% su'
+            )
             """
+            + where,
+            params,
         ).fetchall()
     else:
-        rows = conn.execute(
-            """
-            SELECT
-              i.id,
-              r.receipt_date,
-              r.merchant,
-              r.source_path,
-              i.name_raw,
-              i.name_norm,
-              i.category,
-              i.qty,
-              i.unit,
-              i.amount,
-              i.line_no
-            FROM items i
-            JOIN receipts r ON r.id = i.receipt_id
-            WHERE i.name_norm LIKE ?
-            """,
-            (f"%{term_norm}%",),
-        ).fetchall()
+        rows = conn.execute(ITEM_SELECT + "WHERE i.name_norm LIKE ?" + where, [f"%{term_norm}%", *params]).fetchall()
 
-    out = []
-    for r in rows:
-        out.append(
-            {
-                "item_id": r[0],
-                "date": r[1],
-                "merchant": r[2],
-                "source_path": r[3],
-                "name_raw": r[4],
-                "name_norm": r[5],
-                "category": r[6],
-                "qty": r[7],
-                "unit": r[8],
-                "amount": r[9],
-                "line_no": r[10],
-            }
-        )
-    return out
-
-def apply_filters(items: list[dict], category: str | None, date_from: str | None, date_to: str | None) -> list[dict]:
-    out = items
-    if category:
-        out = [it for it in out if (it.get("category") == category)]
-    if date_from:
-        out = [it for it in out if (it.get("date") or "") >= date_from]
-    if date_to:
-        out = [it for it in out if (it.get("date") or "") <= date_to]
-    return out
+    return [row_to_item(r) for r in rows]
 
 def build_results(items: list[dict]) -> dict:
-    total_amount = 0.0
-    count = 0
-    total_qty = 0.0
-    qty_any = False
-
-    by_category: dict[str, float] = {}
-    by_merchant: dict[str, float] = {}
-
-    for it in items:
-        amt = it.get("amount")
-        if isinstance(amt, (int, float)):
-            total_amount += float(amt)
-
-        q = it.get("qty")
-        if isinstance(q, (int, float)):
-            total_qty += float(q)
-            qty_any = True
-
-        count += 1
-
-        cat = it.get("category") or "diger"
-        by_category[cat] = by_category.get(cat, 0.0) + (float(amt) if isinstance(amt, (int, float)) else 0.0)
-
-        m = it.get("merchant") or "UNKNOWN"
-        by_merchant[m] = by_merchant.get(m, 0.0) + (float(amt) if isinstance(amt, (int, float)) else 0.0)
-
-    total_liters_est, volume_breakdown_units = compute_volume_stats(items)
-
-    return {
-        "matched_item_count": count,
-        "matched_total_amount_try": round(total_amount, 2),
-        "total_qty": round(total_qty, 3) if qty_any else None,
-        "times_purchased": count,
-        "total_liters_est": total_liters_est,
-        "volume_breakdown_units": volume_breakdown_units,
-        "by_category_try": {k: round(v, 2) for k, v in sorted(by_category.items(), key=lambda x: -x[1])},
-        "by_merchant_try": {k: round(v, 2) for k, v in sorted(by_merchant.items(), key=lambda x: -x[1])},
-    }
+    # Toplamlar, adet/litre/kg, birim fiyat ve kategori/işyeri kırılımı tek geçişte (NumPy)
+    return aggregate_items(items)
 
 def format_evidence(items_sorted: list[dict], limit: int = 5) -> str:
     lines = []
@@ -366,7 +243,7 @@ def build_prompt_rag(question: str, results: dict, evidence: str) -> str:
         .replace("{{EVIDENCE}}", evidence.strip() if evidence.strip() else "YOK")
     )
 
-def _format_breakdown_line(bd: dict[str, float]) -> str:
+def _format_breakdown_line(bd: dict[str, float], lang: str = "tr") -> str:
     # '0.5l': 12, '1.5l': 12 ... -> "0.5l: 12 adet, 1.5l: 12 adet"
     def key_to_float(k: str) -> float:
         try:
@@ -377,143 +254,160 @@ def _format_breakdown_line(bd: dict[str, float]) -> str:
     parts = []
     for k, v in sorted(bd.items(), key=lambda x: key_to_float(x[0])):
         vv = int(v) if float(v).is_integer() else v
-        parts.append(f"{k}: {vv} adet")
+        parts.append(f"{k}: {vv} {'adet' if lang == 'tr' else 'units'}")
     return ", ".join(parts)
 
-def answer_from_rag(question: str) -> str:
-    if not INDEX_PATH.exists() or not META_PATH.exists():
-        return "RAG index bulunamadı. Önce indeksleme (Adım 6) tamamlanmalı."
+def _llm_rag(question: str, results: dict, evidence: str) -> str:
+    llm = get_llm()
+    prompt = build_prompt_rag(question, results, evidence)
+    out = llm(prompt, max_tokens=300, temperature=0, top_p=1.0, stop=["<|im_end|>"])
+    return out["choices"][0]["text"].strip()
+
+def _rag_answer(question: str, mode: str) -> Answer:
+    lang = detect_language(question)
+    if not index_ready():
+        return Answer("RAG index bulunamadı. Önce indeksleme (Adım 6) tamamlanmalı.", "none", lang=lang)
 
-    metas = load_meta()
     spec = parse_query(question)
+    kind = numeric_kind(question, spec)
+    # auto: sayısal sorular şablonla (LLM yüklenmez); llm: her zaman serbest anlatım
+    use_template = mode == "auto" and kind is not None
+    not_found = Answer(not_found_text(lang), "none", kind, lang)
 
     conn = connect()
     init_schema(conn)
 
-    # 1) "kaç kez/kaç adet/kaç litre" -> deterministik DB LIKE + filtre
-    if spec.product_term and (is_times_question(question) or is_qty_question(question) or is_liters_question(question)):
+    # 1) Fiş/işyeri düzeyindeki sorular ("en pahalı fişim", "Migros'a gittiğim günler"):
+    #    kalem yerine fiş/işyeri özetleri, kanıtta satır başına bir fiş/işyeri
+    if spec.granularity != "item":
+        ctx = level_context(conn, question, spec)
+        conn.close()
+        if ctx is None:
+            return not_found
+        results, evidence = ctx
+        return Answer(_llm_rag(question, results, evidence), "llm", kind, lang)
+
+    # 2) "kaç kez/kaç adet/kaç litre/kaç kilo/birim fiyat" -> deterministik DB LIKE + filtre
+    if spec.product_term and kind is not None:
         term_norm = normalize_name(spec.product_term)
-        items = db_find_by_term(conn, term_norm)
-        items = apply_filters(items, spec.category, spec.date_from, spec.date_to)
+        items = db_find_by_term(conn, term_norm, spec)
         conn.close()
 
         if not items:
-            return "Bu soruya yanıt verecek kayıt bulamadım."
+            return not_found
 
         items_sorted = sorted(items, key=lambda it: (it.get("date") or ""), reverse=True)
 
         results = build_results(items)
-        evidence = format_evidence(items_sorted, limit=5)
-
-        llm = get_llm()
-        prompt = build_prompt_rag(question, results, evidence)
-        out = llm(prompt, max_tokens=300, temperature=0, top_p=1.0, stop=["<|im_end|>"])
-        text = out["choices"][0]["text"].strip()
+        picked = select_evidence(spec.product_term, question, items_sorted)
+        # Son alım: terimi tam token olarak içeren en yeni kalem (ham LIKE/FTS eşleşmesi "süt" için
+        # SUTLAC olabilir); kanıt satırları alaka sırasıyla seçildiğinden en yeniyi içermeyebilir
+        latest = next((it for it in items_sorted if term_matches(spec.product_term, it)), None)
+        text = render_answer(kind, spec, results, picked, lang, latest=latest) if use_template else None
+        if text is not None:
+            ans = Answer(text, "template", kind, lang)
+        else:
+            ans = Answer(_llm_rag(question, results, format_evidence(picked)), "llm", kind, lang)
 
         # Adım 17: litre sorularında kırılımı deterministik ekle
-        if is_liters_question(question):
+        if kind == "liters":
             bd = results.get("volume_breakdown_units") or {}
             if bd:
-                text += "\n\nKırılım: " + _format_breakdown_line(bd)
+                ans.text += ("\n\nKırılım: " if lang == "tr" else "\n\nBreakdown: ") + _format_breakdown_line(bd, lang)
 
-        return text
+        return ans
 
-    # 2) Sadece kategori/tarih toplam soruları -> DB üzerinden hesap
-    if spec.product_term is None and (spec.category or spec.date_from or spec.date_to):
-        rows = conn.execute(
-            """
-            SELECT
-              i.id,
-              r.receipt_date,
-              r.merchant,
-              r.source_path,
-              i.name_raw,
-              i.name_norm,
-              i.category,
-              i.qty,
-              i.unit,
-              i.amount,
-              i.line_no
-            FROM items i
-            JOIN receipts r ON r.id = i.receipt_id
-            """
-        ).fetchall()
+    # 3) Sadece kategori/tarih toplam soruları -> DB üzerinden hesap
+    if kind == "total":
+        # Filtre ve toplamlar SQL'de; Python'a sadece kanıt için en pahalı 5 kalem gelir
+        plan = plan_items(spec)
+        results = plan.aggregate(conn)
+        if not results["matched_item_count"]:
+            conn.close()
+            return not_found
 
-        items = [
-            {
-                "item_id": r[0],
-                "date": r[1],
-                "merchant": r[2],
-                "source_path": r[3],
-                "name_raw": r[4],
-                "name_norm": r[5],
-                "category": r[6],
-                "qty": r[7],
-                "unit": r[8],
-                "amount": r[9],
-                "line_no": r[10],
-            }
-            for r in rows
-        ]
-        items_f = apply_filters(items, spec.category, spec.date_from, spec.date_to)
+        top = plan.top_items(conn, order="amount", limit=5)
         conn.close()
+        text = render_answer(kind, spec, results, top, lang) if use_template else None
+        if text is not None:
+            return Answer(text, "template", kind, lang)
+        return Answer(_llm_rag(question, results, format_evidence(top)), "llm", kind, lang)
 
-        if not items_f:
-            return "Bu soruya yanıt verecek kayıt bulamadım."
+    # 4) Hibrit retrieval (FTS + FAISS) anahtar düzeyinde; eşleşen anahtarların filtreye uyan tüm kalemleri
+    q_text = spec.product_term if spec.product_term else question
+    hits = retrieve(q_text, spec, conn=conn)
+    items = fetch_items_by_ids(conn, [iid for iid, _ in hits], spec)
+    conn.close()
 
-        items_sorted = sorted(items_f, key=lambda it: float(it.get("amount") or 0.0), reverse=True)
-        results = build_results(items_f)
-        evidence = format_evidence(items_sorted, limit=5)
+    score_map = dict(hits)
+    items_sorted = sorted(items, key=lambda it: score_map.get(it["item_id"], -1.0), reverse=True)
 
-        llm = get_llm()
-        prompt = build_prompt_rag(question, results, evidence)
-        out = llm(prompt, max_tokens=300, temperature=0, top_p=1.0, stop=["<|im_end|>"])
-        return out["choices"][0]["text"].strip()
+    if not items_sorted:
+        return not_found
 
-    # 3) Retrieval yolu
-    index = faiss.read_index(str(INDEX_PATH))
-    emb_model = get_emb_model()
+    results = build_results(items_sorted)
+    # İkinci aşama: kanıt satırları retrieval sırasına göre değil reranker skoruna göre
+    evidence = format_evidence(select_evidence(q_text, question, items_sorted))
+    return Answer(_llm_rag(question, results, evidence), "llm", kind, lang)
 
-    q_text = spec.product_term if spec.product_term else question
-    qv = emb_model.encode([q_text], normalize_embeddings=True)
-    qv = np.asarray(qv, dtype="float32")
 
-    top_k = min(25, len(metas))
-    D, I = index.search(qv, top_k)
-    idxs = [int(x) for x in I[0] if int(x) >= 0]
-    item_ids = [metas[i]["item_id"] for i in idxs]
+def _recorded(engine, question: str, mode: str | None) -> Answer:
+    t0 = time.perf_counter()
+    ans = engine(question, mode or ANSWER_MODE)
+    record_answer(question, ans, time.perf_counter() - t0)
+    return ans
 
-    items = fetch_items_by_ids(conn, item_ids)
-    conn.close()
+def answer(question: str, mode: str | None = None) -> Answer:
+    """
+    Soruyu rapor ya da RAG motoruna yönlendirir; cevap, üretildiği mod
+    (template/llm) ile birlikte döner ve ANSWER_LOG_PATH'e kaydedilir.
+    mode: "auto" (varsayılan, ANSWER_MODE) ya da "llm" (serbest anlatım).
+    """
+    if is_report_question(question) and P_MONTHLY_TOTAL.exists():
+        return _recorded(_report_answer, question, mode)
+    return _recorded(_rag_answer, question, mode)
 
-    score_map = {metas[i]["item_id"]: float(D[0][pos]) for pos, i in enumerate(idxs)}
-    items_sorted = sorted(items, key=lambda it: score_map.get(it["item_id"], -1.0), reverse=True)
-    items_sorted = apply_filters(items_sorted, spec.category, spec.date_from, spec.date_to)
+def answer_from_reports(question: str, mode: str | None = None) -> str:
+    return _recorded(_report_answer, question, mode).text
 
-    if not items_sorted:
-        return "Bu soruya yanıt verecek kayıt bulamadım."
+def answer_from_rag(question: str, mode: str | None = None) -> str:
+    return _recorded(_rag_answer, question, mode).text
 
-    results = build_results(items_sorted)
-    evidence = format_evidence(items_sorted, limit=5)
+def answer_question(q: str) -> str:
+    return answer(q).text
 
-    llm = get_llm()
-    prompt = build_prompt_rag(question, results, evidence)
-    out = llm(prompt, max_tokens=300, temperature=0, top_p=1.0, stop=["<|im_end|>"])
-    return out["choices"][0]["text"].strip()
+def answer_many(questions: list[str], mode: str | None = None) -> list[Answer]:
+    """
+    Toplu soru modu: retrieval sorguları (ürün terimi ya da soru) önce tek
+    batch'te encode edilir; sonraki retrieve çağrıları embedding cache'ten okur.
+    """
+    rag_qs = [q for q in questions if not (is_report_question(q) and P_MONTHLY_TOTAL.exists())]
+    if rag_qs and index_ready():
+        embed_queries([parse_query(q).product_term or q for q in rag_qs])
+    return [answer(q, mode) for q in questions]
 
 
 def main():
+    # python -m src.assistant [--llm] [--batch sorular.txt]  (satır başına bir soru; --llm: serbest anlatım)
+    args = sys.argv[1:]
+    mode = "llm" if "--llm" in args else None
+    args = [a for a in args if a != "--llm"]
+    if len(args) > 1 and args[0] == "--batch":
+        lines = Path(args[1]).read_text(encoding="utf-8").splitlines()
+        questions = [l.strip() for l in lines if l.strip()]
+        answers = answer_many(questions, mode)
+        for q, ans in zip(questions, answers):
+            print(f"\nSoru: {q}\n{ans.text}\n")
+        modes = {m: sum(a.mode == m for a in answers) for m in ("template", "llm", "none")}
+        print(f"BATCH_OK: questions={len(questions)} " + " ".join(f"{k}={v}" for k, v in modes.items()))
+        return
+
     q = input("Soru: ").strip()
     if not q:
         print("EMPTY_QUESTION")
         return
 
-    if is_report_question(q) and P_MONTHLY_TOTAL.exists():
-        ans = answer_from_reports(q)
-    else:
-        ans = answer_from_rag(q)
-
-    print("\n" + ans + "\n")
+    print("\n" + answer(q, mode).text + "\n")
 
 
 if __name__ == "__main__":
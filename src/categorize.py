@@ -1,6 +1,13 @@
 from __future__ import annotations
 
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import deque
 from dataclasses import dataclass
+from pathlib import Path
 from typing import Optional
 
 @dataclass(frozen=True)
@@ -17,15 +24,132 @@ RULES: list[Rule] = [
     Rule("ev", ("ampul", "pil", "poset", "strech", "folyo", "kagit havlu", "pecete", "tuvalet kagidi")),
 ]
 
+# Harici kural dosyası (varsa RULES yerine kullanılır). Format:
+# [{"category": "gida", "keywords": ["sut", "ekmek", ...]}, ...]
+# Sıra önceliktir: ilk eşleşen kural kazanır.
+RULES_PATH = Path(os.getenv("CATEGORY_RULES_PATH", "data/category_rules.json"))
+
+# Dosya değişikliği en fazla bu sıklıkla kontrol edilir (saniye)
+RELOAD_CHECK_INTERVAL = 2.0
+
+
+class RuleMatcher:
+    """
+    Kural setini tek bir Aho-Corasick otomatına derler.
+    Ad üzerinde tek geçişte tüm anahtar kelimeler aranır; en düşük
+    kural sırasına sahip eşleşme döner (ilk kural kazanır semantiği).
+    """
+
+    def __init__(self, rules: list[Rule]):
+        self.categories = [r.category for r in rules]
+        # Kural setinin parmak izi (product_dictionary'de eskimiş kayıtları ayırt etmek için)
+        self.version = hashlib.sha1(
+            json.dumps([[r.category, list(r.keywords)] for r in rules], ensure_ascii=False).encode("utf-8")
+        ).hexdigest()[:12]
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        # Düğümde (fail zinciri dahil) biten en öncelikli kuralın sırası
+        self._best: list[Optional[int]] = [None]
+
+        for rule_idx, rule in enumerate(rules):
+            for kw in rule.keywords:
+                if kw:
+                    self._add(kw, rule_idx)
+        self._build_fail_links()
+
+    def _add(self, kw: str, rule_idx: int) -> None:
+        node = 0
+        for ch in kw:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._best.append(None)
+            node = nxt
+        cur = self._best[node]
+        if cur is None or rule_idx < cur:
+            self._best[node] = rule_idx
+
+    def _build_fail_links(self) -> None:
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self._goto[node].items():
+                queue.append(child)
+                f = self._fail[node]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                target = self._goto[f].get(ch, 0)
+                self._fail[child] = target if target != child else 0
+                # Çıktıları fail zinciri boyunca birleştir (sadece en küçük sıra gerekli)
+                inherited = self._best[self._fail[child]]
+                own = self._best[child]
+                if inherited is not None and (own is None or inherited < own):
+                    self._best[child] = inherited
+
+    def match(self, text: str) -> Optional[str]:
+        goto, fail, best_at = self._goto, self._fail, self._best
+        node = 0
+        best: Optional[int] = None
+        for ch in text:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            b = best_at[node]
+            if b is not None and (best is None or b < best):
+                best = b
+                if best == 0:
+                    break
+        return self.categories[best] if best is not None else None
+
+
+def load_rules(path: Path = RULES_PATH) -> list[Rule]:
+    data = json.loads(path.read_text(encoding="utf-8"))
+    return [Rule(str(r["category"]), tuple(str(k) for k in r.get("keywords") or ())) for r in data]
+
+
+_lock = threading.Lock()
+_matcher: Optional[RuleMatcher] = None
+_rules_mtime: Optional[float] = None
+_last_check = 0.0
+
+def get_matcher() -> RuleMatcher:
+    """Derlenmiş kural setini döndürür; kural dosyası değiştiyse yeniden derler."""
+    global _matcher, _rules_mtime, _last_check
+
+    now = time.monotonic()
+    if _matcher is not None and now - _last_check < RELOAD_CHECK_INTERVAL:
+        return _matcher
+
+    with _lock:
+        _last_check = now
+        try:
+            mtime = RULES_PATH.stat().st_mtime
+        except OSError:
+            mtime = None
+
+        if _matcher is None or mtime != _rules_mtime:
+            rules = RULES
+            if mtime is not None:
+                try:
+                    rules = load_rules(RULES_PATH)
+                except Exception as e:
+                    print(f"⚠️ Kural dosyası okunamadı ({RULES_PATH}): {e}")
+                    if _matcher is not None:
+                        return _matcher
+            _matcher = RuleMatcher(rules)
+            _rules_mtime = mtime
+        return _matcher
+
+def rules_version() -> str:
+    return get_matcher().version
+
 def categorize(norm_name: str) -> str:
     x = (norm_name or "").strip()
     if not x:
         return "diger"
 
-    # basit keyword eşleme
-    for rule in RULES:
-        for kw in rule.keywords:
-            if kw in x:
-                return rule.category
-
-    return "diger"
+    # tek geçişte çoklu keyword eşleme
+    return get_matcher().match(x) or "diger"
@@ -10,7 +10,117 @@ def connect(db_path: Path = DEFAULT_DB_PATH) -> sqlite3.Connection:
     conn.execute("PRAGMA foreign_keys=ON;")
     return conn
 
+def _ensure_columns(conn: sqlite3.Connection, table: str, columns: dict[str, str]) -> None:
+    # Eski veritabanlarında eksik kolonları ekle (CREATE TABLE IF NOT EXISTS bunu yapmaz)
+    # table_xinfo: generated kolonları da listeler
+    existing = {r[1] for r in conn.execute(f"PRAGMA table_xinfo({table})").fetchall()}
+    for name, decl in columns.items():
+        if name not in existing:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {decl}")
+
+def _ensure_trigger(conn: sqlite3.Connection, name: str, sql: str) -> None:
+    # Tanımı değişen trigger'ı sadece kayıtlı SQL farklıysa yeniden oluştur; güncel şemada yazma yapılmaz
+    # (her DROP/CREATE schema_version'ı artırır, diğer bağlantıların sorgularını yeniden derletir)
+    row = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = ?", (name,)).fetchone()
+    if row is not None and " ".join(row[0].split()) == " ".join(sql.split()):
+        return
+    conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+    conn.execute(sql)
+
+def _init_fts(conn: sqlite3.Connection) -> None:
+    """
+    Ürün adı + işyeri üzerinde FTS5 indeksi, trigger'larla items/receipts/merchants
+    ile senkron tutulur. rowid = item_vectors.vec_id (items'ın rowid'i VACUUM'da
+    değişebilir; vec_id sabittir ve FAISS id'leriyle aynıdır). SQLite FTS5
+    olmadan derlenmişse atlanır; arama tarafı LIKE'a düşer.
+    """
+    exists = has_fts(conn)
+    try:
+        conn.executescript("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS items_fts USING fts5(
+          name_norm, name_raw, merchant,
+          tokenize = 'unicode61 remove_diacritics 2',
+          prefix = '2 3'
+        );
+
+        CREATE TRIGGER IF NOT EXISTS trg_items_fts_insert AFTER INSERT ON items
+        BEGIN
+          -- trigger sırası garanti değil: vec_id satırı yoksa burada açılır
+          INSERT OR IGNORE INTO item_vectors (item_id) VALUES (NEW.id);
+          INSERT INTO items_fts (rowid, name_norm, name_raw, merchant)
+          SELECT v.vec_id, NEW.name_norm, NEW.name_raw,
+                 (SELECT COALESCE(m.canonical_name, r.merchant)
+                  FROM receipts r LEFT JOIN merchants m ON m.id = r.merchant_id
+                  WHERE r.id = NEW.receipt_id)
+          FROM item_vectors v WHERE v.item_id = NEW.id;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_items_fts_update
+        AFTER UPDATE OF name_norm, name_raw, receipt_id ON items
+        BEGIN
+          UPDATE items_fts
+          SET name_norm = NEW.name_norm,
+              name_raw = NEW.name_raw,
+              merchant = (SELECT COALESCE(m.canonical_name, r.merchant)
+                          FROM receipts r LEFT JOIN merchants m ON m.id = r.merchant_id
+                          WHERE r.id = NEW.receipt_id)
+          WHERE rowid = (SELECT vec_id FROM item_vectors WHERE item_id = NEW.id);
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_items_fts_delete AFTER DELETE ON items
+        BEGIN
+          DELETE FROM items_fts WHERE rowid = (SELECT vec_id FROM item_vectors WHERE item_id = OLD.id);
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_receipts_fts_update
+        AFTER UPDATE OF merchant, merchant_id ON receipts
+        BEGIN
+          UPDATE items_fts
+          SET merchant = COALESCE((SELECT canonical_name FROM merchants WHERE id = NEW.merchant_id), NEW.merchant)
+          WHERE rowid IN (
+            SELECT v.vec_id FROM items i JOIN item_vectors v ON v.item_id = i.id
+            WHERE i.receipt_id = NEW.id
+          );
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_merchants_fts_update
+        AFTER UPDATE OF canonical_name ON merchants
+        BEGIN
+          UPDATE items_fts SET merchant = NEW.canonical_name
+          WHERE rowid IN (
+            SELECT v.vec_id
+            FROM receipts r
+            JOIN items i ON i.receipt_id = r.id
+            JOIN item_vectors v ON v.item_id = i.id
+            WHERE r.merchant_id = NEW.id
+          );
+        END;
+        """)
+    except sqlite3.OperationalError as e:
+        if "fts5" not in str(e):
+            raise
+        return
+
+    if not exists:
+        conn.execute("""
+        INSERT INTO items_fts (rowid, name_norm, name_raw, merchant)
+        SELECT v.vec_id, i.name_norm, i.name_raw, COALESCE(m.canonical_name, r.merchant)
+        FROM items i
+        JOIN item_vectors v ON v.item_id = i.id
+        LEFT JOIN receipts r ON r.id = i.receipt_id
+        LEFT JOIN merchants m ON m.id = r.merchant_id
+        """)
+
+def has_fts(conn: sqlite3.Connection) -> bool:
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'items_fts'"
+    ).fetchone() is not None
+
 def init_schema(conn: sqlite3.Connection) -> None:
+    has_item_vectors = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'item_vectors'"
+    ).fetchone() is not None
+
     conn.executescript("""
     CREATE TABLE IF NOT EXISTS receipts (
       id TEXT PRIMARY KEY,
@@ -21,7 +131,10 @@ def init_schema(conn: sqlite3.Connection) -> None:
       merchant TEXT,
       receipt_date TEXT,
       currency TEXT DEFAULT 'TRY',
-      total_amount REAL
+      total_amount REAL,
+
+      -- kanonik işyeri (merchants.id); GROUP BY'lar serbest metin yerine bunu kullanır
+      merchant_id INTEGER
     );
 
     CREATE TABLE IF NOT EXISTS items (
@@ -34,11 +147,159 @@ def init_schema(conn: sqlite3.Connection) -> None:
       unit TEXT,
       amount REAL,
       category TEXT,
+      -- kategorinin kaynağı: 'rule' | 'knn' | 'user'
+      category_source TEXT,
 
       line_no INTEGER,
       evidence_snippet TEXT,
 
+      -- enrich_items'in en son işlediği name_raw (farklıysa satır yeniden zenginleştirilir)
+      enriched_name_raw TEXT,
+
+      -- Enrich sırasında addan bir kez çıkarılan paket bilgisi (birim başına)
+      volume_l REAL,
+      weight_kg REAL,
+      pack_count REAL,
+      -- Türetilmiş kolonlar (qty/amount elle düzeltilse de tutarlı kalır)
+      unit_price REAL GENERATED ALWAYS AS (CASE WHEN qty > 0 THEN amount / qty ELSE amount END) VIRTUAL,
+      liters_total REAL GENERATED ALWAYS AS (qty * COALESCE(pack_count, 1) * volume_l) VIRTUAL,
+      kg_total REAL GENERATED ALWAYS AS (qty * COALESCE(pack_count, 1) * weight_kg) VIRTUAL,
+
+      -- Semantik indeks anahtarı (vocab.vocab_id); index_faiss atar
+      vocab_id INTEGER,
+
       FOREIGN KEY(receipt_id) REFERENCES receipts(id)
     );
+
+    -- Kanonik işyerleri ve bilinen yazım varyantları (merchants.merchant_key ile eşlenir)
+    CREATE TABLE IF NOT EXISTS merchants (
+      id INTEGER PRIMARY KEY,
+      canonical_name TEXT NOT NULL,
+      merchant_key TEXT NOT NULL UNIQUE,
+      block TEXT NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS merchant_aliases (
+      alias_key TEXT PRIMARY KEY,
+      merchant_id INTEGER NOT NULL REFERENCES merchants(id)
+    );
+
+    -- Ham ürün adı -> normalize ad/kategori/paket boyutu sözlüğü.
+    -- enrich_items bu tabloyla join yapar; kullanıcı düzeltmeleri buraya yazılır.
+    CREATE TABLE IF NOT EXISTS product_dictionary (
+      name_raw TEXT PRIMARY KEY,
+      name_norm TEXT,
+      category TEXT,
+      size_value REAL,
+      size_unit TEXT,
+      pack_count REAL,
+      source TEXT NOT NULL,         -- 'rule' | 'knn' | 'user'
+      rules_version TEXT,
+      updated_at TEXT
+    );
+
+    -- Kalem başına sabit tamsayı id (vec_id; FTS rowid'i) ve indeks değişiklik kuyruğu.
+    -- dirty=1: kalemin anahtarı/ayı yeniden hesaplanmalı, deleted=1: indeksten çıkarılmalı.
+    -- indexed_vocab/indexed_shard: yayınlanan indekste kalemin bulunduğu (anahtar, ay) çifti.
+    -- dirty_seq: her kirlenmede artar; kurulum sırasında yeniden kirlenen satır temizlenmez.
+    -- Bayraklar aşağıdaki trigger'larla tutulur; index_faiss sadece kirli satırları işler.
+    CREATE TABLE IF NOT EXISTS item_vectors (
+      vec_id INTEGER PRIMARY KEY AUTOINCREMENT,
+      item_id TEXT NOT NULL UNIQUE,
+      dirty INTEGER NOT NULL DEFAULT 1,
+      deleted INTEGER NOT NULL DEFAULT 0,
+      indexed_vocab INTEGER,
+      indexed_shard TEXT,
+      dirty_seq INTEGER NOT NULL DEFAULT 0
+    );
+
+    -- Semantik indeksin birimi: farklı (ürün, kategori, işyeri) anahtarları.
+    -- Anahtarın kalemleri (posting list) items.vocab_id üzerinden okunur;
+    -- tarih/tutar/miktar koşulları SQL'de uygulanır. Anahtar alanları değişmez.
+    CREATE TABLE IF NOT EXISTS vocab (
+      vocab_id INTEGER PRIMARY KEY AUTOINCREMENT,
+      name_norm TEXT NOT NULL,
+      category TEXT NOT NULL DEFAULT '',
+      merchant TEXT NOT NULL DEFAULT '',
+      UNIQUE(name_norm, category, merchant)
+    );
+
+    -- Fiş düzeyi indeksin sabit tamsayı id'si (receipts.id metin). İşyeri düzeyinde merchants.id kullanılır.
+    CREATE TABLE IF NOT EXISTS receipt_vectors (
+      vec_id INTEGER PRIMARY KEY AUTOINCREMENT,
+      receipt_id TEXT NOT NULL UNIQUE
+    );
+    """)
+    _ensure_columns(conn, "receipts", {"merchant_id": "INTEGER"})
+    _ensure_columns(conn, "items", {
+        "category_source": "TEXT",
+        "enriched_name_raw": "TEXT",
+        "volume_l": "REAL",
+        "weight_kg": "REAL",
+        "pack_count": "REAL",
+        "unit_price": "REAL GENERATED ALWAYS AS (CASE WHEN qty > 0 THEN amount / qty ELSE amount END) VIRTUAL",
+        "liters_total": "REAL GENERATED ALWAYS AS (qty * COALESCE(pack_count, 1) * volume_l) VIRTUAL",
+        "kg_total": "REAL GENERATED ALWAYS AS (qty * COALESCE(pack_count, 1) * weight_kg) VIRTUAL",
+        "vocab_id": "INTEGER",
+    })
+    _ensure_columns(conn, "item_vectors", {
+        "indexed_vocab": "INTEGER",
+        "indexed_shard": "TEXT",
+        "dirty_seq": "INTEGER NOT NULL DEFAULT 0",
+    })
+    _ensure_columns(conn, "product_dictionary", {"pack_count": "REAL"})
+    conn.executescript("""
+    CREATE INDEX IF NOT EXISTS idx_receipts_merchant_id ON receipts(merchant_id);
+    CREATE INDEX IF NOT EXISTS idx_merchants_block ON merchants(block);
+    CREATE INDEX IF NOT EXISTS idx_items_name_raw ON items(name_raw);
+    CREATE INDEX IF NOT EXISTS idx_items_enrich_pending
+      ON items(name_raw) WHERE enriched_name_raw IS NOT name_raw;
+    CREATE INDEX IF NOT EXISTS idx_items_volume ON items(volume_l) WHERE volume_l IS NOT NULL;
+    CREATE INDEX IF NOT EXISTS idx_items_weight ON items(weight_kg) WHERE weight_kg IS NOT NULL;
+    CREATE INDEX IF NOT EXISTS idx_items_unit_price ON items(name_norm, unit_price);
+    CREATE INDEX IF NOT EXISTS idx_items_receipt ON items(receipt_id);
+    CREATE INDEX IF NOT EXISTS idx_item_vectors_dirty ON item_vectors(vec_id) WHERE dirty = 1;
+    CREATE INDEX IF NOT EXISTS idx_items_vocab ON items(vocab_id);
+    CREATE INDEX IF NOT EXISTS idx_receipts_date ON receipts(receipt_date);
     """)
+    # Kalemin anahtarını (ürün, kategori, işyeri) ya da ayını belirleyen alanlar değişince kirlenir.
+    # Her kirlenme dirty_seq'i artırır; eski (dirty_seq'siz) tanımlar değiştirilir.
+    _ensure_trigger(conn, "trg_items_vec_insert", """CREATE TRIGGER trg_items_vec_insert AFTER INSERT ON items
+    BEGIN
+      INSERT INTO item_vectors (item_id) VALUES (NEW.id)
+      ON CONFLICT(item_id) DO UPDATE SET dirty = 1, deleted = 0, dirty_seq = dirty_seq + 1;
+    END""")
+    _ensure_trigger(conn, "trg_items_vec_delete", """CREATE TRIGGER trg_items_vec_delete AFTER DELETE ON items
+    BEGIN
+      UPDATE item_vectors SET dirty = 1, deleted = 1, dirty_seq = dirty_seq + 1 WHERE item_id = OLD.id;
+    END""")
+    _ensure_trigger(conn, "trg_receipts_vec_update", """CREATE TRIGGER trg_receipts_vec_update
+    AFTER UPDATE OF merchant, merchant_id, receipt_date ON receipts
+    WHEN OLD.merchant IS NOT NEW.merchant OR OLD.merchant_id IS NOT NEW.merchant_id
+      OR OLD.receipt_date IS NOT NEW.receipt_date
+    BEGIN
+      UPDATE item_vectors SET dirty = 1, dirty_seq = dirty_seq + 1
+      WHERE item_id IN (SELECT id FROM items WHERE receipt_id = NEW.id);
+    END""")
+    _ensure_trigger(conn, "trg_merchants_vec_update", """CREATE TRIGGER trg_merchants_vec_update
+    AFTER UPDATE OF canonical_name ON merchants
+    WHEN OLD.canonical_name IS NOT NEW.canonical_name
+    BEGIN
+      UPDATE item_vectors SET dirty = 1, dirty_seq = dirty_seq + 1
+      WHERE item_id IN (
+        SELECT i.id FROM receipts r JOIN items i ON i.receipt_id = r.id WHERE r.merchant_id = NEW.id
+      );
+    END""")
+    # Miktar/tutar artık vektöre girmez (SQL'de okunur)
+    _ensure_trigger(conn, "trg_items_vec_update", """CREATE TRIGGER trg_items_vec_update
+    AFTER UPDATE OF name_norm, category, receipt_id ON items
+    WHEN OLD.name_norm IS NOT NEW.name_norm OR OLD.category IS NOT NEW.category
+      OR OLD.receipt_id IS NOT NEW.receipt_id
+    BEGIN
+      UPDATE item_vectors SET dirty = 1, dirty_seq = dirty_seq + 1 WHERE item_id = NEW.id;
+    END""")
+    if not has_item_vectors:
+        # Tablo yeni oluşturulduysa mevcut kalemler bir kez kirli olarak eklenir
+        conn.execute("INSERT OR IGNORE INTO item_vectors (item_id) SELECT id FROM items")
+    _init_fts(conn)
     conn.commit()
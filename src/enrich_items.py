@@ -1,37 +1,71 @@
 from __future__ import annotations
 
 import sqlite3
+import sys
 from .db import connect, init_schema
-from .normalize import normalize_name
-from .categorize import categorize
+from .product_dictionary import dictionary_version, missing_names, compute_entries, upsert_entries, apply_to_items
 
-def main():
+# Tek transaction'da işlenecek satır / ad sayısı
+CHUNK_SIZE = 5000
+
+def _load_knn(conn: sqlite3.Connection):
+    # İkinci aşama (embedding kNN) sadece kullanıcı etiketi varsa ve bağımlılıklar kuruluysa
+    if conn.execute("SELECT 1 FROM product_dictionary WHERE source = 'user' LIMIT 1").fetchone() is None:
+        return None
+    try:
+        from .knn_category import build_knn_categorizer
+        return build_knn_categorizer(conn)
+    except ImportError as e:
+        print(f"⚠️ kNN kategorizasyon atlandı: {e}")
+        return None
+
+def main(full: bool = False, chunk_size: int = CHUNK_SIZE):
     conn = connect()
     init_schema(conn)
 
-    rows = conn.execute("SELECT id, name_raw FROM items").fetchall()
-    if not rows:
+    if full:
+        # Tüm tabloyu yeniden zenginleştir (kural seti / etiketler değiştiğinde).
+        # Kullanıcı düzeltmeleri korunur; kNN için etiket kaynağıdır.
+        with conn:
+            conn.execute("DELETE FROM product_dictionary WHERE source != 'user'")
+            conn.execute("UPDATE items SET enriched_name_raw = NULL WHERE category_source IS NOT 'user'")
+
+    if conn.execute("SELECT 1 FROM items LIMIT 1").fetchone() is None:
+        conn.close()
         print("NO_ITEMS")
         return
 
+    # 1) Sözlükte olmayan (ya da eski kural setiyle hesaplanmış) farklı ham adları hesapla
+    names = missing_names(conn, dictionary_version())
+    knn = _load_knn(conn) if names else None
+    for start in range(0, len(names), chunk_size):
+        entries = compute_entries(conn, names[start : start + chunk_size], knn)
+        with conn:
+            upsert_entries(conn, entries)
+
+    # 2) Bekleyen satırları sözlükle join ederek parça parça güncelle
     updated = 0
-    for item_id, name_raw in rows:
-        norm = normalize_name(name_raw)
-        cat = categorize(norm)
-        conn.execute(
-            "UPDATE items SET name_norm = ?, category = ? WHERE id = ?",
-            (norm, cat, item_id),
-        )
-        updated += 1
+    while True:
+        with conn:
+            n = apply_to_items(conn, chunk_size)
+        if n <= 0:
+            break
+        updated += n
 
-    conn.commit()
+    if updated == 0:
+        conn.close()
+        print("ENRICH_OK: updated=0 (no new or changed items)")
+        return
 
     counts = conn.execute(
         "SELECT category, COUNT(*) FROM items GROUP BY category ORDER BY COUNT(*) DESC"
     ).fetchall()
     conn.close()
 
-    print(f"ENRICH_OK: updated={updated} categories={counts}")
+    print(
+        f"ENRICH_OK: updated={updated} new_names={len(names)} "
+        f"knn_labels={len(knn) if knn else 0} categories={counts}"
+    )
 
 if __name__ == "__main__":
-    main()
+    main(full="--full" in sys.argv[1:])
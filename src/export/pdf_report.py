@@ -137,12 +137,14 @@ class PDFReportGenerator:
         start_date = f"{year}-{month:02d}-01"
         end_date = f"{year}-{month:02d}-31"
         
+        # Kanonik işyeri anahtarıyla grupla ("MIGROS" / "Migros Ticaret A.S." tek satır)
         rows = conn.execute("""
-            SELECT r.merchant, SUM(i.amount) as total, COUNT(DISTINCT r.id) as visits
+            SELECT COALESCE(m.canonical_name, MAX(r.merchant)), SUM(i.amount) as total, COUNT(DISTINCT r.id) as visits
             FROM items i
             JOIN receipts r ON i.receipt_id = r.id
+            LEFT JOIN merchants m ON m.id = r.merchant_id
             WHERE r.receipt_date BETWEEN ? AND ?
-            GROUP BY r.merchant
+            GROUP BY COALESCE(r.merchant_id, r.merchant)
             ORDER BY total DESC
             LIMIT ?
         """, (start_date, end_date, limit)).fetchall()
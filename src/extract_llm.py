@@ -9,6 +9,7 @@ from pathlib import Path
 from llama_cpp import Llama
 
 from .db import connect, init_schema
+from .merchants import MerchantResolver
 
 MODEL_PATH = r"models\qwen2.5-7b-instruct-q4_k_m-00001-of-00002.gguf"
 PROMPT_PATH = Path("prompts/extract_receipt_tr.txt")
@@ -93,14 +94,18 @@ def extract_first_json(s: str) -> dict:
         return json.loads(fixed)
 
 
-def upsert_receipt_fields(conn: sqlite3.Connection, rid: str, merchant: str, date: str, currency: str, total_amount):
+def upsert_receipt_fields(conn: sqlite3.Connection, rid: str, merchant: str, date: str, currency: str, total_amount,
+                          resolver: MerchantResolver | None = None):
+    # İşyeri ingest sırasında kanonik merchant_id'ye eşlenir (artımlı)
+    resolver = resolver or MerchantResolver(conn)
+    merchant_id = resolver.resolve(merchant)
     conn.execute(
         """
         UPDATE receipts
-        SET merchant = ?, receipt_date = ?, currency = ?, total_amount = ?
+        SET merchant = ?, merchant_id = ?, receipt_date = ?, currency = ?, total_amount = ?
         WHERE id = ?
         """,
-        (merchant or None, date or None, currency or "TRY", coerce_number(total_amount), rid),
+        (merchant or None, merchant_id, date or None, currency or "TRY", coerce_number(total_amount), rid),
     )
 
 
@@ -162,6 +167,7 @@ def main():
         return
 
     llm = Llama(model_path=MODEL_PATH, n_ctx=4096, n_threads=8, verbose=False)
+    resolver = MerchantResolver(conn)
 
     processed = 0
     skipped = 0
@@ -182,7 +188,7 @@ def main():
         tot = data.get("total_amount")
         items = data.get("items") or []
 
-        upsert_receipt_fields(conn, rid, m, d, cur, tot)
+        upsert_receipt_fields(conn, rid, m, d, cur, tot, resolver)
         insert_items(conn, rid, items)
         conn.commit()
 
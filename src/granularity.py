@@ -0,0 +1,169 @@
+from __future__ import annotations
+
+import json
+import sqlite3
+from dataclasses import replace
+from typing import Optional
+
+from .index_meta import LEVEL_RECEIPT
+from .merchants import lookup_merchant
+from .query_parse import QuerySpec
+from .query_plan import filter_sql
+from .retrieve import search_level
+
+# Prompt'a kanıt olarak giren fiş/işyeri satırı (satır başına bir fiş/işyeri, kalem değil)
+EVIDENCE_ROWS = 5
+# Sonuçlarda listelenen en fazla tarih/işyeri sayısı
+MAX_LISTED = 31
+
+# Fiş başına tek satır: (id, tarih, işyeri, kaynak, fiş toplamı, kalem sayısı).
+# Fiş toplamı yoksa kalem tutarlarının toplamı kullanılır.
+RECEIPT_SELECT = """
+    SELECT
+      r.id AS receipt_id,
+      r.receipt_date AS receipt_date,
+      COALESCE(m.canonical_name, r.merchant) AS merchant,
+      r.source_path AS source_path,
+      COALESCE(r.total_amount, SUM(i.amount)) AS total,
+      COUNT(i.id) AS item_count
+    FROM receipts r
+    JOIN items i ON i.receipt_id = r.id
+    LEFT JOIN merchants m ON m.id = r.merchant_id
+"""
+
+def _receipt_where(spec: QuerySpec) -> tuple[str, list]:
+    # Kategori fişin kalemlerini değil fişin kendisini seçer: o kategoride kalemi olan fişler (toplam tam fiş)
+    where, params = filter_sql(replace(spec, category=None))
+    if spec.category:
+        where += " AND r.id IN (SELECT receipt_id FROM items WHERE category = ?)"
+        params.append(spec.category)
+    return where, params
+
+def receipt_query(
+    spec: QuerySpec, vec_ids: Optional[list[int]] = None, merchant_ids: Optional[list[int]] = None
+) -> tuple[str, list]:
+    """Filtreye ve verildiyse fiş/işyeri düzeyi arama sonucuna uyan fişlerin SQL'i ve parametreleri."""
+    where, params = _receipt_where(spec)
+    if vec_ids is not None:
+        where += " AND r.id IN (SELECT receipt_id FROM receipt_vectors WHERE vec_id IN (SELECT value FROM json_each(?)))"
+        params.append(json.dumps(vec_ids))
+    if merchant_ids is not None:
+        where += " AND r.merchant_id IN (SELECT value FROM json_each(?))"
+        params.append(json.dumps(merchant_ids))
+    return f"{RECEIPT_SELECT} WHERE 1 = 1{where} GROUP BY r.id", params
+
+def fetch_receipts(conn: sqlite3.Connection, spec: QuerySpec, vec_ids: Optional[list[int]] = None) -> list[dict]:
+    sql, params = receipt_query(spec, vec_ids)
+    return [
+        {"receipt_id": r[0], "date": r[1], "merchant": r[2], "source_path": r[3], "total": r[4], "item_count": r[5]}
+        for r in conn.execute(sql, params)
+    ]
+
+def fetch_merchants(conn: sqlite3.Connection, spec: QuerySpec, merchant_ids: Optional[list[int]] = None) -> list[dict]:
+    """İşyeri başına ziyaret (fiş) sayısı, toplam harcama ve son ziyaret; harcamaya göre azalan."""
+    sql, params = receipt_query(spec, merchant_ids=merchant_ids)
+    rows = conn.execute(
+        f"""
+        SELECT COALESCE(t.merchant, 'UNKNOWN'), COUNT(*), SUM(t.total), MAX(t.receipt_date)
+        FROM ({sql}) t
+        GROUP BY 1
+        ORDER BY 3 DESC
+        """,
+        params,
+    ).fetchall()
+    return [{"merchant": r[0], "visits": r[1], "total": r[2], "last_visit": r[3]} for r in rows]
+
+def receipt_sort_key(question: str):
+    """En pahalı/ucuz fiş soruları tutara göre sıralanır; diğerleri için None."""
+    x = (question or "").lower()
+    if any(k in x for k in ("pahal", "yüksek", "yuksek", "büyük", "buyuk")):
+        return lambda r: -float(r.get("total") or 0.0)
+    if any(k in x for k in ("ucuz", "düşük", "dusuk", "küçük", "kucuk")):
+        return lambda r: float(r.get("total") or 0.0)
+    return None
+
+def build_receipt_results(receipts: list[dict]) -> dict:
+    total = sum(float(r["total"] or 0.0) for r in receipts)
+    by_merchant: dict[str, float] = {}
+    for r in receipts:
+        m = r.get("merchant") or "UNKNOWN"
+        by_merchant[m] = by_merchant.get(m, 0.0) + float(r["total"] or 0.0)
+    top = max(receipts, key=lambda r: float(r["total"] or 0.0))
+    return {
+        "granularity": "receipt",
+        "matched_receipt_count": len(receipts),
+        "matched_total_amount_try": round(total, 2),
+        "dates": sorted({r["date"] for r in receipts if r.get("date")})[-MAX_LISTED:],
+        "by_merchant_try": {
+            k: round(v, 2) for k, v in sorted(by_merchant.items(), key=lambda x: -x[1])[:MAX_LISTED]
+        },
+        "most_expensive_receipt": {
+            "date": top["date"], "merchant": top["merchant"], "total_try": round(float(top["total"] or 0.0), 2),
+        },
+    }
+
+def format_receipt_evidence(receipts_sorted: list[dict], limit: int = EVIDENCE_ROWS) -> str:
+    return "\n".join(
+        f"- {r.get('date')} | {r.get('merchant')} | fiş toplamı={r.get('total')} ({r.get('item_count')} kalem)"
+        f" | source: {r.get('source_path')}"
+        for r in receipts_sorted[:limit]
+    )
+
+def build_merchant_results(merchants: list[dict]) -> dict:
+    return {
+        "granularity": "merchant",
+        "matched_merchant_count": len(merchants),
+        "matched_total_amount_try": round(sum(float(m["total"] or 0.0) for m in merchants), 2),
+        "merchants": [
+            {
+                "merchant": m["merchant"], "visits": m["visits"],
+                "total_try": round(float(m["total"] or 0.0), 2), "last_visit": m["last_visit"],
+            }
+            for m in merchants[:MAX_LISTED]
+        ],
+    }
+
+def format_merchant_evidence(merchants: list[dict], limit: int = EVIDENCE_ROWS) -> str:
+    return "\n".join(
+        f"- {m.get('merchant')} | ziyaret={m.get('visits')} | toplam={round(float(m.get('total') or 0.0), 2)}"
+        f" | son ziyaret: {m.get('last_visit')}"
+        for m in merchants[:limit]
+    )
+
+def level_context(conn: sqlite3.Connection, question: str, spec: QuerySpec) -> Optional[tuple[dict, str]]:
+    """
+    Fiş/işyeri düzeyindeki soru için (hesaplanmış sonuçlar, kanıt); kayıt yoksa None.
+    Ürün terimi bilinen bir işyeriyse SQL filtresine çevrilir ("Migros'a gittiğim
+    günler"); kalan terim düzeyin indeksinde aranır, terim yoksa filtreye uyan
+    tüm fişler/işyerleri özetlenir.
+    """
+    term = spec.product_term
+    if term and spec.merchant_id is None:
+        merchant_id = lookup_merchant(conn, term)
+        if merchant_id is not None:
+            spec, term = replace(spec, merchant_id=merchant_id, product_term=None), None
+    hits = search_level(spec.granularity, term, spec, conn=conn) if term else None
+    rank = {key: i for i, (key, _) in enumerate(hits or [])}
+
+    if spec.granularity == LEVEL_RECEIPT:
+        receipts = fetch_receipts(conn, spec, list(rank) if hits is not None else None)
+        if not receipts:
+            return None
+        key = receipt_sort_key(question)
+        if key is None:
+            # Arama sonucunda alaka sırası, diğerlerinde yeniden eskiye
+            receipts.sort(key=lambda r: r.get("date") or "", reverse=True)
+            if hits is not None:
+                vec_of = dict(conn.execute(
+                    "SELECT receipt_id, vec_id FROM receipt_vectors WHERE receipt_id IN (SELECT value FROM json_each(?))",
+                    (json.dumps([r["receipt_id"] for r in receipts]),),
+                ).fetchall())
+                receipts.sort(key=lambda r: rank.get(vec_of.get(r["receipt_id"]), len(rank)))
+        else:
+            receipts.sort(key=key)
+        return build_receipt_results(receipts), format_receipt_evidence(receipts)
+
+    merchants = fetch_merchants(conn, spec, list(rank) if hits is not None else None)
+    if not merchants:
+        return None
+    return build_merchant_results(merchants), format_merchant_evidence(merchants)
@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+import os
+import time
+from pathlib import Path
+
+import faiss
+import numpy as np
+import pandas as pd
+
+from .db import connect, init_schema
+from .index_faiss import KEY_SQL, build_doc_text, encode_texts
+from .index_factory import INDEX_KINDS, apply_search_params, build_index, make_spec, train_index
+
+# Ölçüm için kullanılacak en fazla anahtar ve sorgu sayısı
+BENCH_MAX_ITEMS = int(os.getenv("INDEX_BENCH_MAX_ITEMS", "200000"))
+BENCH_QUERIES = int(os.getenv("INDEX_BENCH_QUERIES", "200"))
+TOP_K = 10
+
+# Arama zamanı parametre taraması (IVF: nprobe, HNSW: efSearch)
+NPROBE_SWEEP = (1, 4, 16, 64)
+EF_SWEEP = (16, 64, 256)
+
+OUT_DIR = Path("data/reports")
+OUT_PATH = OUT_DIR / "index_benchmark.csv"
+
+def load_corpus(conn, limit: int) -> tuple[np.ndarray, np.ndarray]:
+    # İndeksin birimi: farklı (ürün, kategori, işyeri) anahtarları
+    rows = conn.execute(
+        f"""
+        SELECT * FROM (
+          SELECT DISTINCT {KEY_SQL}
+          FROM items i
+          JOIN receipts r ON r.id = i.receipt_id
+          LEFT JOIN merchants m ON m.id = r.merchant_id
+        )
+        ORDER BY RANDOM()
+        LIMIT ?
+        """,
+        (limit,),
+    ).fetchall()
+    docs = [build_doc_text(r) for r in rows]
+    emb = encode_texts(docs) if docs else np.zeros((0, 0), dtype="float32")
+    return emb, np.arange(len(docs), dtype="int64")
+
+def load_queries(conn, limit: int) -> np.ndarray:
+    # Ürün aramalarına benzer kısa sorgular: rastgele normalize ürün adları
+    names = [r[0] for r in conn.execute(
+        "SELECT DISTINCT name_norm FROM items WHERE name_norm IS NOT NULL AND name_norm != '' ORDER BY RANDOM() LIMIT ?",
+        (limit,),
+    ).fetchall()]
+    return encode_texts(names) if names else np.zeros((0, 0), dtype="float32")
+
+def _recall(found: np.ndarray, truth: np.ndarray) -> float:
+    hits = [len(set(f[f >= 0].tolist()) & set(t[t >= 0].tolist())) for f, t in zip(found, truth)]
+    return float(np.mean(hits)) / truth.shape[1]
+
+def _latency_ms(index: faiss.Index, queries: np.ndarray, k: int) -> tuple[float, np.ndarray]:
+    # Tek tek sorgu (asistandaki kullanım şekli)
+    out = np.empty((queries.shape[0], k), dtype="int64")
+    t0 = time.perf_counter()
+    for i in range(queries.shape[0]):
+        _, I = index.search(queries[i : i + 1], k)
+        out[i] = I[0]
+    return (time.perf_counter() - t0) * 1000 / max(queries.shape[0], 1), out
+
+def main():
+    conn = connect()
+    init_schema(conn)
+    emb, ids = load_corpus(conn, BENCH_MAX_ITEMS)
+    queries = load_queries(conn, BENCH_QUERIES)
+    conn.close()
+
+    if emb.shape[0] == 0 or queries.shape[0] == 0:
+        print("NO_ITEMS")
+        return
+
+    n, dim = emb.shape
+    k = min(TOP_K, n)
+    exact = faiss.IndexFlatIP(dim)
+    exact.add(emb)
+    _, truth = exact.search(queries, k)
+
+    rows = []
+    for kind in INDEX_KINDS:
+        spec = make_spec(kind, n, dim)
+        t0 = time.perf_counter()
+        index = build_index(spec, dim)
+        try:
+            train_index(index, spec, emb)
+        except RuntimeError as e:
+            # Örn. PQ eğitimi için korpus çok küçük
+            print(f"⚠️ {kind} atlandı: {e}")
+            continue
+        index.add_with_ids(emb, ids)
+        build_s = time.perf_counter() - t0
+        size_mb = len(faiss.serialize_index(index)) / (1024 * 1024)
+
+        if spec.is_ivf:
+            sweep = [("nprobe", p) for p in NPROBE_SWEEP if p <= spec.nlist]
+        elif kind == "hnsw":
+            sweep = [("ef_search", e) for e in EF_SWEEP]
+        else:
+            sweep = [("-", 0)]
+
+        for param, value in sweep:
+            if param == "nprobe":
+                apply_search_params(index, spec, nprobe=value)
+            elif param == "ef_search":
+                spec.ef_search = value
+                apply_search_params(index, spec)
+            ms, found = _latency_ms(index, queries, k)
+            rows.append({
+                "kind": kind,
+                "nlist": spec.nlist,
+                "pq_m": spec.pq_m,
+                "param": param,
+                "value": value,
+                f"recall_at_{k}": round(_recall(found, truth), 4),
+                "ms_per_query": round(ms, 3),
+                "build_s": round(build_s, 2),
+                "index_mb": round(size_mb, 1),
+            })
+
+    df = pd.DataFrame(rows)
+    OUT_DIR.mkdir(parents=True, exist_ok=True)
+    df.to_csv(OUT_PATH, index=False, encoding="utf-8")
+
+    print(f"INDEX_BENCH_OK: items={n} queries={queries.shape[0]} dim={dim} -> {OUT_PATH}")
+    print(df.to_string(index=False))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+from __future__ import annotations
+
+import math
+import os
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Optional
+
+import faiss
+import numpy as np
+
+# flat | ivf_flat | ivf_sq8 | ivf_pq | hnsw | auto (boyut ve bellek bütçesine göre)
+INDEX_KIND = os.getenv("FAISS_INDEX_KIND", "auto")
+# Vektör indeksi için ayrılan bellek (MB); auto seçimde sıkıştırma seviyesini belirler
+MEMORY_BUDGET_MB = float(os.getenv("FAISS_MEMORY_BUDGET_MB", "1024"))
+
+INDEX_KINDS = ("flat", "ivf_flat", "ivf_sq8", "ivf_pq", "hnsw")
+
+# Bu boyutun altında brute force zaten birkaç ms; yaklaşık indekse gerek yok
+FLAT_MAX_ITEMS = 100_000
+# IVF eğitimi için liste başına örnek sayısı (FAISS 39'un altında uyarı verir)
+TRAIN_POINTS_PER_LIST = 64
+HNSW_M = 32
+
+
+@dataclass
+class IndexSpec:
+    """İndeks tipi ve parametreleri (manifest'e yazılır, aramada tekrar uygulanır)."""
+    kind: str
+    nlist: int = 0
+    pq_m: int = 0
+    hnsw_m: int = 0
+    nprobe: int = 0
+    ef_search: int = 0
+
+    @property
+    def is_ivf(self) -> bool:
+        return self.kind.startswith("ivf")
+
+    @property
+    def supports_remove(self) -> bool:
+        # HNSW grafından vektör silinemez; değişiklikte yeniden kurulur
+        return self.kind != "hnsw"
+
+    def bytes_per_vector(self, dim: int) -> int:
+        # Yaklaşık: kodlar + 8 bayt id
+        if self.kind == "ivf_sq8":
+            return dim + 8
+        if self.kind == "ivf_pq":
+            return self.pq_m + 8
+        if self.kind == "hnsw":
+            return dim * 4 + self.hnsw_m * 2 * 4 + 8
+        return dim * 4 + 8
+
+    def train_size(self, n: int) -> int:
+        return min(n, self.nlist * TRAIN_POINTS_PER_LIST) if self.is_ivf else 0
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "IndexSpec":
+        return cls(**{k: d[k] for k in cls.__dataclass_fields__ if k in d})
+
+
+def _pq_m(dim: int) -> int:
+    # dim'i bölen en büyük alt-kuantizör sayısı (alt vektör başına >= 4 boyut)
+    for m in (64, 48, 32, 24, 16, 12, 8, 4, 2, 1):
+        if dim % m == 0 and dim // m >= 4:
+            return m
+    return 1
+
+def make_spec(kind: str, n: int, dim: int) -> IndexSpec:
+    """Verilen tip için korpus boyutuna göre parametreleri hesaplar."""
+    if kind not in INDEX_KINDS:
+        raise ValueError(f"Bilinmeyen indeks tipi: {kind} (seçenekler: {', '.join(INDEX_KINDS)})")
+    if kind == "flat":
+        return IndexSpec("flat")
+    if kind == "hnsw":
+        return IndexSpec("hnsw", hnsw_m=HNSW_M, ef_search=64)
+
+    nlist = int(min(65536, max(16, 4 * math.sqrt(max(n, 1)))))
+    # Eğitim örneği korpustan büyük olamaz
+    nlist = max(1, min(nlist, n // 39 if n >= 39 else 1))
+    nprobe = min(nlist, max(8, nlist // 32))
+    return IndexSpec(kind, nlist=nlist, pq_m=_pq_m(dim) if kind == "ivf_pq" else 0, nprobe=nprobe)
+
+def select_spec(n: int, dim: int, kind: str = INDEX_KIND, budget_mb: float = MEMORY_BUDGET_MB) -> IndexSpec:
+    """
+    kind='auto' ise: küçük korpusta Flat, büyükte bütçeye sığan en az
+    sıkıştırılmış IVF (Flat -> SQ8 -> PQ). IVF'ler silme/ekleme destekler,
+    bu yüzden artımlı güncellemede HNSW'ye tercih edilir.
+    """
+    if kind != "auto":
+        return make_spec(kind, n, dim)
+    if n <= FLAT_MAX_ITEMS:
+        return make_spec("flat", n, dim)
+
+    budget = budget_mb * 1024 * 1024 * 0.8
+    for k in ("ivf_flat", "ivf_sq8", "ivf_pq"):
+        spec = make_spec(k, n, dim)
+        if n * spec.bytes_per_vector(dim) <= budget:
+            return spec
+    return make_spec("ivf_pq", n, dim)
+
+def build_index(spec: IndexSpec, dim: int) -> faiss.Index:
+    """Boş (gerekirse eğitilmemiş) ve id eşlemeli bir indeks oluşturur."""
+    metric = faiss.METRIC_INNER_PRODUCT  # normalize vektörlerde cosine
+    if spec.kind == "flat":
+        return faiss.IndexIDMap2(faiss.IndexFlatIP(dim))
+    if spec.kind == "hnsw":
+        return faiss.IndexIDMap2(faiss.index_factory(dim, f"HNSW{spec.hnsw_m},Flat", metric))
+    # IVF indeksleri id'leri kendileri tutar (add_with_ids / remove_ids)
+    code = {"ivf_flat": "Flat", "ivf_sq8": "SQ8", "ivf_pq": f"PQ{spec.pq_m}x8"}[spec.kind]
+    return faiss.index_factory(dim, f"IVF{spec.nlist},{code}", metric)
+
+def train_index(index: faiss.Index, spec: IndexSpec, sample: np.ndarray, seed: int = 0) -> None:
+    if index.is_trained:
+        return
+    n = spec.train_size(sample.shape[0])
+    if n < sample.shape[0]:
+        rng = np.random.default_rng(seed)
+        sample = sample[rng.choice(sample.shape[0], n, replace=False)]
+    index.train(np.ascontiguousarray(sample, dtype="float32"))
+
+def apply_search_params(index: faiss.Index, spec: IndexSpec, nprobe: Optional[int] = None) -> None:
+    """nprobe / efSearch gibi arama zamanı parametrelerini uygular."""
+    if spec.is_ivf:
+        faiss.extract_index_ivf(index).nprobe = int(nprobe or spec.nprobe or 1)
+    elif spec.kind == "hnsw":
+        inner = faiss.downcast_index(index.index if isinstance(index, faiss.IndexIDMap) else index)
+        inner.hnsw.efSearch = int(spec.ef_search or 64)
+
+def read_index(path: Path, spec: IndexSpec, mmap: bool = False) -> faiss.Index:
+    """
+    Shard dosyasını okur. mmap=True: salt okunur, bellek eşlemeli (sayfa cache'i
+    aynı dosyayı açan süreçler arasında paylaşılır). IVF'de ters listeler
+    dosyanın içinden on-disk olarak, Flat/HNSW'de vektör kodları eşlenir.
+    Eşlenmiş indekse ekleme/silme yapılamaz (builder mmap kullanmaz).
+    """
+    if not mmap:
+        return faiss.read_index(str(path))
+    flags = faiss.IO_FLAG_READ_ONLY | (faiss.IO_FLAG_MMAP if spec.is_ivf else faiss.IO_FLAG_MMAP_IFC)
+    return faiss.read_index(str(path), flags)
+
+def index_ids(index: faiss.Index) -> np.ndarray:
+    """IndexIDMap tabanlı indeksteki id'ler (HNSW'de silme gerekip gerekmediğini anlamak için)."""
+    if isinstance(index, faiss.IndexIDMap):
+        return faiss.vector_to_array(index.id_map)
+    raise TypeError("index_ids sadece IndexIDMap için desteklenir")
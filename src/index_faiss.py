@@ -1,94 +1,648 @@
 from __future__ import annotations
 
+from collections import deque
+from datetime import date, datetime
 import json
+import os
 from pathlib import Path
+import shutil
 import sqlite3
+import sys
+from typing import Optional
 
 import faiss
 import numpy as np
-from sentence_transformers import SentenceTransformer
-
 from .db import connect, init_schema
+from .ai.embed_cache import get_embedding_cache
+from .ai.embedder import EmbedPool, embedder_name, get_embedder, pool_size
+from .index_factory import INDEX_KIND, IndexSpec, build_index, select_spec, train_index
+from .index_meta import (
+    INDEX_DIR, INDEX_UNIT, LEVEL_MERCHANT, LEVEL_RECEIPT, LEVELS, MERCHANT_SHARD, SHARD_SQL, UNDATED_SHARD,
+    level_path, levels_exist, meta_exists, publish_version, read_manifest, shard_path, staging_dir, version_dir,
+    write_vocab_meta,
+)
+
+# Akışlı kurulum: DB'den bir seferde okunup encode edilen satır sayısı (bellek üst sınırını belirler)
+CHUNK_ROWS = int(os.getenv("INDEX_CHUNK_ROWS", "4096"))
+# Chunk içinde modele verilen batch boyutu
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+# Süreç havuzu (EMBED_WORKERS > 1), bir chunk'ta en az bu kadar yeni metin görülünce açılır;
+# küçük artımlı güncellemeler modeli tek süreçte yükler
+POOL_MIN_TEXTS = int(os.getenv("EMBED_POOL_MIN_TEXTS", "1024"))
+# Yarıda kalan kurulumun tamamlanan shard'ları (staging klasöründe)
+CHECKPOINT_FILE = "checkpoint.json"
+# Fiş/işyeri dokümanlarına giren en fazla farklı ürün adı (doküman model girdi sınırını aşmasın)
+RECEIPT_DOC_MAX_ITEMS = 30
+MERCHANT_DOC_MAX_ITEMS = 40
+
+# Bu kadar ay geride kalan shard'lar bir kez sıkıştırılıp dondurulur (0 = içinde bulunulan ay hariç hepsi)
+FREEZE_AFTER_MONTHS = int(os.getenv("INDEX_FREEZE_MONTHS", "2"))
 
-# Multilingual embedding modeli (yerelde cache'lenir)
-EMB_MODEL_NAME = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+# Sürüm klasörlerinden önceki düz dosya düzeni (ilk sürümlü kurulumda silinir)
+LEGACY_PATHS = [
+    INDEX_DIR / name
+    for name in (
+        "items.faiss", "items_meta.jsonl", "items_vec_ids.npy", "items_item_ids.npy",
+        "items_day.npy", "items_cat.npy", "items_categories.json",
+    )
+]
 
-INDEX_DIR = Path("data/index")
-INDEX_PATH = INDEX_DIR / "items.faiss"
-META_PATH = INDEX_DIR / "items_meta.jsonl"
+def _join_parts(parts: list[str]) -> str:
+    return " | ".join([p for p in parts if p.split(":", 1)[1].strip()])
 
 def build_doc_text(row) -> str:
-    # row: (item_id, receipt_id, merchant, receipt_date, name_norm, category, qty, unit, amount)
-    item_id, receipt_id, merchant, date, name_norm, category, qty, unit, amount = row
-    parts = [
+    # row: (name_norm, category, merchant) -- vocab anahtarı; tarih/miktar/tutar SQL'de kalır
+    name_norm, category, merchant = row
+    return _join_parts([
         f"merchant: {merchant or ''}",
-        f"date: {date or ''}",
         f"item: {name_norm or ''}",
         f"category: {category or ''}",
-        f"qty: {qty if qty is not None else ''} {unit or ''}".strip(),
-        f"amount: {amount if amount is not None else ''}",
-    ]
-    return " | ".join([p for p in parts if p.strip()])
+    ])
+
+def build_receipt_doc(merchant: str, names: list[str], categories: set[str]) -> str:
+    # Fiş özeti: işyeri, ürünler (fiş sırasıyla), kategoriler; tarih ve toplam SQL'de kalır
+    return _join_parts([
+        f"merchant: {merchant or ''}",
+        f"items: {', '.join(names[:RECEIPT_DOC_MAX_ITEMS])}",
+        f"categories: {', '.join(sorted(categories))}",
+    ])
+
+def build_merchant_doc(merchant: str, names: list[str], categories: set[str]) -> str:
+    # İşyeri özeti: kategoriler ve en sık alınan ürünler
+    return _join_parts([
+        f"merchant: {merchant or ''}",
+        f"categories: {', '.join(sorted(categories))}",
+        f"items: {', '.join(names[:MERCHANT_DOC_MAX_ITEMS])}",
+    ])
+
+def encode_texts(texts: list[str]) -> np.ndarray:
+    # Model sadece cache'te olmayan metin varsa yüklenir
+    return get_embedding_cache().encode(
+        embedder_name(), texts, lambda missing: get_embedder().encode(missing, batch_size=EMBED_BATCH_SIZE)
+    )
+
+def previous_version(manifest: Optional[dict]) -> Optional[Path]:
+    """Artımlı güncellemenin temel alacağı yayınlanmış sürüm (yoksa/uyumsuzsa None -> tam kurulum)."""
+    if not manifest or manifest.get("version") is None or "shards" not in manifest:
+        return None
+    # Kalem bazlı eski indeks (unit yok) anahtar bazlıya artımlı çevrilemez
+    if manifest.get("unit") != INDEX_UNIT:
+        return None
+    # Embedding backend'i değiştiyse (örn. torch -> onnx-int8) vektörler yeniden hesaplanır
+    if manifest.get("model") != embedder_name():
+        return None
+    root = version_dir(manifest["version"])
+    if not meta_exists(root) or any(not shard_path(root, n).exists() for n in manifest["shards"]):
+        return None
+    # Fiş/işyeri düzeyleri olmayan eski sürüm: düzeyler bir kez tam kurulumla eklenir
+    if not levels_exist(root, manifest):
+        return None
+    return root
+
+def needs_reselect(entry: dict, n_live: int) -> bool:
+    """Shard'ın indeks tipi yeniden seçilmeli mi (ayar değişti ya da shard 2 katına çıktı/yarıya indi)."""
+    kind = (entry.get("spec") or {}).get("kind")
+    if INDEX_KIND != "auto":
+        return kind != INDEX_KIND
+    built = int(entry.get("built_items") or 0)
+    return n_live > 2 * max(built, 1000) or n_live < built // 2
+
+def freeze_cutoff(today: Optional[date] = None) -> str:
+    """Bu aydan önceki ("YYYY-MM" < cutoff) shard'lar donmuş sayılır."""
+    today = today or date.today()
+    m = today.year * 12 + today.month - 1 - FREEZE_AFTER_MONTHS
+    return f"{m // 12:04d}-{m % 12 + 1:02d}"
+
+def is_frozen_month(name: str, cutoff: str) -> bool:
+    return name != UNDATED_SHARD and name < cutoff
+
+# Kalemin indeks anahtarı: (ürün, kategori, işyeri); vocab tablosundaki sırayla
+KEY_SQL = "COALESCE(i.name_norm, ''), COALESCE(i.category, ''), COALESCE(m.canonical_name, r.merchant, '')"
+
+def mark_all_dirty(conn: sqlite3.Connection) -> None:
+    with conn:
+        conn.execute("DELETE FROM item_vectors WHERE deleted = 1")
+        conn.execute("UPDATE item_vectors SET dirty = 1, dirty_seq = dirty_seq + 1")
+
+def fetch_docs(conn: sqlite3.Connection, vocab_ids: list[int]) -> dict[int, str]:
+    """vocab_id -> indekslenen doküman metni (meta deposunda metin tutulmaz)."""
+    if not vocab_ids:
+        return {}
+    q = ",".join(["?"] * len(vocab_ids))
+    rows = conn.execute(
+        f"SELECT vocab_id, name_norm, category, merchant FROM vocab WHERE vocab_id IN ({q})",
+        [int(v) for v in vocab_ids],
+    ).fetchall()
+    return {r[0]: build_doc_text(r[1:]) for r in rows}
+
+def stage_dirty_keys(conn: sqlite3.Connection) -> np.ndarray:
+    """
+    Kirli kalemlerin anahtarını vocab'a ekler ve yeni (ay, anahtar) çiftlerini
+    temp.dirty_keys'e yazar (silinenlerde vocab_id NULL; seq: o anki dirty_seq). items.vocab_id ve
+    indexed_* sürüm yayınlanırken güncellenir; o zamana kadar yayınlanmış
+    indeksi gösterirler. Kirli vec_id'leri döndürür.
+    """
+    with conn:
+        # Anahtarlar değişmez; yeni eklenenler kurulum yarıda kalsa da kalır (tekrar denemede aynı id)
+        conn.execute(f"""
+            INSERT OR IGNORE INTO vocab (name_norm, category, merchant)
+            SELECT DISTINCT {KEY_SQL}
+            FROM item_vectors v
+            JOIN items i ON i.id = v.item_id
+            LEFT JOIN receipts r ON r.id = i.receipt_id
+            LEFT JOIN merchants m ON m.id = r.merchant_id
+            WHERE v.dirty = 1 AND v.deleted = 0
+        """)
+    conn.executescript("""
+        DROP TABLE IF EXISTS temp.dirty_keys;
+        CREATE TEMP TABLE dirty_keys (vec_id INTEGER PRIMARY KEY, item_id TEXT, shard TEXT, vocab_id INTEGER, seq INTEGER);
+        DROP TABLE IF EXISTS temp.affected;
+        CREATE TEMP TABLE affected (shard TEXT, vocab_id INTEGER, PRIMARY KEY (shard, vocab_id)) WITHOUT ROWID;
+        DROP TABLE IF EXISTS temp.pairs;
+        CREATE TEMP TABLE pairs (shard TEXT, vocab_id INTEGER, PRIMARY KEY (shard, vocab_id)) WITHOUT ROWID;
+    """)
+    conn.execute(f"""
+        INSERT INTO temp.dirty_keys (vec_id, item_id, shard, vocab_id, seq)
+        SELECT v.vec_id, v.item_id, {SHARD_SQL}, k.vocab_id, v.dirty_seq
+        FROM item_vectors v
+        LEFT JOIN items i ON i.id = v.item_id AND v.deleted = 0
+        LEFT JOIN receipts r ON r.id = i.receipt_id
+        LEFT JOIN merchants m ON m.id = r.merchant_id
+        LEFT JOIN vocab k ON i.id IS NOT NULL AND (k.name_norm, k.category, k.merchant) = ({KEY_SQL})
+        WHERE v.dirty = 1
+    """)
+    # İçeriği değişebilecek çiftler: kirli kalemlerin eski ve yeni (ay, anahtar) çiftleri
+    conn.execute("""
+        INSERT OR IGNORE INTO temp.affected
+        SELECT indexed_shard, indexed_vocab FROM item_vectors WHERE dirty = 1 AND indexed_vocab IS NOT NULL
+    """)
+    conn.execute("INSERT OR IGNORE INTO temp.affected SELECT shard, vocab_id FROM temp.dirty_keys WHERE vocab_id IS NOT NULL")
+    # Güncelleme sonrası indekste olacak çiftler (kirli olmayanlar yayınlanmış yerlerinde kalır)
+    conn.execute("""
+        INSERT OR IGNORE INTO temp.pairs
+        SELECT COALESCE(d.shard, v.indexed_shard), COALESCE(d.vocab_id, v.indexed_vocab)
+        FROM item_vectors v
+        LEFT JOIN temp.dirty_keys d ON d.vec_id = v.vec_id
+        WHERE v.deleted = 0 AND COALESCE(d.vocab_id, v.indexed_vocab) IS NOT NULL
+    """)
+    conn.commit()
+    return np.fromiter((r[0] for r in conn.execute("SELECT vec_id FROM temp.dirty_keys ORDER BY vec_id")), dtype="int64")
+
+# Satır düzeni: (vocab_id, shard, name_norm, category, merchant)
+PAIR_SELECT = """
+    SELECT p.vocab_id, p.shard, k.name_norm, k.category, k.merchant
+    FROM temp.pairs p
+    JOIN vocab k ON k.vocab_id = p.vocab_id
+"""
+
+def iter_shard_chunks(conn: sqlite3.Connection, where: str = "", params: list = ()):
+    """
+    Çiftler shard ve vocab_id sırasıyla cursor'dan okunur; en fazla CHUNK_ROWS
+    satırlık (shard, satırlar) parçaları üretilir (hepsi belleğe alınmaz).
+    """
+    cur = conn.execute(f"{PAIR_SELECT} {where} ORDER BY p.shard, p.vocab_id", list(params))
+    while True:
+        rows = cur.fetchmany(CHUNK_ROWS)
+        if not rows:
+            break
+        start = 0
+        for i in range(1, len(rows) + 1):
+            if i == len(rows) or rows[i][1] != rows[start][1]:
+                yield rows[start][1], rows[start:i]
+                start = i
+
+def stage_receipt_ids(conn: sqlite3.Connection) -> None:
+    """Kirli kalemlerin fişlerine sabit vec_id verir; silinmiş fişlerin id'leri bırakılır (tekrar kullanılmaz)."""
+    with conn:
+        conn.execute("""
+            INSERT OR IGNORE INTO receipt_vectors (receipt_id)
+            SELECT DISTINCT i.receipt_id FROM temp.dirty_keys d JOIN items i ON i.id = d.item_id
+        """)
+        conn.execute(
+            "DELETE FROM receipt_vectors WHERE NOT EXISTS (SELECT 1 FROM receipts r WHERE r.id = receipt_vectors.receipt_id)"
+        )
+
+# Satır düzeni: (vec_id, ay, işyeri, name_norm, category); fiş başına kalem sırasıyla
+RECEIPT_DOC_SELECT = f"""
+    SELECT rv.vec_id, {SHARD_SQL}, COALESCE(m.canonical_name, r.merchant, ''), i.name_norm, i.category
+    FROM receipts r
+    JOIN receipt_vectors rv ON rv.receipt_id = r.id
+    JOIN items i ON i.receipt_id = r.id
+    LEFT JOIN merchants m ON m.id = r.merchant_id
+"""
+
+# Satır düzeni fişlerle aynı: (merchant_id, -, işyeri, name_norm, category); işyeri içinde sıklık sırasıyla
+MERCHANT_DOC_SELECT = """
+    SELECT m.id, NULL, m.canonical_name, i.name_norm, i.category
+    FROM merchants m
+    JOIN receipts r ON r.merchant_id = m.id
+    JOIN items i ON i.receipt_id = r.id
+    GROUP BY m.id, i.name_norm, i.category
+    ORDER BY m.id, COUNT(*) DESC, i.name_norm
+"""
+
+def _group_docs(rows, shard_of, build):
+    # (id, x, işyeri, ad, kategori) satırlarını id başına tek dokümana toplar -> (id, shard, metin)
+    key, merchant, names, cats = None, "", {}, set()
+    for row in rows:
+        if key is None or row[0] != key[0]:
+            if key is not None:
+                yield key[0], key[1], build(merchant, list(names), cats)
+            key, merchant, names, cats = (row[0], shard_of(row)), row[2], {}, set()
+        if row[3]:
+            names[row[3]] = None
+        if row[4]:
+            cats.add(row[4])
+    if key is not None:
+        yield key[0], key[1], build(merchant, list(names), cats)
+
+def iter_receipt_docs(conn: sqlite3.Connection, months: Optional[list[str]] = None):
+    """Fiş başına (vec_id, ay, özet metni), ay ve vec_id sırasıyla (months=None: tüm aylar)."""
+    where, params = "", []
+    if months is not None:
+        where, params = f"WHERE {SHARD_SQL} IN (SELECT value FROM json_each(?))", [json.dumps(sorted(months))]
+    cur = conn.execute(f"{RECEIPT_DOC_SELECT} {where} ORDER BY 2, 1, i.line_no", params)
+    return _group_docs(cur, lambda r: r[1], build_receipt_doc)
+
+def iter_merchant_docs(conn: sqlite3.Connection):
+    """Kanonik işyeri başına (merchants.id, MERCHANT_SHARD, özet metni)."""
+    return _group_docs(conn.execute(MERCHANT_DOC_SELECT), lambda r: MERCHANT_SHARD, build_merchant_doc)
+
+def level_counts(conn: sqlite3.Connection, level: str) -> dict[str, int]:
+    """Shard başına yaklaşık doküman sayısı (ShardBuilder'ın indeks tipi seçimi için)."""
+    if level == LEVEL_MERCHANT:
+        return {MERCHANT_SHARD: conn.execute("SELECT COUNT(*) FROM merchants").fetchone()[0]}
+    return dict(conn.execute(f"SELECT {SHARD_SQL} AS shard, COUNT(*) FROM receipts r GROUP BY shard").fetchall())
+
+def chunk_docs(docs):
+    """Shard sırasındaki (id, shard, metin) akışını en fazla CHUNK_ROWS satırlık (shard, satırlar) parçalarına böler."""
+    name, rows = None, []
+    for row in docs:
+        if rows and (row[1] != name or len(rows) >= CHUNK_ROWS):
+            yield name, rows
+            rows = []
+        name = row[1]
+        rows.append(row)
+    if rows:
+        yield name, rows
+
+def affected_shards(conn: sqlite3.Connection) -> set[str]:
+    return {r[0] for r in conn.execute("SELECT DISTINCT shard FROM temp.affected")}
+
+def shard_live_counts(conn: sqlite3.Connection) -> dict[str, int]:
+    return dict(conn.execute("SELECT shard, COUNT(*) FROM temp.pairs GROUP BY shard").fetchall())
+
+class ChunkEncoder:
+    """
+    (shard, satırlar) parçalarını sırasıyla (shard, satırlar, emb, ids) olarak
+    döndürür. Cache'te olmayan metinler EmbedPool süreçlerinde paralel encode
+    edilir: en fazla 2 x süreç sayısı parça aynı anda işlenir, sonuçlar okuma
+    sırasıyla alınıp cache'e ve indekse eklenir.
+    """
+
+    def __init__(self):
+        self.cache = get_embedding_cache()
+        self.model = embedder_name()
+        self.workers = pool_size()
+        self.pool: Optional[EmbedPool] = None
+        # Havuza gönderilmiş metinler: sonraki parçalarda tekrar gönderilmez (sırayla cache'e girer)
+        self._submitted: set[str] = set()
+
+    def __call__(self, chunks, text_of=lambda r: build_doc_text(r[2:5])):
+        pending = deque()
+        for name, rows in chunks:
+            texts = [text_of(r) for r in rows]
+            found = self.cache.lookup(self.model, texts)
+            missing = [t for t in dict.fromkeys(texts) if t not in found and t not in self._submitted]
+            job = None
+            if missing and self.workers > 1 and (self.pool is not None or len(missing) >= POOL_MIN_TEXTS):
+                if self.pool is None:
+                    self.pool = EmbedPool(self.workers)
+                job = self.pool.submit(missing, EMBED_BATCH_SIZE)
+                self._submitted.update(missing)
+            pending.append((name, rows, texts, missing, job))
+            # Tek süreçte encode edilecek parça sıradaysa beklemeye gerek yok
+            while pending and (len(pending) > 2 * self.workers or pending[0][4] is None):
+                yield self._finish(*pending.popleft())
+        while pending:
+            yield self._finish(*pending.popleft())
 
-def main():
+    def _finish(self, name, rows, texts, missing, job):
+        if job is None:
+            encode_fn = lambda m: get_embedder().encode(m, batch_size=EMBED_BATCH_SIZE)
+        else:
+            emb, pos = job.get(), {t: i for i, t in enumerate(missing)}
+            encode_fn = lambda m: emb[[pos[t] for t in m]]
+        out = self.cache.encode(self.model, texts, encode_fn)
+        return name, rows, out, np.asarray([r[0] for r in rows], dtype="int64")
+
+    def close(self) -> None:
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+
+
+class ShardBuilder:
+    """
+    Sıfırdan kurulan shard'a chunk chunk vektör ekler. Tip beklenen boyuta göre
+    seçilir; IVF ise chunk'lar eğitim örneği dolana kadar bekletilip sonra eklenir.
+    """
+
+    def __init__(self, n_expected: int):
+        self.n_expected = n_expected
+        self.index: Optional[faiss.Index] = None
+        self.spec: Optional[IndexSpec] = None
+        self.count = 0
+        self._pending: list[tuple[np.ndarray, np.ndarray]] = []
+        self._pending_n = 0
+
+    def add(self, emb: np.ndarray, ids: np.ndarray) -> None:
+        if self.index is None:
+            self.spec = select_spec(max(self.n_expected, len(ids)), emb.shape[1])
+            self.index = build_index(self.spec, emb.shape[1])
+        self.count += len(ids)
+        if self.index.is_trained:
+            self.index.add_with_ids(emb, ids)
+            return
+        self._pending.append((emb, ids))
+        self._pending_n += len(ids)
+        if self._pending_n >= self.spec.train_size(self.n_expected):
+            self._flush()
+
+    def _flush(self) -> None:
+        emb = np.concatenate([e for e, _ in self._pending])
+        ids = np.concatenate([i for _, i in self._pending])
+        self._pending, self._pending_n = [], 0
+        train_index(self.index, self.spec, emb)
+        self.index.add_with_ids(emb, ids)
+
+    def finish(self) -> Optional[faiss.Index]:
+        if self._pending:
+            self._flush()
+        return self.index
+
+
+def build_level(encoder: ChunkEncoder, stage: Path, level: str, docs, counts: dict[str, int]) -> dict[str, dict]:
+    """Düzeyin (fiş/işyeri) verilen dokümanlarından shard'ları sıfırdan kurar; shard adı -> manifest girdisi."""
+    out: dict[str, dict] = {}
+    current, builder = None, None
+
+    def flush() -> None:
+        index = builder.finish()
+        path = level_path(stage, level, current)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        faiss.write_index(index, str(path))
+        out[current] = {"spec": builder.spec.to_dict(), "ntotal": int(index.ntotal)}
+
+    for name, rows, emb, ids in encoder(chunk_docs(docs), text_of=lambda r: r[2]):
+        if name != current:
+            if builder is not None:
+                flush()
+            current, builder = name, ShardBuilder(counts.get(name, 0))
+        builder.add(emb, ids)
+    if builder is not None:
+        flush()
+    return out
+
+def _link_or_copy(src: Path, dst: Path) -> None:
+    # Değişmeyen shard yeni sürüme kopyalanmadan bağlanır
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    dst.unlink(missing_ok=True)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+def load_checkpoint(stage: Path, plan: dict) -> Optional[dict]:
+    """Aynı plan (taban sürüm, model, kirli küme, shard listeleri) için kaydedilmiş ilerleme."""
+    try:
+        ck = json.loads((stage / CHECKPOINT_FILE).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    return ck if ck.get("plan") == plan else None
+
+def save_checkpoint(stage: Path, ck: dict) -> None:
+    tmp = stage / (CHECKPOINT_FILE + ".tmp")
+    tmp.write_text(json.dumps(ck, ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp, stage / CHECKPOINT_FILE)
+
+def main(full: bool = False, compact: bool = False):
     INDEX_DIR.mkdir(parents=True, exist_ok=True)
 
     conn = connect()
     init_schema(conn)
 
-    rows = conn.execute(
-        """
-        SELECT
-          i.id,
-          i.receipt_id,
-          r.merchant,
-          r.receipt_date,
-          i.name_norm,
-          i.category,
-          i.qty,
-          i.unit,
-          i.amount
-        FROM items i
-        JOIN receipts r ON r.id = i.receipt_id
-        ORDER BY r.receipt_date, i.line_no
-        """
-    ).fetchall()
-    conn.close()
+    manifest = read_manifest()
+    prev_root = None if full else previous_version(manifest)
+    shards: dict[str, dict] = dict(manifest["shards"]) if prev_root is not None else {}
+    if prev_root is None:
+        # Sıfırdan kurulum: tüm kalemler kirli sayılır
+        mark_all_dirty(conn)
+
+    cutoff = freeze_cutoff()
+    # Yeniden kurulacak shard'lar: ay geride kaldıysa bir kez sıkıştırılıp dondurulur
+    # (--compact: donmuşların hepsi), indeks tipi ayarı değiştiyse yeniden seçilir
+    forced = {
+        n for n, e in shards.items()
+        if (is_frozen_month(n, cutoff) and (compact or not e.get("frozen"))) or needs_reselect(e, int(e["ntotal"]))
+    }
+
+    dirty_ids = stage_dirty_keys(conn)
+    stage_receipt_ids(conn)
+    if dirty_ids.size == 0 and not forced:
+        conn.close()
+        if not shards:
+            print("NO_ITEMS")
+        else:
+            n = sum(int(e["ntotal"]) for e in shards.values())
+            print(f"INDEX_OK: unchanged keys={n} shards={len(shards)} version={manifest['version']}")
+        return
+
+    # Sadece kirli kalemlerin eski/yeni (ay, anahtar) çiftlerinin bulunduğu shard'lar işlenir
+    # (yeni fişler: içinde bulunulan ay)
+    touched = affected_shards(conn) | forced
+    live_counts = shard_live_counts(conn)
+    rebuild = set()
+    for name in touched:
+        entry = shards.get(name)
+        if (
+            prev_root is None
+            or entry is None
+            or name in forced
+            or is_frozen_month(name, cutoff)
+            or needs_reselect(entry, live_counts.get(name, 0))
+            # HNSW'den vektör silinemez
+            or not IndexSpec.from_dict(entry["spec"]).supports_remove
+        ):
+            rebuild.add(name)
+    incremental = touched - rebuild
+
+    # Yeni sürüm geçici klasöre yazılır; okuyucular manifest değişene kadar eski sürümü kullanır.
+    # Aynı plan için yarıda kalmış kurulum varsa tamamlanan shard'ları kullanılır.
+    version = int((manifest or {}).get("version") or 0) + 1
+    plan = {
+        "base_version": manifest["version"] if prev_root is not None else None,
+        "model": embedder_name(),
+        "dirty": [int(dirty_ids.size), int(dirty_ids.sum()), int(dirty_ids.max()) if dirty_ids.size else 0],
+        "rebuild": sorted(rebuild),
+        "incremental": sorted(incremental),
+    }
+    stage = staging_dir(version, keep=True)
+    ck = load_checkpoint(stage, plan)
+    if ck is None:
+        stage = staging_dir(version)
+        ck = {"plan": plan, "done": {}, "embedded": 0, "removed": 0, "dim": int((manifest or {}).get("dim") or 0)}
+        save_checkpoint(stage, ck)
+    elif ck["done"]:
+        print(f"INDEX_RESUME: version={version} shards_done={len(ck['done'])}/{len(touched)}")
+    done: dict[str, Optional[dict]] = ck["done"]
+
+    def finish_shard(name: str, index: Optional[faiss.Index], entry: dict) -> None:
+        if index is None or index.ntotal == 0:
+            done[name] = None
+        else:
+            faiss.write_index(index, str(shard_path(stage, name)))
+            entry["ntotal"] = int(index.ntotal)
+            done[name] = entry
+            ck["dim"] = int(index.d)
+        save_checkpoint(stage, ck)
+
+    # Encode süreç havuzu (gerekirse) iki adım boyunca açık kalır
+    encoder = ChunkEncoder()
+    try:
+        # 1) Yeniden kurulan shard'lar: shard'ın tüm anahtarları akış halinde eklenir
+        todo = sorted(rebuild - set(done))
+        if todo:
+            if prev_root is None:
+                where, params = "", []
+            else:
+                where, params = f"WHERE p.shard IN ({','.join('?' * len(todo))})", todo
+            current, builder = None, None
+            chunks = ((n, rows) for n, rows in iter_shard_chunks(conn, where, params) if n not in done)
+            for name, rows, emb, ids in encoder(chunks):
+                if name != current:
+                    if builder is not None:
+                        finish_shard(current, builder.finish(), {
+                            "spec": builder.spec.to_dict(), "built_items": builder.count,
+                            "frozen": is_frozen_month(current, cutoff),
+                        })
+                    current, builder = name, ShardBuilder(live_counts.get(name, 0))
+                builder.add(emb, ids)
+                ck["embedded"] += len(rows)
+            if builder is not None:
+                finish_shard(current, builder.finish(), {
+                    "spec": builder.spec.to_dict(), "built_items": builder.count,
+                    "frozen": is_frozen_month(current, cutoff),
+                })
+            # Hiç anahtarı kalmayan shard'lar düşer
+            for name in todo:
+                if name not in done:
+                    finish_shard(name, None, {})
 
-    if not rows:
+        # 2) Artımlı shard'lar: etkilenen anahtarlar çıkarılır, hâlâ kalemi olanlar tekrar eklenir
+        for name in sorted(incremental - set(done)):
+            index = faiss.read_index(str(shard_path(prev_root, name)))
+            rem = np.fromiter(
+                (r[0] for r in conn.execute("SELECT vocab_id FROM temp.affected WHERE shard = ?", [name])), dtype="int64"
+            )
+            ck["removed"] += int(index.remove_ids(rem))
+            where = "WHERE p.shard = ? AND p.vocab_id IN (SELECT vocab_id FROM temp.affected WHERE shard = ?)"
+            for _, rows, emb, ids in encoder(iter_shard_chunks(conn, where, [name, name])):
+                index.add_with_ids(emb, ids)
+                ck["embedded"] += len(rows)
+            finish_shard(name, index, dict(shards[name]))
+
+        # 3) Fiş ve işyeri düzeyleri: etkilenen ayların fiş shard'ları ve işyeri indeksi baştan kurulur
+        #    (küçük indeksler; değişmeyen dokümanların embedding'i cache'ten gelir). Yarıda kalırsa düzey tekrarlanır.
+        level_done = ck.setdefault("levels", {})
+        if LEVEL_RECEIPT not in level_done:
+            months = None if prev_root is None else sorted(touched)
+            level_done[LEVEL_RECEIPT] = build_level(
+                encoder, stage, LEVEL_RECEIPT, iter_receipt_docs(conn, months), level_counts(conn, LEVEL_RECEIPT)
+            )
+            save_checkpoint(stage, ck)
+        if LEVEL_MERCHANT not in level_done:
+            level_done[LEVEL_MERCHANT] = build_level(
+                encoder, stage, LEVEL_MERCHANT, iter_merchant_docs(conn), level_counts(conn, LEVEL_MERCHANT)
+            )
+            save_checkpoint(stage, ck)
+    finally:
+        encoder.close()
+
+    for name, entry in done.items():
+        if entry is None:
+            shards.pop(name, None)
+        else:
+            shards[name] = entry
+    for name in shards:
+        if name not in touched:
+            _link_or_copy(shard_path(prev_root, name), shard_path(stage, name))
+
+    # Fiş düzeyinde dokunulmayan aylar önceki sürümden bağlanır; işyeri düzeyi her seferinde yenidir
+    receipt_shards = {}
+    if prev_root is not None:
+        receipt_shards = {n: e for n, e in (manifest.get("levels") or {}).get(LEVEL_RECEIPT, {}).items() if n not in touched}
+        for name in receipt_shards:
+            _link_or_copy(level_path(prev_root, LEVEL_RECEIPT, name), level_path(stage, LEVEL_RECEIPT, name))
+    receipt_shards.update(level_done[LEVEL_RECEIPT])
+    levels = {LEVEL_RECEIPT: receipt_shards, LEVEL_MERCHANT: level_done[LEVEL_MERCHANT]}
+
+    if not shards:
+        shutil.rmtree(stage, ignore_errors=True)
+        conn.close()
         print("NO_ITEMS")
         return
 
-    docs = [build_doc_text(r) for r in rows]
-
-    model = SentenceTransformer(EMB_MODEL_NAME)
-    emb = model.encode(docs, normalize_embeddings=True, show_progress_bar=True)
-    emb = np.asarray(emb, dtype="float32")
-
-    dim = emb.shape[1]
-    index = faiss.IndexFlatIP(dim)  # cosine similarity ~ inner product with normalized vectors
-    index.add(emb)
-
-    faiss.write_index(index, str(INDEX_PATH))
-
-    with META_PATH.open("w", encoding="utf-8") as f:
-        for r, d in zip(rows, docs):
-            item_id, receipt_id, merchant, date, name_norm, category, qty, unit, amount = r
-            meta = {
-                "item_id": item_id,
-                "receipt_id": receipt_id,
-                "merchant": merchant,
-                "date": date,
-                "name_norm": name_norm,
-                "category": category,
-                "qty": qty,
-                "unit": unit,
-                "amount": amount,
-                "doc": d,
-            }
-            f.write(json.dumps(meta, ensure_ascii=False) + "\n")
-
-    print(f"INDEX_OK: items={len(rows)} dim={dim} index_path={INDEX_PATH} meta_path={META_PATH}")
+    ntotal = sum(int(e["ntotal"]) for e in shards.values())
+    (stage / CHECKPOINT_FILE).unlink(missing_ok=True)
+
+    # Bayraklar ve posting list'ler (items.vocab_id) sürüm yayınlanmadan önce commit edilir:
+    # manifest'i okuyan IndexManager yeni sürümü yüklediğinde SQLite yeni posting list'leri gösterir.
+    # Meta dizileri aynı transaction içinden okunur. Kurulum sırasında başka bağlantıda yeniden
+    # kirlenen satırlar (dirty_seq değişmiş) kirli kalır; indexed_* bu sürümdeki yeri gösterir.
+    try:
+        conn.execute("""
+            DELETE FROM item_vectors
+            WHERE deleted = 1 AND (vec_id, dirty_seq) IN (SELECT vec_id, seq FROM temp.dirty_keys)
+        """)
+        conn.execute("""
+            UPDATE item_vectors
+            SET dirty = CASE WHEN item_vectors.dirty_seq = d.seq THEN 0 ELSE 1 END,
+                indexed_vocab = d.vocab_id, indexed_shard = d.shard
+            FROM temp.dirty_keys d WHERE item_vectors.vec_id = d.vec_id
+        """)
+        conn.execute("""
+            UPDATE items SET vocab_id = d.vocab_id
+            FROM temp.dirty_keys d WHERE items.id = d.item_id AND d.vocab_id IS NOT NULL
+        """)
+        n_meta = write_vocab_meta(conn, stage)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    root = publish_version(stage, {
+        "version": version,
+        "unit": INDEX_UNIT,
+        "model": embedder_name(),
+        "dim": ck["dim"],
+        "ntotal": ntotal,
+        "shards": {n: shards[n] for n in sorted(shards)},
+        "levels": {lv: {n: levels[lv][n] for n in sorted(levels[lv])} for lv in LEVELS},
+        "updated_at": datetime.now().isoformat(timespec="seconds"),
+    })
+
+    for path in LEGACY_PATHS:
+        path.unlink(missing_ok=True)
+
+    print(
+        f"INDEX_OK: embedded={ck['embedded']} removed={ck['removed']} keys={ntotal} shards={len(shards)} "
+        f"touched={len(touched)} rebuilt={len(rebuild)} dim={ck['dim']} version={version} "
+        f"index_dir={root} meta_keys={n_meta} "
+        + " ".join(f"{lv}_docs={sum(int(e['ntotal']) for e in levels[lv].values())}" for lv in LEVELS)
+    )
 
 if __name__ == "__main__":
-    main()
+    main(full="--full" in sys.argv[1:], compact="--compact" in sys.argv[1:])
@@ -0,0 +1,240 @@
+from __future__ import annotations
+
+import multiprocessing as mp
+import os
+from pathlib import Path
+import sys
+import threading
+from dataclasses import dataclass, field
+from typing import Optional
+
+import faiss
+import numpy as np
+
+from .index_factory import IndexSpec, apply_search_params, read_index
+from .index_meta import (
+    INDEX_UNIT, LEVELS, MANIFEST_PATH, VocabMeta, level_path, meta_exists, read_manifest, shard_path, version_dir,
+)
+
+
+# mmap: shard'lar salt okunur ve bellek eşlemeli açılır; aynı sürümü kullanan süreçler
+# (Streamlit, CLI, asistan) tek kopyayı sayfa cache'inde paylaşır. memory: süreç başına kopya.
+SERVE_MODE = os.getenv("INDEX_SERVE_MODE", "mmap")
+SERVE_MODES = ("mmap", "memory")
+# RSS ölçümünde süreç başına sorgu sayısı (sayfaların gerçekten okunması için)
+RSS_QUERIES = 64
+
+
+@dataclass
+class IndexShard:
+    """Bir aylık shard: indeks, parametreleri ve meta'daki satır aralığı (fiş/işyeri düzeyinde boş)."""
+    name: str
+    index: faiss.Index
+    spec: IndexSpec
+    rows: slice
+
+
+@dataclass
+class IndexHandle:
+    """Yayınlanmış bir sürümün shard'ları, meta dizileri ve fiş/işyeri düzeyleri (hepsi aynı sürümden)."""
+    version: int
+    shards: dict[str, IndexShard]
+    meta: VocabMeta
+    manifest: dict
+    mmap: bool = False
+    # düzey -> shard adı -> shard (düzeyleri olmayan eski sürümde boş)
+    levels: dict[str, dict[str, IndexShard]] = field(default_factory=dict)
+
+    @property
+    def ntotal(self) -> int:
+        return sum(int(s.index.ntotal) for s in self.shards.values())
+
+
+def load_version(manifest: dict, mmap: bool = False) -> Optional[IndexHandle]:
+    version = manifest.get("version")
+    if version is None or "shards" not in manifest or manifest.get("unit") != INDEX_UNIT:
+        return None
+    root = version_dir(int(version))
+    if not meta_exists(root) or any(not shard_path(root, n).exists() for n in manifest["shards"]):
+        return None
+    meta = VocabMeta(root)
+    if not meta.is_consistent():
+        return None
+    levels_manifest = manifest.get("levels") or {}
+    if any(not level_path(root, lv, n).exists() for lv in LEVELS for n in levels_manifest.get(lv) or {}):
+        return None
+    rows = meta.shard_rows()
+    empty = slice(0, 0)
+
+    def load(path: Path, name: str, entry: dict, shard_rows: slice) -> IndexShard:
+        spec = IndexSpec.from_dict(entry.get("spec") or {"kind": "flat"})
+        index = read_index(path, spec, mmap=mmap)
+        apply_search_params(index, spec)
+        return IndexShard(name, index, spec, shard_rows)
+
+    shards = {
+        name: load(shard_path(root, name), name, entry, rows.get(name, empty)) for name, entry in manifest["shards"].items()
+    }
+    levels = {
+        lv: {n: load(level_path(root, lv, n), n, e, empty) for n, e in (levels_manifest.get(lv) or {}).items()}
+        for lv in LEVELS
+    }
+    return IndexHandle(int(version), shards, meta, manifest, mmap, levels)
+
+
+def _manifest_stamp() -> Optional[tuple[int, int]]:
+    try:
+        st = MANIFEST_PATH.stat()
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+class IndexManager:
+    """
+    Süreç başına tek indeks (Streamlit oturumları aynı nesneyi paylaşır).
+    Her çağrıda sadece manifest'in stat'ı kontrol edilir; yeni sürüm
+    yayınlandıysa yüklenip referans tek adımda değiştirilir. Eski handle'ı
+    tutan aramalar kendi sürümleriyle tamamlanır.
+    """
+
+    def __init__(self, mode: str = SERVE_MODE):
+        if mode not in SERVE_MODES:
+            raise ValueError(f"Bilinmeyen INDEX_SERVE_MODE: {mode} (seçenekler: {', '.join(SERVE_MODES)})")
+        self.mmap = mode == "mmap"
+        self._lock = threading.Lock()
+        self._current: Optional[IndexHandle] = None
+        self._stamp: Optional[tuple[int, int]] = None
+
+    def current(self) -> Optional[IndexHandle]:
+        """Yayınlanmış en güncel sürüm (hiç kurulum yoksa None)"""
+        stamp = _manifest_stamp()
+        if stamp is None or stamp == self._stamp:
+            return self._current
+        with self._lock:
+            if stamp != self._stamp:
+                manifest = read_manifest() or {}
+                cur = self._current
+                if cur is None or manifest.get("version") != cur.version:
+                    handle = load_version(manifest, mmap=self.mmap)
+                    if handle is None:
+                        # Yüklenemedi: eski sürümle devam, sonraki çağrıda tekrar denenir
+                        return cur
+                    self._current = handle
+                self._stamp = stamp
+            return self._current
+
+    def get_stats(self) -> dict:
+        """Yüklü sürüm bilgisi"""
+        cur = self._current
+        if cur is None:
+            return {"version": None, "mode": "mmap" if self.mmap else "memory"}
+        kinds = sorted({s.spec.kind for s in cur.shards.values()})
+        return {
+            "version": cur.version, "mode": "mmap" if cur.mmap else "memory", "shards": len(cur.shards),
+            "kinds": kinds, "keys": len(cur.meta), "ntotal": cur.ntotal,
+            "levels": {lv: sum(int(s.index.ntotal) for s in shards.values()) for lv, shards in cur.levels.items()},
+        }
+
+
+# Global instance
+_manager: Optional[IndexManager] = None
+
+def get_index_manager() -> IndexManager:
+    """Singleton indeks yöneticisi"""
+    global _manager
+    if _manager is None:
+        _manager = IndexManager()
+    return _manager
+
+def index_ready() -> bool:
+    return get_index_manager().current() is not None
+
+
+def process_memory() -> dict[str, Optional[float]]:
+    """
+    Bu sürecin belleği (MB). rss: eşlenmiş dosya sayfaları dahil; private:
+    sürece özel (anonim) bellek; pss: paylaşılan sayfalar paylaşan süreç
+    sayısına bölünmüş. Linux'ta /proc, diğerlerinde varsa psutil kullanılır.
+    """
+    try:
+        text = Path("/proc/self/smaps_rollup").read_text()
+    except OSError:
+        text = None
+    if text:
+        kb = {}
+        for line in text.splitlines()[1:]:
+            key, _, value = line.partition(":")
+            if value.strip().endswith("kB"):
+                kb[key] = int(value.split()[0])
+        return {"rss_mb": kb.get("Rss", 0) / 1024, "private_mb": kb.get("Anonymous", 0) / 1024, "pss_mb": kb.get("Pss", 0) / 1024}
+    try:
+        import psutil
+    except ImportError:
+        return {"rss_mb": None, "private_mb": None, "pss_mb": None}
+    info = psutil.Process().memory_full_info()
+    pss = getattr(info, "pss", None)
+    return {"rss_mb": info.rss / 2**20, "private_mb": info.uss / 2**20, "pss_mb": pss / 2**20 if pss is not None else None}
+
+def _rss_worker(mode: str, n_queries: int, loaded, done, out) -> None:
+    before = process_memory()
+    handle = IndexManager(mode).current()
+    if handle is not None:
+        # Tüm shard'lar sorgulanır ki eşlenmiş sayfalar da okunmuş olsun
+        rng = np.random.default_rng(0)
+        for shard in handle.shards.values():
+            q = rng.standard_normal((n_queries, shard.index.d)).astype("float32")
+            q /= np.linalg.norm(q, axis=1, keepdims=True)
+            shard.index.search(q, 10)
+    # Ölçüm, bütün süreçler indeksi açmış durumdayken yapılır (paylaşım PSS'te görünür)
+    loaded.wait()
+    out.put((before, process_memory()))
+    done.wait()
+
+def _avg_delta(rows: list[tuple[dict, dict]], key: str) -> Optional[float]:
+    if rows[0][1][key] is None:
+        return None
+    return round(sum(after[key] - before[key] for before, after in rows) / len(rows), 1)
+
+def measure_rss(procs: int = 3, modes: tuple[str, ...] = SERVE_MODES, n_queries: int = RSS_QUERIES) -> dict[str, dict]:
+    """
+    Her mod için aynı anda `procs` süreç yayınlanmış sürümü açıp sorgular;
+    süreç başına indeksin getirdiği RSS/özel bellek artışı ve süreçlerin toplam
+    PSS'i (yorumlayıcı ve kütüphaneler dahil) döner.
+    """
+    ctx = mp.get_context("spawn")
+    results = {}
+    for mode in modes:
+        loaded, done, out = ctx.Barrier(procs + 1), ctx.Barrier(procs + 1), ctx.Queue()
+        workers = [ctx.Process(target=_rss_worker, args=(mode, n_queries, loaded, done, out)) for _ in range(procs)]
+        for w in workers:
+            w.start()
+        loaded.wait()
+        rows = [out.get() for _ in workers]
+        done.wait()
+        for w in workers:
+            w.join()
+        pss = [after["pss_mb"] for _, after in rows]
+        results[mode] = {
+            "procs": procs,
+            "rss_mb": _avg_delta(rows, "rss_mb"),
+            "private_mb": _avg_delta(rows, "private_mb"),
+            "pss_total_mb": round(sum(pss), 1) if None not in pss else None,
+        }
+    return results
+
+
+def main():
+    # python -m src.index_manager [--rss [N]]   (N: aynı anda açılan süreç sayısı)
+    args = sys.argv[1:]
+    if args and args[0] == "--rss":
+        procs = int(args[1]) if len(args) > 1 else 3
+        for mode, res in measure_rss(procs).items():
+            print(f"INDEX_RSS_OK: mode={mode} " + " ".join(f"{k}={v}" for k, v in res.items()))
+        return
+    manager = get_index_manager()
+    manager.current()
+    print(f"INDEX_STATUS: {manager.get_stats()}")
+
+if __name__ == "__main__":
+    main()
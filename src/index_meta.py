@@ -0,0 +1,246 @@
+from __future__ import annotations
+
+import json
+import os
+import re
+import shutil
+import sqlite3
+from datetime import date
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+INDEX_DIR = Path("data/index")
+# Her kurulum kendi sürüm klasörüne (v000001, v000002, ...) yazılır; yayınlanan
+# sürüm manifest'te tutulur. Okuyucular hiçbir zaman yazılmakta olan dosyayı görmez.
+# Vektörler fiş ayına göre shard'lara bölünür: <sürüm>/shards/2024-03.faiss, ...
+# Tarihi olmayan kalemler ayrı bir shard'dadır.
+SHARDS_DIR = "shards"
+UNDATED_SHARD = "undated"
+# SQL'de aynı kural (builder akışı shard sırasıyla okur): geçerli YYYY-MM-DD ise ay, değilse tarihsiz
+SHARD_SQL = (
+    "CASE WHEN date(substr(r.receipt_date, 1, 10)) = substr(r.receipt_date, 1, 10) "
+    f"THEN substr(r.receipt_date, 1, 7) ELSE '{UNDATED_SHARD}' END"
+)
+# Fiş ve işyeri düzeyi indeksleri aynı sürümde: <sürüm>/levels/receipt/2024-03.faiss (fiş düzeyi
+# de aylık shard'lı, id: receipt_vectors.vec_id), <sürüm>/levels/merchant/all.faiss (id: merchants.id)
+LEVELS_DIR = "levels"
+LEVEL_RECEIPT = "receipt"
+LEVEL_MERCHANT = "merchant"
+LEVELS = (LEVEL_RECEIPT, LEVEL_MERCHANT)
+MERCHANT_SHARD = "all"
+# write_vocab_meta'nın DB'den tek seferde okuduğu satır sayısı
+META_CHUNK_ROWS = 50_000
+# İndeksteki (shard, anahtar) satırları, shard ve vocab_id sırasında: FAISS id'si (vocab_id),
+# shard kodu (ad listesi SHARD_NAMES_FILE'da) ve kategori kodu (-1=yok; adlar CAT_NAMES_FILE'da)
+IDS_FILE = "vocab_ids.npy"
+SHARD_CODES_FILE = "vocab_shard.npy"
+SHARD_NAMES_FILE = "shards.json"
+CATS_FILE = "vocab_cat.npy"
+CAT_NAMES_FILE = "categories.json"
+# Yayınlanan sürüm, indeks tipi/parametreleri, model ve boyut (index_faiss yazar, arama tarafı okur)
+MANIFEST_PATH = INDEX_DIR / "manifest.json"
+# Manifest'teki indeks birimi; farklıysa (eski kalem bazlı indeks) tam kurulum yapılır
+INDEX_UNIT = "vocab"
+# Silinmeden tutulan eski sürüm sayısı (hâlâ eski sürümü kullanan okuyucular için)
+KEEP_VERSIONS = 2
+
+
+class VocabMeta:
+    """
+    Her shard'daki anahtarlar (vocab_id) ve kategori kodları. Diziler
+    memory-map ile açılır; satırlar shard sırasında olduğundan her shard
+    bitişik bir aralıktır.
+    """
+
+    def __init__(self, root: Path):
+        self.vocab_ids = np.load(root / IDS_FILE, mmap_mode="r")
+        self.shard_codes = np.load(root / SHARD_CODES_FILE, mmap_mode="r")
+        self.cats = np.load(root / CATS_FILE, mmap_mode="r")
+        self.shard_names = json.loads((root / SHARD_NAMES_FILE).read_text(encoding="utf-8"))
+        self.cat_codes = {c: i for i, c in enumerate(json.loads((root / CAT_NAMES_FILE).read_text(encoding="utf-8")))}
+
+    def __len__(self) -> int:
+        return int(self.vocab_ids.shape[0])
+
+    def is_consistent(self) -> bool:
+        n = len(self)
+        return self.shard_codes.shape[0] == n and self.cats.shape[0] == n
+
+    def shard_rows(self) -> dict[str, slice]:
+        """shard adı -> o shard'ın satır aralığı."""
+        codes = np.arange(len(self.shard_names))
+        starts = np.searchsorted(self.shard_codes, codes, side="left")
+        ends = np.searchsorted(self.shard_codes, codes, side="right")
+        return {name: slice(int(s), int(e)) for name, s, e in zip(self.shard_names, starts, ends)}
+
+    def select(
+        self, rows: slice, category: Optional[str] = None, candidates: Optional[np.ndarray] = None
+    ) -> Optional[np.ndarray]:
+        """
+        Aralıktaki anahtarlardan kategoriye uyan ve (verildiyse) aday kümesinde
+        olanların vocab_id'leri; hepsi uyuyorsa None (seçici gerekmez).
+        """
+        if not category and candidates is None:
+            return None
+        ids = np.asarray(self.vocab_ids[rows], dtype="int64")
+        mask = np.ones(ids.size, dtype=bool)
+        if category:
+            code = self.cat_codes.get(category)
+            if code is None:
+                return ids[:0]
+            mask &= self.cats[rows] == code
+        if candidates is not None:
+            mask &= np.isin(ids, candidates, assume_unique=True)
+        return None if mask.all() else ids[mask]
+
+
+_ISO_DATE_RE = re.compile(r"\d{4}-\d{2}-\d{2}")
+
+def _day(value: Optional[str]) -> int:
+    s = str(value)[:10] if value is not None else ""
+    if not _ISO_DATE_RE.fullmatch(s):
+        return 0
+    try:
+        return date.fromisoformat(s).toordinal()
+    except ValueError:
+        return 0
+
+def shard_of_day(day: int) -> str:
+    if day <= 0:
+        return UNDATED_SHARD
+    d = date.fromordinal(day)
+    return f"{d.year:04d}-{d.month:02d}"
+
+def shard_key(receipt_date: Optional[str]) -> str:
+    return shard_of_day(_day(receipt_date))
+
+def route_shards(names, date_from: Optional[str] = None, date_to: Optional[str] = None) -> list[str]:
+    """
+    Tarih aralığıyla kesişen shard'lar (retrieve'daki SQL filtresiyle aynı kural:
+    tarih filtresi varsa tarihsiz kalemler dışarıda kalır).
+    """
+    if not (date_from or date_to):
+        return sorted(names)
+    lo = _day(date_from) if date_from else 0
+    if date_to:
+        hi = _day(date_to)
+        if hi == 0:
+            return []
+        hi_name = shard_of_day(hi)
+    out = []
+    for name in sorted(names):
+        if name == UNDATED_SHARD:
+            if lo == 0 and not date_to:
+                out.append(name)
+            continue
+        if lo and name < shard_of_day(lo):
+            continue
+        if date_to and name > hi_name:
+            continue
+        out.append(name)
+    return out
+
+def write_vocab_meta(conn: sqlite3.Connection, root: Path) -> int:
+    """
+    Yayınlanacak indeksteki (shard, anahtar) satırlarını root'a yazar (root
+    henüz yayınlanmamış sürüm klasörüdür). İçerik item_vectors'taki
+    indexed_shard/indexed_vocab'dan okunur, yani shard dosyalarıyla aynıdır.
+    """
+    base = """
+        FROM (SELECT DISTINCT indexed_shard, indexed_vocab FROM item_vectors WHERE indexed_vocab IS NOT NULL) p
+        JOIN vocab k ON k.vocab_id = p.indexed_vocab
+    """
+    n = conn.execute(f"SELECT COUNT(*) {base}").fetchone()[0]
+    shard_names = [s for (s,) in conn.execute(f"SELECT DISTINCT p.indexed_shard {base} ORDER BY 1")]
+    cat_names = [c for (c,) in conn.execute(f"SELECT DISTINCT k.category {base} WHERE k.category != '' ORDER BY 1")]
+    shard_codes = {s: i for i, s in enumerate(shard_names)}
+    codes = {c: i for i, c in enumerate(cat_names)}
+
+    vocab_ids = np.empty(n, dtype="int64")
+    shards = np.empty(n, dtype="int16")
+    cats = np.empty(n, dtype="int16")
+    cur = conn.execute(f"SELECT p.indexed_shard, p.indexed_vocab, k.category {base} ORDER BY 1, 2")
+    pos = 0
+    while True:
+        rows = cur.fetchmany(META_CHUNK_ROWS)
+        if not rows:
+            break
+        end = pos + len(rows)
+        shards[pos:end] = [shard_codes[r[0]] for r in rows]
+        vocab_ids[pos:end] = [r[1] for r in rows]
+        cats[pos:end] = [codes.get(r[2], -1) for r in rows]
+        pos = end
+
+    root.mkdir(parents=True, exist_ok=True)
+    (root / SHARD_NAMES_FILE).write_text(json.dumps(shard_names, ensure_ascii=False), encoding="utf-8")
+    (root / CAT_NAMES_FILE).write_text(json.dumps(cat_names, ensure_ascii=False), encoding="utf-8")
+    for name, arr in ((SHARD_CODES_FILE, shards), (CATS_FILE, cats), (IDS_FILE, vocab_ids)):
+        np.save(root / name, arr[:pos])
+    return pos
+
+
+def version_dir(version: int) -> Path:
+    return INDEX_DIR / f"v{int(version):06d}"
+
+def shard_path(root: Path, name: str) -> Path:
+    return root / SHARDS_DIR / f"{name}.faiss"
+
+def level_path(root: Path, level: str, name: str) -> Path:
+    return root / LEVELS_DIR / level / f"{name}.faiss"
+
+def levels_exist(root: Path, manifest: dict) -> bool:
+    """Manifest'teki fiş/işyeri düzeyi shard'ları root'ta mevcut mu (düzeyleri olmayan eski sürümde False)."""
+    levels = manifest.get("levels")
+    if not isinstance(levels, dict):
+        return False
+    return all(level_path(root, lv, n).exists() for lv in LEVELS for n in levels.get(lv) or {})
+
+def staging_dir(version: int, keep: bool = False) -> Path:
+    """Yayınlanmamış sürüm klasörü; keep=False ise yarıda kalan kurulumdan artakalanlar silinir."""
+    path = version_dir(version).with_suffix(".tmp")
+    if not keep:
+        shutil.rmtree(path, ignore_errors=True)
+    (path / SHARDS_DIR).mkdir(parents=True, exist_ok=True)
+    return path
+
+def publish_version(staging: Path, manifest: dict) -> Path:
+    """
+    Hazırlanan sürüm klasörünü yerine taşır, ardından manifest'i atomik
+    olarak değiştirir. Okuyucular yeni sürümü manifest üzerinden görür.
+    """
+    target = version_dir(manifest["version"])
+    # Manifest'e hiç yazılmamış (yayınlanmamış) eski deneme
+    shutil.rmtree(target, ignore_errors=True)
+    os.replace(staging, target)
+    write_manifest(manifest)
+    prune_versions(int(manifest["version"]))
+    return target
+
+def prune_versions(current: int, keep: int = KEEP_VERSIONS) -> None:
+    for path in INDEX_DIR.glob("v[0-9]*"):
+        try:
+            version = int(path.name[1:])
+        except ValueError:
+            continue
+        if version <= current - keep:
+            # Windows'ta hâlâ açık (memmap) dosyalar silinemez; sonraki kurulumda tekrar denenir
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def read_manifest() -> Optional[dict]:
+    try:
+        return json.loads(MANIFEST_PATH.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+def write_manifest(manifest: dict) -> None:
+    INDEX_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = MANIFEST_PATH.with_suffix(".json.tmp")
+    tmp.write_text(json.dumps(manifest, ensure_ascii=False, indent=2), encoding="utf-8")
+    os.replace(tmp, MANIFEST_PATH)
+
+
+def meta_exists(root: Path) -> bool:
+    return all((root / f).exists() for f in (IDS_FILE, SHARD_CODES_FILE, SHARD_NAMES_FILE, CATS_FILE, CAT_NAMES_FILE))
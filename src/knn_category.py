@@ -0,0 +1,94 @@
+from __future__ import annotations
+
+import sqlite3
+from typing import Optional
+
+import faiss
+import numpy as np
+
+from .index_faiss import encode_texts
+
+# Komşu sayısı ve oylamaya katılacak minimum kosinüs benzerliği
+K_NEIGHBORS = 5
+MIN_SIMILARITY = 0.60
+# Kazanan kategorinin toplam oy ağırlığındaki minimum payı
+MIN_VOTE_SHARE = 0.5
+
+def embed_names(names: list[str]) -> np.ndarray:
+    """
+    name_norm listesi için normalize edilmiş embedding matrisi döndürür.
+    Vektörler index_faiss ile ortak embedding cache'ten gelir; sadece
+    yeni adlar encode edilir.
+    """
+    return encode_texts(names)
+
+
+class KnnCategorizer:
+    """
+    Kullanıcının düzelttiği ürünler (product_dictionary, source='user') üzerinde
+    küçük bir FAISS indeksi. Kural setinin 'diger' bıraktığı adlar en
+    yakın etiketli komşuların benzerlik ağırlıklı oyuyla kategorilenir.
+    """
+
+    def __init__(self, label_names: list[str], label_cats: list[str], label_emb: np.ndarray):
+        self.label_names = label_names
+        self.label_cats = label_cats
+        self.index = faiss.IndexFlatIP(label_emb.shape[1])
+        self.index.add(label_emb)
+
+    def __len__(self) -> int:
+        return len(self.label_names)
+
+    def predict_vectors(self, emb: np.ndarray) -> list[tuple[Optional[str], float]]:
+        k = min(K_NEIGHBORS, len(self.label_names))
+        D, I = self.index.search(emb, k)
+
+        out: list[tuple[Optional[str], float]] = []
+        for sims, idxs in zip(D, I):
+            votes: dict[str, float] = {}
+            for sim, idx in zip(sims, idxs):
+                if idx < 0 or sim < MIN_SIMILARITY:
+                    continue
+                cat = self.label_cats[idx]
+                votes[cat] = votes.get(cat, 0.0) + float(sim)
+            if not votes:
+                out.append((None, 0.0))
+                continue
+            cat, weight = max(votes.items(), key=lambda x: x[1])
+            share = weight / sum(votes.values())
+            out.append((cat, share) if share >= MIN_VOTE_SHARE else (None, share))
+        return out
+
+    def predict(self, names: list[str]) -> list[tuple[Optional[str], float]]:
+        if not names:
+            return []
+        return self.predict_vectors(embed_names(names))
+
+
+def load_labels(conn: sqlite3.Connection) -> list[tuple[str, str]]:
+    # Kullanıcı düzeltmeleri product_dictionary'de tutulur (ham ad başına bir kayıt).
+    # Aynı normalize ad farklı kategorilerle düzeltildiyse çoğunluk kazanır.
+    rows = conn.execute(
+        """
+        SELECT name_norm, LOWER(category) AS cat, COUNT(*) AS n
+        FROM product_dictionary
+        WHERE source = 'user'
+          AND name_norm IS NOT NULL AND name_norm != ''
+          AND category IS NOT NULL AND category != ''
+        GROUP BY name_norm, cat
+        ORDER BY name_norm, n DESC
+        """
+    ).fetchall()
+    labels: dict[str, str] = {}
+    for name, cat, _ in rows:
+        labels.setdefault(name, cat)
+    return list(labels.items())
+
+def build_knn_categorizer(conn: sqlite3.Connection) -> Optional[KnnCategorizer]:
+    """Etiketli ad yoksa None döner (ikinci aşama atlanır)."""
+    labels = load_labels(conn)
+    if not labels:
+        return None
+    names = [n for n, _ in labels]
+    cats = [c for _, c in labels]
+    return KnnCategorizer(names, cats, embed_names(names))
@@ -0,0 +1,153 @@
+from __future__ import annotations
+
+import re
+import sqlite3
+from difflib import SequenceMatcher
+from typing import Optional
+
+from .db import connect, init_schema
+from .normalize import _TR_MAP
+
+# Unvan/şirket türü ekleri: "Migros Ticaret A.S." -> "migros"
+LEGAL_TOKENS = {
+    "a", "s", "as", "ao", "anonim", "sirketi", "sti", "ltd", "limited", "tic", "ticaret",
+    "san", "sanayi", "ve", "vb", "pazarlama", "magazacilik", "magazalari", "gida", "hizmetleri",
+    "inc", "co", "corp", "llc",
+}
+
+# Bulanık eşleşme eşiği (aynı blok içindeki adaylar için)
+FUZZY_THRESHOLD = 0.85
+BLOCK_LEN = 3
+
+def merchant_key(name: str) -> str:
+    """
+    İşyeri adını karşılaştırma anahtarına çevirir.
+      'MİGROS', 'Migros Ticaret A.S.', 'migros' -> 'migros'
+    """
+    if not name:
+        return ""
+    # casefold 'İ'yi 'i̇' (noktalı) yapar; önce TR harflerini sadeleştir
+    x = name.strip().translate(_TR_MAP).casefold()
+    x = re.sub(r"[^a-z0-9]+", " ", x)
+    tokens = x.split()
+    # Ekler sadece sondan atılır ("A-101" içindeki "a" korunur)
+    while len(tokens) > 1 and tokens[-1] in LEGAL_TOKENS:
+        tokens.pop()
+    return " ".join(tokens)
+
+def _block(key: str) -> str:
+    return key.replace(" ", "")[:BLOCK_LEN]
+
+def _similar(a: str, b: str) -> float:
+    # "migros" ~ "migros jet": kısa anahtar uzununun ilk token(lar)ı ise eşleşme say
+    if a.split()[0] == b.split()[0] and (a.startswith(b) or b.startswith(a)):
+        return 1.0
+    return SequenceMatcher(None, a, b).ratio()
+
+
+def lookup_merchant(conn: sqlite3.Connection, name: Optional[str]) -> Optional[int]:
+    """
+    Sorgudaki ad bilinen bir işyeri mi (örn. "Migros'a gittiğim günler"): sadece
+    tam anahtar eşleşmesi; bulanık eşleşme ürün adlarını işyerine çevirebilir, yeni işyeri eklenmez.
+    """
+    key = merchant_key(name or "")
+    if not key:
+        return None
+    row = conn.execute("SELECT merchant_id FROM merchant_aliases WHERE alias_key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+
+class MerchantResolver:
+    """
+    Serbest metin işyeri adlarını küçük bir tam sayı anahtara (merchants.id) eşler.
+    1) Tam anahtar eşleşmesi (merchant_aliases)
+    2) Aynı bloktaki (anahtarın ilk harfleri) kanonik işyerleriyle bulanık eşleşme
+    3) Eşleşme yoksa yeni işyeri
+    """
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+        self._alias_cache: dict[str, int] = {}
+
+    def resolve(self, name: Optional[str]) -> Optional[int]:
+        key = merchant_key(name or "")
+        if not key:
+            return None
+
+        mid = self._alias_cache.get(key)
+        if mid is not None:
+            return mid
+
+        row = self.conn.execute(
+            "SELECT merchant_id FROM merchant_aliases WHERE alias_key = ?", (key,)
+        ).fetchone()
+        if row:
+            self._alias_cache[key] = row[0]
+            return row[0]
+
+        block = _block(key)
+        best_id, best_score = None, 0.0
+        for cand_id, cand_key in self.conn.execute(
+            "SELECT id, merchant_key FROM merchants WHERE block = ?", (block,)
+        ):
+            score = _similar(key, cand_key)
+            if score > best_score:
+                best_id, best_score = cand_id, score
+
+        if best_id is not None and best_score >= FUZZY_THRESHOLD:
+            mid = best_id
+        else:
+            mid = self.conn.execute(
+                "INSERT INTO merchants (canonical_name, merchant_key, block) VALUES (?, ?, ?)",
+                ((name or "").strip(), key, block),
+            ).lastrowid
+
+        self.conn.execute(
+            "INSERT OR IGNORE INTO merchant_aliases (alias_key, merchant_id) VALUES (?, ?)",
+            (key, mid),
+        )
+        self._alias_cache[key] = mid
+        return mid
+
+
+def canonicalize_receipts(conn: sqlite3.Connection, batch_size: int = 1000) -> int:
+    """
+    merchant_id'si boş olan fişleri (yeni veya eski kayıtlar) eşler. Anahtarı boş
+    çıkan adlar (sadece noktalama vb.) NULL kalır; gruplamalar r.merchant'a düşer.
+    """
+    resolver = MerchantResolver(conn)
+    updated, last_id = 0, ""
+    while True:
+        # id sırasıyla ilerlenir; eşlenemeyen (NULL kalan) fişler aynı çalışmada tekrar seçilmez
+        rows = conn.execute(
+            """
+            SELECT id, merchant FROM receipts
+            WHERE merchant_id IS NULL AND merchant IS NOT NULL AND merchant != '' AND id > ?
+            ORDER BY id
+            LIMIT ?
+            """,
+            (last_id, batch_size),
+        ).fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        params = []
+        for rid, merchant in rows:
+            mid = resolver.resolve(merchant)
+            if mid is not None:
+                params.append((mid, rid))
+        with conn:
+            conn.executemany("UPDATE receipts SET merchant_id = ? WHERE id = ?", params)
+        updated += len(params)
+    return updated
+
+def main():
+    conn = connect()
+    init_schema(conn)
+    updated = canonicalize_receipts(conn)
+    total = conn.execute("SELECT COUNT(*) FROM merchants").fetchone()[0]
+    conn.close()
+    print(f"MERCHANTS_OK: receipts_updated={updated} merchants_total={total}")
+
+if __name__ == "__main__":
+    main()
@@ -31,3 +31,43 @@ def normalize_name(s: str) -> str:
     x = re.sub(r"[^a-z0-9\s\.\-]", " ", x)
     x = re.sub(r"\s+", " ", x).strip()
     return x
+
+# Paket boyutu: "su 1.5l", "sut 500ml", "un 2kg", "peynir 600g"
+_SIZE_RE = re.compile(r"(\d+(?:\.\d+)?)\s*(ml|cl|l|kg|g)\b")
+_SIZE_TO_BASE = {"ml": (0.001, "l"), "cl": (0.01, "l"), "l": (1.0, "l"), "g": (0.001, "kg"), "kg": (1.0, "kg")}
+
+def parse_size(name_norm: str) -> tuple[float | None, str | None]:
+    """
+    Normalize edilmiş addan paket boyutunu çıkarır, temel birime çevirir.
+      'su 1.5l'     -> (1.5, 'l')
+      'sut 500ml'   -> (0.5, 'l')
+      'peynir 600g' -> (0.6, 'kg')
+    """
+    if not name_norm:
+        return None, None
+    m = _SIZE_RE.search(name_norm)
+    if not m:
+        return None, None
+    try:
+        value = float(m.group(1))
+    except ValueError:
+        return None, None
+    factor, unit = _SIZE_TO_BASE[m.group(2)]
+    return round(value * factor, 6), unit
+
+# Paket adedi: "su 6x1.5l", "yumurta 30lu", "pecete 100 lu", "kahve filtre 80li"
+_PACK_RE = re.compile(r"\b(\d+)\s*(?:x\s*(?=\d)|(?:li|lu)\b)")
+
+def parse_pack_count(name_norm: str) -> float | None:
+    """
+    Çoklu paketlerde paket içindeki adet.
+      'su 6x1.5l' -> 6
+      'yumurta 30lu' -> 30
+    """
+    if not name_norm:
+        return None
+    m = _PACK_RE.search(name_norm)
+    if not m:
+        return None
+    n = int(m.group(1))
+    return float(n) if 1 < n <= 1000 else None
@@ -2,6 +2,7 @@ from __future__ import annotations
 
 from .ingest_pdf import main as ingest_main
 from .extract_llm import main as extract_all_main
+from .merchants import main as merchants_main
 from .enrich_items import main as enrich_main
 from .index_faiss import main as index_main
 from .report_monthly import main as report_main
@@ -14,10 +15,11 @@ def main():
     # 2) Extract ALL receipts -> items
     extract_all_main()
 
-    # 3) Enrich items (normalize + category)
+    # 3) Canonicalize merchants (eski / eşlenmemiş fişler) + enrich items (normalize + category)
+    merchants_main()
     enrich_main()
 
-    # 4) Rebuild FAISS index
+    # 4) Update FAISS index (sadece değişen kalemler yeniden embed edilir)
     index_main()
 
     # 5) Rebuild reports
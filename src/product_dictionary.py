@@ -0,0 +1,156 @@
+from __future__ import annotations
+
+import json
+import sqlite3
+from datetime import datetime
+
+from .normalize import normalize_name, parse_size, parse_pack_count
+from .categorize import categorize, rules_version
+
+# Ad ayrıştırma mantığı değiştiğinde artırılır; eski 'rule' kayıtları yeniden hesaplanır
+PARSER_VERSION = 2
+
+def dictionary_version() -> str:
+    return f"{rules_version()}.p{PARSER_VERSION}"
+
+def missing_names(conn: sqlite3.Connection, version: str) -> list[str]:
+    """
+    Yeniden hesaplanacak farklı ham adlar (satır sayısından çok daha az):
+    zenginleştirme bekleyen satırlarda sözlükte olmayanlar ve kalemlerde geçen,
+    eski kural setiyle hesaplanmış tüm otomatik (rule/knn) kayıtlar.
+    """
+    rows = conn.execute(
+        """
+        SELECT DISTINCT i.name_raw
+        FROM items i
+        LEFT JOIN product_dictionary d ON d.name_raw = i.name_raw
+        WHERE i.enriched_name_raw IS NOT i.name_raw AND d.name_raw IS NULL
+        UNION
+        SELECT d.name_raw
+        FROM product_dictionary d
+        WHERE d.source != 'user' AND d.rules_version IS NOT ?
+          AND d.name_raw IN (SELECT name_raw FROM items)
+        """,
+        (version,),
+    ).fetchall()
+    return [r[0] for r in rows]
+
+def compute_entries(conn: sqlite3.Connection, names_raw: list[str], knn=None) -> list[tuple]:
+    """Kural (+ opsiyonel kNN) ile sözlük kayıtlarını hesaplar."""
+    version = dictionary_version()
+    now = datetime.now().isoformat()
+
+    entries: dict[str, list] = {}
+    fallback: dict[str, str] = {}
+    for name_raw in names_raw:
+        norm = normalize_name(name_raw)
+        cat = categorize(norm)
+        size_value, size_unit = parse_size(norm)
+        pack_count = parse_pack_count(norm)
+        entries[name_raw] = [name_raw, norm, cat, size_value, size_unit, pack_count, "rule", version, now]
+        if cat == "diger" and norm:
+            fallback[name_raw] = norm
+
+    # Kuralın eşlemediği adlar: etiketli komşulardan tek batch kNN
+    if knn is not None and fallback:
+        for name_raw, (cat, _) in zip(fallback, knn.predict(list(fallback.values()))):
+            if cat:
+                entries[name_raw][2] = cat
+                entries[name_raw][6] = "knn"
+
+    return [tuple(e) for e in entries.values()]
+
+def upsert_entries(conn: sqlite3.Connection, entries: list[tuple]) -> None:
+    # Sonucu değişen (ad, kategori, boyut, paket) otomatik kayıtların satırları yeniden join edilir;
+    # aksi halde aynı ham adın eski ve yeni satırları farklı kategoride kalır
+    existing = {
+        r[0]: r[1:]
+        for r in conn.execute(
+            """
+            SELECT name_raw, name_norm, category, size_value, size_unit, pack_count
+            FROM product_dictionary
+            WHERE source != 'user' AND name_raw IN (SELECT value FROM json_each(?))
+            """,
+            (json.dumps([e[0] for e in entries]),),
+        )
+    }
+    changed = [(e[0],) for e in entries if e[0] in existing and tuple(existing[e[0]]) != tuple(e[1:6])]
+    # Kullanıcı düzeltmeleri otomatik sonuçlarla ezilmez
+    conn.executemany(
+        """
+        INSERT INTO product_dictionary
+          (name_raw, name_norm, category, size_value, size_unit, pack_count, source, rules_version, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(name_raw) DO UPDATE SET
+          name_norm = excluded.name_norm,
+          category = excluded.category,
+          size_value = excluded.size_value,
+          size_unit = excluded.size_unit,
+          pack_count = excluded.pack_count,
+          source = excluded.source,
+          rules_version = excluded.rules_version,
+          updated_at = excluded.updated_at
+        WHERE product_dictionary.source != 'user'
+        """,
+        entries,
+    )
+    conn.executemany("UPDATE items SET enriched_name_raw = NULL WHERE name_raw = ?", changed)
+
+def apply_to_items(conn: sqlite3.Connection, limit: int) -> int:
+    """
+    Bekleyen satırların bir parçasını sözlükle join ederek günceller. Parça sadece
+    sözlükte karşılığı olan bekleyen satırlardan seçilir: 0 dönmesi bunların bittiği anlamına gelir.
+    """
+    cur = conn.execute(
+        """
+        UPDATE items
+        SET name_norm = d.name_norm,
+            category = d.category,
+            category_source = d.source,
+            volume_l = CASE WHEN d.size_unit = 'l' THEN d.size_value END,
+            weight_kg = CASE WHEN d.size_unit = 'kg' THEN d.size_value END,
+            pack_count = d.pack_count,
+            enriched_name_raw = items.name_raw
+        FROM product_dictionary d
+        WHERE d.name_raw = items.name_raw
+          AND items.rowid IN (
+            SELECT p.rowid FROM items p
+            JOIN product_dictionary pd ON pd.name_raw = p.name_raw
+            WHERE p.enriched_name_raw IS NOT p.name_raw
+            LIMIT ?
+          )
+        """,
+        (limit,),
+    )
+    return cur.rowcount
+
+def record_user_correction(conn: sqlite3.Connection, item_id: str, name_norm: str, category: str) -> None:
+    """
+    Veri düzenleyicideki düzeltmeyi sözlüğe yazar ve aynı ham ada sahip
+    satırları bir sonraki zenginleştirmede yeniden join edilmek üzere işaretler.
+    """
+    row = conn.execute("SELECT name_raw FROM items WHERE id = ?", (item_id,)).fetchone()
+    if row is None:
+        return
+    name_raw = row[0]
+    size_value, size_unit = parse_size(name_norm or "")
+    pack_count = parse_pack_count(name_norm or "")
+    conn.execute(
+        """
+        INSERT INTO product_dictionary
+          (name_raw, name_norm, category, size_value, size_unit, pack_count, source, rules_version, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, 'user', NULL, ?)
+        ON CONFLICT(name_raw) DO UPDATE SET
+          name_norm = excluded.name_norm,
+          category = excluded.category,
+          size_value = excluded.size_value,
+          size_unit = excluded.size_unit,
+          pack_count = excluded.pack_count,
+          source = 'user',
+          rules_version = NULL,
+          updated_at = excluded.updated_at
+        """,
+        (name_raw, name_norm, category, size_value, size_unit, pack_count, datetime.now().isoformat()),
+    )
+    # Düzeltilen satır dahil: paket bilgisi de yeni addan yeniden türetilir
+    conn.execute("UPDATE items SET enriched_name_raw = NULL WHERE name_raw = ?", (name_raw,))
@@ -15,27 +15,66 @@ CATEGORY_ALIASES = {
 
 STOPWORDS = {
     "kac", "kaç", "lira", "tutar", "toplam", "harcama", "harcamam", "ne", "nedir",
-    "mi", "mı", "mu", "mü", "son", "gun", "gün", "ay", "bu", "gecen", "geçen",
+    "mi", "mı", "mu", "mü", "son", "gun", "gün", "ay", "bu", "gecen", "geçen", "kadar", "harcadim", "harcadım",
     "kategorilere", "dagilim", "dağılım", "kırılım", "kirilim",
-    "en", "cok", "çok", "kez", "defa", "adet", "tane", "alinmis", "alınmış"
+    "en", "cok", "çok", "kez", "defa", "adet", "tane", "alinmis", "alınmış",
+    # İngilizce sorular ("how many times did I buy milk last month")
+    "how", "many", "much", "often", "times", "did", "buy", "bought", "what", "was", "were", "the",
+    "total", "spend", "spent", "spending", "last", "this", "month", "days", "units", "pieces",
+    "liters", "litres", "unit", "price", "average", "for", "and"
 }
 
+# Cevabın birimi: kalem (varsayılan), fiş ya da işyeri. "en pahalı fişim" fiş, "hangi marketlere
+# gittim" işyeri, "Migros'a gittiğim günler" fiş düzeyinde aranır (daha az aday, daha kısa kanıt).
+GRANULARITIES = ("item", "receipt", "merchant")
+_RECEIPT_RE = re.compile(r"\bfi[sş](i|im|imi|imde|ler\w*|in\w*)?\b")
+MERCHANT_CUES = (
+    "hangi market", "hangi mağaza", "hangi magaza", "hangi işyer", "hangi isyer", "hangi dükkan", "hangi dukkan",
+    "marketler", "mağazalar", "magazalar", "işyerleri", "isyerleri", "nereden", "nerede",
+)
+VISIT_CUES = ("gittiğim", "gittigim", "gittim", "alışveriş", "alisveris")
+# Fiş/işyeri sorularında "market" işyeri anlamında; gıda kategorisi filtresine çevrilmez
+MERCHANT_WORDS = {"market"}
+# Fiş/işyeri sorularında yönlendirme kelimeleri ürün terimi sayılmaz; kalem sorularında
+# ürün adının parçası olabilir ("market poşeti"), orada sadece "aldım/aldığım" atlanır
+_CUE_TOKEN_RE = re.compile(
+    r"(fi[sş](i|im|imi|imde|ler\w*|in\w*)?|gitti\w*|al[ıi][sş]veri[sş]\w*|hangi|market\w*|ma[gğ]aza\w*"
+    r"|[iı][sş]yer\w*|d[uü]kkan\w*|nere\w*|pahal\w*|ucuz\w*|g[uü]nler\w*)"
+)
+_VERB_TOKEN_RE = re.compile(r"(ald[ıi][gğ]\w*|ald[ıi]m\w*)")
+
 @dataclass
 class QuerySpec:
     product_term: Optional[str] = None
     category: Optional[str] = None
     date_from: Optional[str] = None  # YYYY-MM-DD
     date_to: Optional[str] = None    # YYYY-MM-DD (inclusive)
+    granularity: str = "item"        # GRANULARITIES
+    # Kanonik işyeri filtresi (merchants.id); fiş/işyeri sorgularında ürün terimi bilinen bir işyeriyse atanır
+    merchant_id: Optional[int] = None
 
 def _iso(d: date) -> str:
     return d.isoformat()
 
+def detect_granularity(x: str) -> str:
+    """Küçük harfli sorudan cevap birimi: fiş kelimesi > işyeri ifadeleri > ziyaret ifadeleri > kalem."""
+    if _RECEIPT_RE.search(x):
+        return "receipt"
+    if any(c in x for c in MERCHANT_CUES):
+        return "merchant"
+    if any(c in x for c in VISIT_CUES):
+        return "receipt"
+    return "item"
+
 def parse_query(q: str) -> QuerySpec:
     x = (q or "").strip().lower()
     spec = QuerySpec()
+    spec.granularity = detect_granularity(x)
 
     # 1) Kategori (substring)
     for cat, keys in CATEGORY_ALIASES.items():
+        if spec.granularity != "item":
+            keys = [k for k in keys if k not in MERCHANT_WORDS]
         if any(k in x for k in keys):
             spec.category = cat
             break
@@ -43,7 +82,7 @@ def parse_query(q: str) -> QuerySpec:
     # 2) Tarih filtreleri
     today = date.today()
 
-    m = re.search(r"son\s+(\d+)\s+g[uü]n", x)
+    m = re.search(r"(?:son|last)\s+(\d+)\s+(?:g[uü]n|days?)", x)
     if m:
         n = int(m.group(1))
         spec.date_from = _iso(today - timedelta(days=n))
@@ -60,12 +99,12 @@ def parse_query(q: str) -> QuerySpec:
         spec.date_from = _iso(start)
         spec.date_to = _iso(end)
 
-    if "bu ay" in x:
+    if "bu ay" in x or "this month" in x:
         start = date(today.year, today.month, 1)
         spec.date_from = _iso(start)
         spec.date_to = _iso(today)
 
-    if ("gecen ay" in x) or ("geçen ay" in x):
+    if ("gecen ay" in x) or ("geçen ay" in x) or ("last month" in x):
         first_this = date(today.year, today.month, 1)
         end = first_this - timedelta(days=1)
         start = date(end.year, end.month, 1)
@@ -83,7 +122,9 @@ def parse_query(q: str) -> QuerySpec:
     candidates = []
     for t in tokens:
         tl = t.lower()
-        if tl in STOPWORDS:
+        if tl in STOPWORDS or _VERB_TOKEN_RE.fullmatch(tl):
+            continue
+        if spec.granularity != "item" and _CUE_TOKEN_RE.fullmatch(tl):
             continue
         # kategori kelimelerini ele
         if any(tl in keys for keys in CATEGORY_ALIASES.values()):
@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+import sqlite3
+from dataclasses import dataclass, field
+from typing import Optional
+
+from .aggregate import AGGREGATE_SELECT, results_from_groups
+from .query_parse import QuerySpec
+
+# Kalem sorgularının ortak kolon listesi (row_to_item ile aynı sırada)
+ITEM_COLUMNS = """
+      i.id,
+      r.receipt_date,
+      COALESCE(m.canonical_name, r.merchant),
+      r.source_path,
+      i.name_raw,
+      i.name_norm,
+      i.category,
+      i.qty,
+      i.unit,
+      i.amount,
+      i.line_no,
+      i.volume_l,
+      i.weight_kg,
+      i.pack_count,
+      i.unit_price,
+      i.liters_total,
+      i.kg_total
+"""
+ITEM_FROM = """
+    FROM items i
+    JOIN receipts r ON r.id = i.receipt_id
+    LEFT JOIN merchants m ON m.id = r.merchant_id
+"""
+ITEM_SELECT = f"""
+    SELECT{ITEM_COLUMNS}{ITEM_FROM}"""
+
+def row_to_item(r) -> dict:
+    return {
+        "item_id": r[0],
+        "date": r[1],
+        "merchant": r[2],
+        "source_path": r[3],
+        "name_raw": r[4],
+        "name_norm": r[5],
+        "category": r[6],
+        "qty": r[7],
+        "unit": r[8],
+        "amount": r[9],
+        "line_no": r[10],
+        "volume_l": r[11],
+        "weight_kg": r[12],
+        "pack_count": r[13],
+        "unit_price": r[14],
+        "liters_total": r[15],
+        "kg_total": r[16],
+    }
+
+def filter_sql(filters: Optional[QuerySpec]) -> tuple[str, list]:
+    sql, params = "", []
+    if filters is None:
+        return sql, params
+    if filters.category:
+        sql += " AND i.category = ?"
+        params.append(filters.category)
+    if filters.date_from:
+        sql += " AND r.receipt_date >= ?"
+        params.append(filters.date_from)
+    if filters.date_to:
+        sql += " AND r.receipt_date <= ?"
+        params.append(filters.date_to)
+    if filters.merchant_id is not None:
+        sql += " AND r.merchant_id = ?"
+        params.append(filters.merchant_id)
+    return sql, params
+
+# Kanıt sıralamaları: en pahalı (kategori/tarih toplamları) ve en yeni kalemler
+EVIDENCE_ORDERS = {
+    "amount": "COALESCE(i.amount, 0) DESC",
+    "date": "r.receipt_date DESC",
+}
+
+
+@dataclass
+class ItemPlan:
+    """QuerySpec'ten derlenmiş kalem sorgusu: parametreli WHERE koşulu (tüm yüklemler SQL'de)."""
+    where: str = ""
+    params: list = field(default_factory=list)
+
+    def sql(self, select: str, tail: str = "") -> str:
+        return f"{select}{ITEM_FROM}WHERE 1 = 1{self.where}{tail}"
+
+    def aggregate(self, conn: sqlite3.Connection) -> dict:
+        """Filtreye uyan kalemlerin sonuç sözlüğü; kalemler Python'a hiç gelmez."""
+        rows = conn.execute(self.sql(AGGREGATE_SELECT, " GROUP BY 1, 2, 3"), self.params).fetchall()
+        return results_from_groups(rows)
+
+    def top_items(self, conn: sqlite3.Connection, order: str = "amount", limit: int = 5) -> list[dict]:
+        """Kanıt satırları: sadece sıralamanın ilk `limit` kalemi okunur."""
+        sql = self.sql(f"SELECT{ITEM_COLUMNS}", f" ORDER BY {EVIDENCE_ORDERS[order]}, i.id LIMIT ?")
+        return [row_to_item(r) for r in conn.execute(sql, [*self.params, limit])]
+
+def plan_items(spec: QuerySpec) -> ItemPlan:
+    """Kategori/tarih/işyeri filtrelerini parametreli SQL'e derler."""
+    where, params = filter_sql(spec)
+    return ItemPlan(where, params)
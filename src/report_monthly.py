@@ -20,17 +20,22 @@ def main():
     df = pd.read_sql_query(
         """
         SELECT
+          r.id AS receipt_id,
           r.receipt_date,
-          r.merchant,
+          r.merchant_id,
+          COALESCE(m.canonical_name, r.merchant) AS merchant,
           r.source_path,
           i.name_raw,
           i.name_norm,
           i.category,
           i.qty,
           i.unit,
-          i.amount
+          i.amount,
+          i.liters_total,
+          i.kg_total
         FROM items i
         JOIN receipts r ON r.id = i.receipt_id
+        LEFT JOIN merchants m ON m.id = r.merchant_id
         WHERE r.receipt_date IS NOT NULL
         """,
         con,
@@ -52,11 +57,10 @@ def main():
         .sort_values("month")
     )
 
-    # 2) Aylık kategori kırılımı
+    # 2) Aylık kategori kırılımı (litre/kg enrich'te hesaplanan kolonlardan)
     monthly_by_category = (
-        df.groupby(["month", "category"], as_index=False)["amount"]
-        .sum()
-        .rename(columns={"amount": "total_try"})
+        df.groupby(["month", "category"], as_index=False)
+        .agg(total_try=("amount", "sum"), total_liters=("liters_total", "sum"), total_kg=("kg_total", "sum"))
         .sort_values(["month", "total_try"], ascending=[True, False])
     )
 
@@ -69,19 +73,34 @@ def main():
     )
     top_items_20 = top_items.groupby("month").head(20).reset_index(drop=True)
 
+    # 4) Aylık işyeri kırılımı (kanonik merchant_id üzerinden; yazım varyantları tek satır)
+    # Eşlenmemiş fişler (merchant_id NULL) kendi adlarıyla gruplanır: COALESCE(r.merchant_id, r.merchant)
+    # NULL içeren merchant_id kolonu float okunur: anahtar "12.0" değil "12" olsun diye önce Int64
+    merchant_ids = df["merchant_id"].astype("Int64")
+    df["merchant_key"] = merchant_ids.astype(str).where(merchant_ids.notna(), df["merchant"]).astype(str)
+    monthly_by_merchant = (
+        df.groupby(["month", "merchant_key"], as_index=False)
+        .agg(merchant=("merchant", "first"), total_try=("amount", "sum"), visits=("receipt_id", "nunique"))
+        .drop(columns=["merchant_key"])
+        .sort_values(["month", "total_try"], ascending=[True, False])
+    )
+
     # CSV export
     p1 = OUT_DIR / "monthly_total.csv"
     p2 = OUT_DIR / "monthly_by_category.csv"
     p3 = OUT_DIR / "top_items_by_month_top20.csv"
+    p4 = OUT_DIR / "monthly_by_merchant.csv"
 
     monthly_total.to_csv(p1, index=False, encoding="utf-8")
     monthly_by_category.to_csv(p2, index=False, encoding="utf-8")
     top_items_20.to_csv(p3, index=False, encoding="utf-8")
+    monthly_by_merchant.to_csv(p4, index=False, encoding="utf-8")
 
     print("REPORT_OK")
     print(f"- {p1}")
     print(f"- {p2}")
     print(f"- {p3}")
+    print(f"- {p4}")
 
     # Konsolda da kısa özet göster
     print("\nMONTHLY_TOTAL (preview):")
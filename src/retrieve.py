@@ -0,0 +1,309 @@
+from __future__ import annotations
+
+import json
+import os
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+from .ai.embedder import get_embedder
+from .db import connect, has_fts, init_schema
+from .index_manager import index_ready
+from .normalize import normalize_name
+from .query_parse import QuerySpec
+from .query_plan import filter_sql
+from .index_meta import LEVEL_MERCHANT, LEVEL_RECEIPT
+from .search_faiss import level_search_many, vector_search_many
+
+# Reciprocal rank fusion sabiti (standart değer); skor = sum(1 / (RRF_K + sıra))
+RRF_K = 60
+# Her kaynaktan füzyona alınan aday anahtar sayısı
+CANDIDATES_PER_SOURCE = 50
+# Sorgu başına kalemleri döndürülen anahtar (ürün, kategori, işyeri) sayısı
+KEYS_PER_QUERY = 20
+# Fiş/işyeri düzeyinde sorgu başına döndürülen fiş ve işyeri sayısı (kanıt satır başına bir fiş/işyeri)
+RECEIPTS_PER_QUERY = 20
+MERCHANTS_PER_QUERY = 10
+# FTS kolon ağırlıkları: name_norm, name_raw, merchant
+BM25_WEIGHTS = (10.0, 5.0, 1.0)
+# Sorgu embedding'leri için LRU cache boyutu (aynı ürün terimleri sık tekrarlanır)
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_EMB_CACHE_SIZE", "2048"))
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+def fts_tokens(text: str) -> list[str]:
+    return _TOKEN_RE.findall(normalize_name(text or ""))
+
+def fts_phrase(text: str) -> Optional[str]:
+    """
+    LIKE '%terim%' karşılığı: terim tokenları sırayla, son token önek olarak
+    ("sut" -> sutlac da eşleşir). 2 harflik tek token ("su") tam eşleşir.
+    """
+    tokens = fts_tokens(text)
+    if not tokens:
+        return None
+    phrase = '"' + " ".join(tokens) + '"'
+    return phrase if len(tokens) == 1 and len(tokens[0]) <= 2 else phrase + "*"
+
+def fts_any(text: str) -> Optional[str]:
+    # Sıralama için geniş eşleşme: tokenlardan herhangi biri (3+ harfliler önek)
+    tokens = list(dict.fromkeys(fts_tokens(text)))
+    parts = [f'"{t}"*' if len(t) >= 3 else f'"{t}"' for t in tokens]
+    return " OR ".join(parts) if parts else None
+
+# Düzey -> FTS eşleşmelerinin gruplandığı FAISS id'si
+LEVEL_KEY_SQL = {
+    "item": "i.vocab_id",
+    LEVEL_RECEIPT: "(SELECT rv.vec_id FROM receipt_vectors rv WHERE rv.receipt_id = r.id)",
+    LEVEL_MERCHANT: "r.merchant_id",
+}
+
+def fts_search(
+    conn: sqlite3.Connection,
+    match: str,
+    filters: Optional[QuerySpec] = None,
+    limit: int = CANDIDATES_PER_SOURCE,
+    level: str = "item",
+) -> list[int]:
+    """
+    FTS MATCH ifadesine uyan kalemlerin anahtarları (vocab_id; fiş/işyeri
+    düzeyinde fişin vec_id'si ya da merchants.id), en iyi bm25 skoru sırasıyla
+    (filtreler SQL'de uygulanır).
+    """
+    where, params = filter_sql(filters)
+    # bm25() GROUP BY ile aynı sorguda kullanılamaz; eşleşmeler önce ayrı hesaplanır
+    rows = conn.execute(
+        f"""
+        WITH hits AS MATERIALIZED (
+          SELECT {LEVEL_KEY_SQL[level]} AS key, bm25(items_fts, {", ".join(str(w) for w in BM25_WEIGHTS)}) AS score
+          FROM items_fts f
+          JOIN item_vectors v ON v.vec_id = f.rowid
+          JOIN items i ON i.id = v.item_id
+          JOIN receipts r ON r.id = i.receipt_id
+          WHERE items_fts MATCH ?{where}
+        )
+        SELECT key FROM hits WHERE key IS NOT NULL GROUP BY key ORDER BY MIN(score) LIMIT ?
+        """,
+        [match, *params, limit],
+    ).fetchall()
+    return [r[0] for r in rows]
+
+def candidate_keys(conn: sqlite3.Connection, filters: Optional[QuerySpec]) -> Optional[np.ndarray]:
+    """
+    Tarih aralığında kalemi olan anahtarlar (vektör aramasının id seçicisi).
+    Tarih filtresi yoksa None: ay routing'i ve kategori kodu yeterli.
+    """
+    if filters is None or not (filters.date_from or filters.date_to):
+        return None
+    where, params = filter_sql(filters)
+    return np.fromiter(
+        (r[0] for r in conn.execute(
+            f"""
+            SELECT DISTINCT i.vocab_id
+            FROM items i
+            JOIN receipts r ON r.id = i.receipt_id
+            WHERE i.vocab_id IS NOT NULL{where}
+            """,
+            params,
+        )),
+        dtype="int64",
+    )
+
+def level_candidates(conn: sqlite3.Connection, level: str, filters: Optional[QuerySpec]) -> Optional[np.ndarray]:
+    """
+    Fiş/işyeri düzeyinde filtreye (kategori, tarih, işyeri) uyan kalemi olan
+    fişlerin vec_id'leri ya da işyerlerinin id'leri; filtre yoksa None.
+    """
+    where, params = filter_sql(filters)
+    if not where:
+        return None
+    return np.fromiter(
+        (r[0] for r in conn.execute(
+            f"""
+            SELECT DISTINCT {LEVEL_KEY_SQL[level]} AS key
+            FROM items i
+            JOIN receipts r ON r.id = i.receipt_id
+            WHERE 1 = 1{where}
+            """,
+            params,
+        ) if r[0] is not None),
+        dtype="int64",
+    )
+
+def expand_keys(
+    conn: sqlite3.Connection, keys: list[tuple[int, float]], filters: Optional[QuerySpec] = None
+) -> list[tuple[str, float]]:
+    """
+    Anahtarların posting list'i (items.vocab_id): filtreye uyan tüm kalemler,
+    anahtar sırası ve anahtar içinde yeniden eskiye. (item_id, anahtar skoru) döner.
+    """
+    if not keys:
+        return []
+    where, params = filter_sql(filters)
+    rank = {vid: i for i, (vid, _) in enumerate(keys)}
+    score = dict(keys)
+    rows = conn.execute(
+        f"""
+        SELECT i.id, i.vocab_id
+        FROM items i
+        JOIN receipts r ON r.id = i.receipt_id
+        WHERE i.vocab_id IN (SELECT value FROM json_each(?)){where}
+        ORDER BY r.receipt_date DESC, i.id
+        """,
+        [json.dumps(list(rank)), *params],
+    ).fetchall()
+    rows.sort(key=lambda r: rank[r[1]])
+    return [(iid, score[vid]) for iid, vid in rows]
+
+# normalize metin -> embedding (süreç içi, embedder singleton'ı ile aynı ömür)
+_query_cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+_query_lock = threading.Lock()
+
+def embed_queries(texts: list[str]) -> np.ndarray:
+    """
+    Sorgu embedding'leri; anahtar normalize metin ("Süt", "süt " -> "sut") ve
+    encode edilen de bu anahtardır (vektör sorunun ilk hangi yazımla geldiğine
+    bağlı olmaz; kalem dokümanlarındaki ad da normalize). Cache'te olmayanlar
+    tek batch'te encode edilir.
+    """
+    keys = [normalize_name(t) or t for t in texts]
+    found: dict[str, np.ndarray] = {}
+    with _query_lock:
+        for key in keys:
+            if key in _query_cache:
+                _query_cache.move_to_end(key)
+                found[key] = _query_cache[key]
+
+    missing = list(dict.fromkeys(k for k in keys if k not in found))
+    if missing:
+        emb = get_embedder().encode(missing)
+        with _query_lock:
+            for key, vec in zip(missing, emb):
+                found[key] = _query_cache[key] = vec
+            while len(_query_cache) > QUERY_CACHE_SIZE:
+                _query_cache.popitem(last=False)
+
+    if not keys:
+        return np.zeros((0, 0), dtype="float32")
+    return np.stack([found[k] for k in keys]).astype("float32", copy=False)
+
+def embed_query(text: str) -> np.ndarray:
+    return embed_queries([text])
+
+def rrf_fuse(rankings: list[list], k: int, rrf_k: int = RRF_K) -> list[tuple]:
+    scores: dict = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, start=1):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank)
+    return sorted(scores.items(), key=lambda x: -x[1])[:k]
+
+def search_keys_many(
+    queries: list[str],
+    filters: Optional[QuerySpec] = None,
+    k: int = KEYS_PER_QUERY,
+    conn: Optional[sqlite3.Connection] = None,
+) -> list[list[tuple[int, float]]]:
+    """
+    Sorgu başına en iyi k anahtar: (vocab_id, rrf skoru). Sorgular tek batch'te
+    encode edilip tek FAISS çağrısıyla aranır; filtre tüm sorgular için ortaktır.
+    """
+    if not queries:
+        return []
+    own_conn = conn is None
+    if own_conn:
+        conn = connect()
+        init_schema(conn)
+    try:
+        rankings: list[list[list[int]]] = [[] for _ in queries]
+
+        if has_fts(conn):
+            for r, query in zip(rankings, queries):
+                match = fts_any(query)
+                if match:
+                    r.append(fts_search(conn, match, filters, CANDIDATES_PER_SOURCE))
+
+        if index_ready():
+            f = filters or QuerySpec()
+            hits = vector_search_many(
+                embed_queries(queries), CANDIDATES_PER_SOURCE, f.category, f.date_from, f.date_to,
+                candidates=candidate_keys(conn, f),
+            )
+            for r, h in zip(rankings, hits):
+                r.append([vid for vid, _ in h])
+
+        return [rrf_fuse(r, k) for r in rankings]
+    finally:
+        if own_conn:
+            conn.close()
+
+def search_level(
+    level: str,
+    query: str,
+    filters: Optional[QuerySpec] = None,
+    k: Optional[int] = None,
+    conn: Optional[sqlite3.Connection] = None,
+) -> list[tuple[int, float]]:
+    """
+    Fiş ya da işyeri düzeyinde hibrit arama: kalem FTS eşleşmeleri fişe/işyerine
+    gruplanır, özet dokümanlarının FAISS sıralamasıyla RRF'te birleştirilir.
+    (fiş vec_id'si ya da merchants.id, rrf skoru) döner.
+    """
+    if k is None:
+        k = RECEIPTS_PER_QUERY if level == LEVEL_RECEIPT else MERCHANTS_PER_QUERY
+    own_conn = conn is None
+    if own_conn:
+        conn = connect()
+        init_schema(conn)
+    try:
+        rankings: list[list[int]] = []
+        match = fts_any(query)
+        if match and has_fts(conn):
+            rankings.append(fts_search(conn, match, filters, CANDIDATES_PER_SOURCE, level=level))
+        if index_ready():
+            f = filters or QuerySpec()
+            hits = level_search_many(
+                level, embed_queries([query]), CANDIDATES_PER_SOURCE, f.date_from, f.date_to,
+                candidates=level_candidates(conn, level, f),
+            )[0]
+            rankings.append([key for key, _ in hits])
+        return rrf_fuse(rankings, k)
+    finally:
+        if own_conn:
+            conn.close()
+
+def search_many(
+    queries: list[str],
+    filters: Optional[QuerySpec] = None,
+    k: int = KEYS_PER_QUERY,
+    conn: Optional[sqlite3.Connection] = None,
+) -> list[list[tuple[str, float]]]:
+    """
+    retrieve()'ın çoklu sorgu hali (toplu soru modu, UI önerileri). Sorgu
+    başına en iyi k anahtarın filtreye uyan tüm kalemleri döner.
+    """
+    own_conn = conn is None
+    if own_conn:
+        conn = connect()
+        init_schema(conn)
+    try:
+        return [expand_keys(conn, keys, filters) for keys in search_keys_many(queries, filters, k, conn)]
+    finally:
+        if own_conn:
+            conn.close()
+
+def retrieve(
+    query: str,
+    filters: Optional[QuerySpec] = None,
+    k: int = KEYS_PER_QUERY,
+    conn: Optional[sqlite3.Connection] = None,
+) -> list[tuple[str, float]]:
+    """
+    Hibrit arama: FTS5 (bm25) ve FAISS anahtar (ürün, kategori, işyeri)
+    sıralamaları reciprocal rank fusion ile birleştirilir; en iyi k anahtarın
+    kategori/tarih filtresine uyan tüm kalemleri (item_id, rrf skoru) döner.
+    """
+    return search_many([query], filters, k, conn)[0]
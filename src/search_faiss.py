@@ -1,22 +1,166 @@
 from __future__ import annotations
 
-import json
-from pathlib import Path
+import math
+from typing import Optional
 
 import faiss
 import numpy as np
-from sentence_transformers import SentenceTransformer
 
-EMB_MODEL_NAME = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
-INDEX_PATH = Path("data/index/items.faiss")
-META_PATH = Path("data/index/items_meta.jsonl")
+from .ai.embedder import get_embedder
+from .db import connect
+from .index_factory import IndexSpec, index_ids
+from .index_faiss import fetch_docs
+from .index_manager import IndexShard, get_index_manager
+from .index_meta import LEVEL_RECEIPT, route_shards
 
-def load_meta():
-    metas = []
-    with META_PATH.open("r", encoding="utf-8") as f:
-        for line in f:
-            metas.append(json.loads(line))
-    return metas
+# Filtreye uyan vektör sayısı bunun altındaysa HNSW yerine seçili vektörler üzerinde tam arama
+EXACT_FILTER_MAX = 20_000
+# IVF: filtre bu orandan seçiciyse tüm listeler taranır (skor sadece seçili id'ler için hesaplanır)
+EXHAUSTIVE_SELECTIVITY = 0.01
+
+def _id_bitmap(vec_ids: np.ndarray) -> np.ndarray:
+    # IDSelectorBitmap: id'nin biti 1 ise aday (little-endian bit sırası)
+    bits = np.zeros(int(vec_ids.max()) + 1, dtype=bool)
+    bits[vec_ids] = True
+    return np.packbits(bits, bitorder="little")
+
+def _filtered_params(index: faiss.Index, spec: IndexSpec, sel: faiss.IDSelector, selectivity: float, k: int):
+    if spec.is_ivf:
+        nlist = faiss.extract_index_ivf(index).nlist
+        if selectivity <= EXHAUSTIVE_SELECTIVITY:
+            nprobe = nlist
+        else:
+            # Seçicilik düştükçe daha çok liste taranır ki filtre sonrası k aday kalsın
+            nprobe = min(nlist, math.ceil((spec.nprobe or 1) / selectivity))
+        return faiss.SearchParametersIVF(sel=sel, nprobe=int(nprobe))
+    if spec.kind == "hnsw":
+        ef = min(4096, max(spec.ef_search or 64, math.ceil(k / max(selectivity, 1e-6))))
+        return faiss.SearchParametersHNSW(sel=sel, efSearch=int(ef))
+    return faiss.SearchParameters(sel=sel)
+
+def _search_shard(shard: IndexShard, qvs: np.ndarray, k: int, sel_ids: Optional[np.ndarray]):
+    index, spec = shard.index, shard.spec
+    if sel_ids is None:
+        return index.search(qvs, min(k, int(index.ntotal)))
+
+    k = min(k, int(sel_ids.size))
+    if spec.kind == "hnsw" and sel_ids.size <= EXACT_FILTER_MAX:
+        # Seçici filtrede graf araması aday bulamaz; seçili vektörler doğrudan skorlanır
+        scores = qvs @ index.reconstruct_batch(sel_ids).T
+        top = np.argsort(-scores, axis=1)[:, :k]
+        return np.take_along_axis(scores, top, axis=1), sel_ids[top]
+    bitmap = _id_bitmap(sel_ids)
+    sel = faiss.IDSelectorBitmap(bitmap.size, faiss.swig_ptr(bitmap))
+    params = _filtered_params(index, spec, sel, sel_ids.size / max(int(index.ntotal), 1), k)
+    return index.search(qvs, k, params=params)
+
+def _merge_hits(parts_d: list, parts_i: list, k: int, nq: int) -> list[list[tuple[int, float]]]:
+    if not parts_d:
+        return [[] for _ in range(nq)]
+    D, I = np.concatenate(parts_d, axis=1), np.concatenate(parts_i, axis=1)
+    out = []
+    for d_row, i_row in zip(D, I):
+        # Shard sonuçları birleştirilip skorla tekrar top-k seçilir
+        best: dict[int, float] = {}
+        for vid, score in zip(i_row.tolist(), d_row.tolist()):
+            if vid >= 0 and score > best.get(vid, -np.inf):
+                best[vid] = score
+        out.append(sorted(best.items(), key=lambda x: -x[1])[:k])
+    return out
+
+def _as_queries(qvs: np.ndarray) -> np.ndarray:
+    qvs = np.asarray(qvs, dtype="float32")
+    return np.ascontiguousarray(qvs[None, :] if qvs.ndim == 1 else qvs)
+
+def vector_search_many(
+    qvs: np.ndarray,
+    k: int,
+    category: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    candidates: Optional[np.ndarray] = None,
+) -> list[list[tuple[int, float]]]:
+    """
+    Birden çok sorgu vektörü shard başına tek index.search çağrısıyla aranır;
+    sorgu başına (vocab_id, skor) listesi döner. Tarih aralığı dışındaki aylık
+    shard'lara hiç bakılmaz; kategori ve aday anahtarlar (örn. SQL'den gelen,
+    aralıkta kalemi olan vocab_id'ler) id seçicisine çevrilir. Aynı anahtar
+    birden çok ayda bulunur; en yüksek skoru alınır.
+    """
+    qvs = _as_queries(qvs)
+    if qvs.shape[0] == 0:
+        return []
+    # İndeks ve meta aynı sürümden; arama sürerken yeni sürüm yayınlansa da bu handle geçerli kalır
+    handle = get_index_manager().current()
+    if handle is None:
+        return [[] for _ in range(qvs.shape[0])]
+    meta = handle.meta
+    if candidates is not None:
+        candidates = np.unique(np.asarray(candidates, dtype="int64"))
+
+    parts_d, parts_i = [], []
+    for name in route_shards(handle.shards, date_from, date_to):
+        shard = handle.shards[name]
+        sel_ids = meta.select(shard.rows, category, candidates)
+        if sel_ids is not None and sel_ids.size == 0:
+            continue
+        D, I = _search_shard(shard, qvs, k, sel_ids)
+        parts_d.append(D)
+        parts_i.append(I)
+    return _merge_hits(parts_d, parts_i, k, qvs.shape[0])
+
+def level_search_many(
+    level: str,
+    qvs: np.ndarray,
+    k: int,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    candidates: Optional[np.ndarray] = None,
+) -> list[list[tuple[int, float]]]:
+    """
+    Fiş (receipt_vectors.vec_id) ya da işyeri (merchants.id) düzeyinde arama;
+    sorgu başına (id, skor) listesi. Fiş düzeyi ay shard'larına göre route
+    edilir; kategori/tarih koşulları candidates ile (SQL'den) gelir.
+    """
+    qvs = _as_queries(qvs)
+    if qvs.shape[0] == 0:
+        return []
+    handle = get_index_manager().current()
+    shards = (handle.levels.get(level) or {}) if handle is not None else {}
+    if candidates is not None:
+        candidates = np.unique(np.asarray(candidates, dtype="int64"))
+        if candidates.size == 0:
+            return [[] for _ in range(qvs.shape[0])]
+    names = route_shards(shards, date_from, date_to) if level == LEVEL_RECEIPT else sorted(shards)
+
+    parts_d, parts_i = [], []
+    for name in names:
+        shard, sel_ids = shards[name], candidates
+        if sel_ids is not None and shard.spec.kind == "hnsw":
+            # Adaylar tüm shard'lar için ortak; tam skorlama sadece bu shard'dakilerle yapılabilir
+            sel_ids = sel_ids[np.isin(sel_ids, index_ids(shard.index))]
+            if sel_ids.size == 0:
+                continue
+        D, I = _search_shard(shard, qvs, k, sel_ids)
+        parts_d.append(D)
+        parts_i.append(I)
+    return _merge_hits(parts_d, parts_i, k, qvs.shape[0])
+
+def vector_search(
+    qv: np.ndarray,
+    k: int,
+    category: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    candidates: Optional[np.ndarray] = None,
+) -> list[tuple[int, float]]:
+    """
+    Sorgu vektörü için (vocab_id, skor) listesi. Filtreler aramadan önce id
+    seçicisine çevrilir; top-k sadece filtreye uyan anahtarlar arasından
+    hesaplanır.
+    """
+    qv = np.asarray(qv, dtype="float32").reshape(1, -1)
+    return vector_search_many(qv, k, category, date_from, date_to, candidates)[0]
 
 def main():
     q = input("Soru/arama: ").strip()
@@ -24,19 +168,22 @@ def main():
         print("EMPTY_QUERY")
         return
 
-    index = faiss.read_index(str(INDEX_PATH))
-    metas = load_meta()
-
-    model = SentenceTransformer(EMB_MODEL_NAME)
-    qv = model.encode([q], normalize_embeddings=True)
-    qv = np.asarray(qv, dtype="float32")
+    qv = get_embedder().encode([q])
+    hits = vector_search(qv, 5)
 
-    D, I = index.search(qv, 5)
+    conn = connect()
+    docs = fetch_docs(conn, [vid for vid, _ in hits])
+    counts = dict(conn.execute(
+        f"SELECT vocab_id, COUNT(*) FROM items WHERE vocab_id IN ({','.join('?' * len(hits))}) GROUP BY vocab_id",
+        [vid for vid, _ in hits],
+    ).fetchall()) if hits else {}
+    conn.close()
 
-    for rank, (score, idx) in enumerate(zip(D[0], I[0]), start=1):
-        m = metas[idx]
-        print(f"\n#{rank} score={score:.4f}")
-        print(m["doc"])
+    for rank, (vid, score) in enumerate(hits, start=1):
+        if vid not in docs:
+            continue
+        print(f"\n#{rank} score={score:.4f} items={counts.get(vid, 0)}")
+        print(docs[vid])
 
 if __name__ == "__main__":
     main()
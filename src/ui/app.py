@@ -17,9 +17,10 @@ if str(root_path) not in sys.path:
     sys.path.append(str(root_path))
 
 from src.db import connect
-from src.assistant import answer_from_rag, answer_from_reports, is_report_question
+from src.assistant import answer
 from src.ingest_pdf import ingest_one
 from src.analysis import get_subscriptions, check_budget_alerts
+from src.product_dictionary import record_user_correction
 
 # --- Page Config ---
 st.set_page_config(
@@ -136,6 +137,8 @@ if "messages" not in st.session_state:
     })
 
 DB_PATH = Path("data/spendrag.sqlite")
+# Cevabın nasıl üretildiği (assistant.Answer.mode)
+MODE_CAPTIONS = {"template": "⚡ Şablon cevap", "llm": "🧠 LLM cevabı"}
 INBOX_DIR = Path("data/inbox")
 INBOX_DIR.mkdir(parents=True, exist_ok=True)
 
@@ -186,8 +189,10 @@ def load_data():
         return pd.DataFrame()
     conn = connect()
     query = """
-    SELECT r.receipt_date, r.merchant, i.name_raw, i.name_norm, i.category, i.qty, i.amount
+    SELECT r.receipt_date, r.merchant_id, COALESCE(m.canonical_name, r.merchant) AS merchant,
+           i.name_raw, i.name_norm, i.category, i.qty, i.amount
     FROM items i JOIN receipts r ON r.id = i.receipt_id
+    LEFT JOIN merchants m ON m.id = r.merchant_id
     WHERE r.receipt_date IS NOT NULL
     """
     df = pd.read_sql_query(query, conn)
@@ -245,11 +250,15 @@ with st.sidebar:
 if selected_page == "💬 Sohbet Asistanı":
     st.title("💡 Akıllı Harcama Asistanı")
     st.caption("Verileriniz üzerinden doğal dille sorgulama yapın.")
+    # Sayısal sorular (kaç kez/adet/litre, aylık toplam) varsayılan olarak şablonla anında cevaplanır
+    use_llm = st.toggle("Serbest anlatım (LLM)", value=False, help="Sayısal sorularda da cevabı 7B model yazar (10-30 sn).")
     
     for msg in st.session_state.messages:
         avatar = "🤖" if msg["role"] == "assistant" else "👤"
         with st.chat_message(msg["role"], avatar=avatar):
             st.markdown(msg["content"])
+            if msg.get("mode") in MODE_CAPTIONS:
+                st.caption(MODE_CAPTIONS[msg["mode"]])
             
     if prompt := st.chat_input("Harcamalarınla ilgili sor..."):
         st.session_state.messages.append({"role": "user", "content": prompt})
@@ -257,17 +266,18 @@ if selected_page == "💬 Sohbet Asistanı":
             st.markdown(prompt)
             
         with st.chat_message("assistant", avatar="🤖"):
-            with st.spinner("🧠 Düşünüyorum... (7B model, 10-30 saniye sürebilir)"):
+            with st.spinner("🧠 Düşünüyorum..."):
+                mode = None
                 try:
-                    if is_report_question(prompt) and (Path("data/reports/monthly_total.csv").exists()):
-                        response = answer_from_reports(prompt)
-                    else:
-                        response = answer_from_rag(prompt)
+                    ans = answer(prompt, mode="llm" if use_llm else None)
+                    response, mode = ans.text, ans.mode
                 except Exception as e:
                     response = f"Bir hata oluştu: {e}"
                 
                 st.markdown(response)
-                st.session_state.messages.append({"role": "assistant", "content": response})
+                if mode in MODE_CAPTIONS:
+                    st.caption(MODE_CAPTIONS[mode])
+                st.session_state.messages.append({"role": "assistant", "content": response, "mode": mode})
 
 elif selected_page == "📊 Finansal Özet":
     st.title("📊 Finansal Genel Bakış")
@@ -278,7 +288,7 @@ elif selected_page == "📊 Finansal Özet":
     else:
         # Top Metrics Row
         total_spent = df["amount"].sum()
-        unique_merchants = df["merchant"].nunique()
+        unique_merchants = df["merchant_id"].fillna(df["merchant"]).nunique()
         top_category_name = df.groupby("category")["amount"].sum().idxmax()
         
         m1, m2, m3 = st.columns(3)
@@ -615,6 +625,8 @@ elif selected_page == "📝 Veri İnceleme":
     if st.button("💾 Değişiklikleri Kaydet", type="primary"):
         cursor = conn.cursor()
         try:
+            # Elle düzeltilen ad/kategoriler ürün sözlüğüne yazılır (kNN için etiket olur)
+            orig = {r["id"]: (r["name_norm"], r["category"]) for _, r in df_items.iterrows()}
             # Basit update döngüsü
             for index, row in edited_df.iterrows():
                 # receipt_date ve merchant aslında receipts tablosunda ama burada basitleştirilmiş view kullanıyoruz.
@@ -626,7 +638,10 @@ elif selected_page == "📝 Veri İnceleme":
                     SET name_norm=?, category=?, amount=?, qty=?, unit=?
                     WHERE id=?
                 """, (row["name_norm"], row["category"], row["amount"], row["qty"], row["unit"], row["id"]))
-                
+                if row["id"] in orig and (row["name_norm"], row["category"]) != orig[row["id"]]:
+                    cursor.execute("UPDATE items SET category_source='user' WHERE id=?", (row["id"],))
+                    record_user_correction(conn, row["id"], row["name_norm"], row["category"])
+
                 # Eğer tarih değişikliği isteniyorsa receipts tablosuna gitmeliyiz (İLERİ SEVİYE)
                 # Şimdilik pas geçiyoruz.
             conn.commit()